@@ -0,0 +1,552 @@
+import argparse
+import datetime
+import functools
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+# 与CDK堆栈共用的路由规则模块（pgpool_aurora_cdk/pgpool_aurora_cdk）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pgpool_aurora_cdk'))
+from pgpool_aurora_cdk.agents.pgpool_conf import format_value
+from pgpool_aurora_cdk.routing import WRITE_FUNCTIONS, routing_settings
+
+# 离线分析SQL负载，生成pgpool的读写路由规则：
+# 逐行读取语句日志（本地文件或CloudWatch Logs），按会话跟踪事务和最近写入的表，
+# 把语句分为读、写和事务控制，把读语句调用的函数分为只读和写入（只有已知只读的内置函数、--read-only-function
+# 指定的函数和pg_proc中非VOLATILE的函数视为只读，其余函数都视为写入），
+# 估算当前配置和生成规则后可分流到读取实例的比例，并输出供CDK堆栈渲染的routing_rules JSON：
+#   read_only_function_list / write_function_list：函数列表（二者只能设置一个）
+#   primary_routing_query_pattern_list：写入后很快读取同一张表的查询（读取实例可能尚未复制），固定发往写入实例
+#   disable_load_balance_on_write：事务内写入后的读语句路由方式
+# 会话、查询指纹和函数都有数量上限，内存占用与日志大小无关。
+#
+# 支持两种日志格式：
+#   pgpool日志（log_line_prefix = '%t: pid %p: '，logging_profile=debug时记录每条语句），
+#     pid为pgpool子进程，即一个客户端会话，读后写检测最准确
+#   Aurora postgresql日志（默认log_line_prefix '%t:%r:%u@%d:[%p]:'，需要记录全部语句），
+#     pid为后端进程；经pgpool分流后同一客户端会话的读写分布在不同实例上，读后写只能在同一实例内检测
+
+# 记录首行：时间戳、pid、级别和消息；其余行是上一条记录的续行（多行SQL）
+RECORD_START = re.compile(
+    r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(\.\d+)?(?: [A-Za-z]+)?:(?: pid (\d+):|.*?\[(\d+)\]:) ?([A-Z]+\d?):\s+(.*)$'
+)
+# LOG:  statement: ...、LOG:  execute <unnamed>: ...，以及log_min_duration_statement的duration前缀
+STATEMENT = re.compile(r'^(?:duration: [\d.]+ ms\s+)?(?:statement|execute [^:]*): (.*)$', re.S)
+DISCONNECTION = 'disconnection: session time'
+# 单条记录最多保留的字符数，超长的语句只按开头部分分类
+MAX_RECORD_CHARS = 65536
+
+# 字符串、美元引用和注释一次扫描，避免字符串中的--或引号干扰
+LITERALS = re.compile(
+    r"(?P<string>(?:[eEbBxXnN]|[uU]&)?'(?:[^']|'')*')"
+    r"|(?P<dollar>\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$)"
+    r"|(?P<comment>/\*.*?\*/|--[^\n]*)",
+    re.S
+)
+PARAMETERS = re.compile(r'\$\d+')
+NUMBERS = re.compile(r'(?<![\w$])\d+(?:\.\d+)?(?:e[+-]?\d+)?')
+IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+READ_COMMANDS = ('select', 'with', 'values', 'table', 'show', 'explain')
+TRANSACTION_START = re.compile(r'^(?:begin|start\s+transaction)\b')
+TRANSACTION_END = re.compile(r'^(?:commit|end|abort|rollback)\b(?!\s+to\b)(?!\s+prepared\b)')
+# 发往所有后端或与读写路由无关的命令
+OTHER_COMMANDS = ('set', 'reset', 'savepoint', 'release', 'rollback', 'discard', 'deallocate', 'prepare',
+                  'declare', 'fetch', 'move', 'close', 'listen', 'unlisten', 'load')
+# 读命令中的写入：行锁、SELECT INTO和写入型CTE
+WRITING_READ = re.compile(
+    r'\bfor\s+(?:no\s+key\s+)?(?:update|share|key\s+share)\b'
+    r'|\b(?:insert|update|delete|merge)\b'
+    r'|^select\b(?:(?!\bfrom\b).)*\binto\b'
+)
+READ_TABLES = re.compile(r'\b(?:from|join)\s+(?:only\s+)?([a-z_"][\w."$]*)')
+WRITE_TABLES = re.compile(
+    r'\b(?:insert\s+into|(?<!for )(?<!key )update|delete\s+from|merge\s+into|truncate(?:\s+table)?|copy)'
+    r'\s+(?:only\s+)?([a-z_"][\w."$]*)'
+)
+FUNCTION_CALLS = re.compile(r'(\bas\s+)?(?<![\w.:$"])((?:[a-z_][\w$]*\.)?[a-z_][\w$]*)\s*\(')
+# 后面可以跟括号的SQL关键字和类型名，不是函数调用
+NOT_FUNCTIONS = frozenset((
+    'select', 'from', 'where', 'and', 'or', 'not', 'in', 'exists', 'any', 'all', 'some', 'values', 'on',
+    'using', 'join', 'lateral', 'over', 'filter', 'within', 'group', 'by', 'order', 'partition', 'when',
+    'then', 'else', 'case', 'cast', 'row', 'array', 'with', 'into', 'union', 'intersect', 'except',
+    'distinct', 'is', 'like', 'ilike', 'between', 'limit', 'offset', 'returning', 'set', 'table', 'only',
+    'recursive', 'materialized', 'having', 'window', 'rows', 'range', 'tablesample', 'coalesce', 'nullif',
+    'greatest', 'least', 'interval', 'timestamp', 'date', 'time', 'numeric', 'decimal', 'varchar', 'char',
+    'character', 'int', 'integer', 'bigint', 'smallint', 'float', 'real', 'precision', 'boolean', 'text',
+    'collate', 'grouping', 'cube', 'rollup', 'sets', 'of', 'conflict', 'do', 'if', 'explain', 'analyze', 'as',
+))
+# 常用的非volatile内置函数；函数列表为空时pgpool按pg_proc的volatility判断，
+# 其余函数（包括默认为VOLATILE的自定义函数）视为写入。用于估算当前配置的分流比例，
+# 也是生成规则时默认视为只读的函数
+STABLE_BUILTINS = frozenset((
+    'count', 'sum', 'avg', 'min', 'max', 'array_agg', 'string_agg', 'json_agg', 'jsonb_agg', 'bool_and',
+    'bool_or', 'lower', 'upper', 'length', 'substring', 'substr', 'trim', 'btrim', 'ltrim', 'rtrim',
+    'position', 'replace', 'split_part', 'concat', 'concat_ws', 'left', 'right', 'lpad', 'rpad', 'format',
+    'now', 'date_trunc', 'date_part', 'extract', 'to_char', 'to_date', 'to_timestamp', 'to_number', 'age',
+    'abs', 'round', 'floor', 'ceil', 'ceiling', 'mod', 'power', 'sqrt', 'row_number', 'rank',
+    'dense_rank', 'lag', 'lead', 'first_value', 'last_value', 'ntile', 'unnest', 'generate_series',
+    'array_length', 'cardinality', 'json_build_object', 'jsonb_build_object', 'json_build_array',
+    'jsonb_build_array', 'jsonb_array_elements', 'json_array_elements', 'jsonb_extract_path_text',
+    'to_json', 'to_jsonb', 'md5', 'encode', 'decode', 'current_setting', 'version',
+))
+# pg_proc.provolatile：i（IMMUTABLE）和s（STABLE）不会写入
+NON_VOLATILE = frozenset('is')
+# 导出函数volatility的查询，输出供--function-volatility读取
+FUNCTION_VOLATILITY_QUERY = (
+    "SELECT n.nspname || '.' || p.proname, p.provolatile FROM pg_proc p "
+    "JOIN pg_namespace n ON n.oid = p.pronamespace WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')"
+)
+# POSIX扩展正则中需要转义的字符
+PATTERN_SPECIAL = re.compile(r'([.\[\]{}()\\*+?^$|])')
+
+DEFAULT_MAX_SESSIONS = 10000
+DEFAULT_MAX_FINGERPRINTS = 20000
+MAX_FUNCTIONS = 10000
+MAX_SESSION_TABLES = 256
+CLOUDWATCH_FILTER = '?"statement: " ?"execute " ?"disconnection: "'
+
+
+class BoundedCounter:
+    # 有上限的计数表：超过上限时丢弃计数最小的一半条目，被丢弃的计数记入dropped
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.fields = fields
+        self.entries = {}
+        self.dropped = 0
+
+    def add(self, key, *values):
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= self.capacity:
+                self._prune()
+            entry = self.entries[key] = [0] * self.fields
+        for i, value in enumerate(values):
+            entry[i] += value
+        return entry
+
+    def _prune(self):
+        ranked = sorted(self.entries.items(), key=lambda item: item[1][0])
+        for key, entry in ranked[:len(ranked) // 2]:
+            self.dropped += entry[0]
+            del self.entries[key]
+
+
+class Session:
+    __slots__ = ('in_transaction', 'transaction_wrote', 'transaction_tables', 'recent_writes')
+
+    def __init__(self):
+        self.in_transaction = False
+        self.transaction_wrote = False
+        self.transaction_tables = set()
+        # 事务外写入的表及写入时间，用于检测读后写
+        self.recent_writes = {}
+
+
+@functools.lru_cache(maxsize=8)
+def epoch_seconds(stamp):
+    # 同一秒内的记录共用一次解析
+    return datetime.datetime.strptime(stamp, '%Y-%m-%d %H:%M:%S').replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+def read_records(lines):
+    # (来源, 行) -> (来源, 时间, pid, 级别, 消息)，续行拼接到上一条记录
+    current = None
+    for source, line in lines:
+        line = line.rstrip('\r\n')
+        match = RECORD_START.match(line)
+        if match:
+            if current:
+                yield current[0], current[1], current[2], current[3], '\n'.join(current[4])
+            stamp, fraction, pgpool_pid, aurora_pid, level, message = match.groups()
+            seconds = epoch_seconds(stamp) + (float(fraction) if fraction else 0)
+            current = [source, seconds, pgpool_pid or aurora_pid, level, [message], len(message)]
+        elif current is not None and current[5] < MAX_RECORD_CHARS:
+            current[4].append(line)
+            current[5] += len(line) + 1
+    if current:
+        yield current[0], current[1], current[2], current[3], '\n'.join(current[4])
+
+
+def fingerprint(sql):
+    # 去掉注释，常量和参数替换为?，IN列表合并，空白折叠，统一小写
+    def literal(match):
+        return ' ' if match.group('comment') else '?'
+
+    text = LITERALS.sub(literal, sql[:MAX_RECORD_CHARS]).lower()
+    text = PARAMETERS.sub('?', text)
+    text = NUMBERS.sub('?', text)
+    text = IN_LISTS.sub('(?)', text)
+    return WHITESPACE.sub(' ', text).strip().rstrip(';').rstrip()
+
+
+def classify(text):
+    if TRANSACTION_START.match(text):
+        return 'begin'
+    if TRANSACTION_END.match(text):
+        return 'end'
+    command = text.lstrip('(').split(' ', 1)[0].split('(', 1)[0]
+    if command in READ_COMMANDS:
+        return 'write' if WRITING_READ.search(text) else 'read'
+    if command in OTHER_COMMANDS or not command:
+        return 'other'
+    return 'write'
+
+
+def table_name(name):
+    return name.split('.')[-1].strip('"')
+
+
+def read_tables(text):
+    return {table_name(name) for name in READ_TABLES.findall(text)}
+
+
+def write_tables(text):
+    return {table_name(name) for name in WRITE_TABLES.findall(text)}
+
+
+def function_calls(text):
+    calls = set()
+    for alias, name in FUNCTION_CALLS.findall(text):
+        if not alias and name.split('.')[-1] not in NOT_FUNCTIONS:
+            calls.add(name)
+    return calls
+
+
+def load_function_volatility(lines):
+    # psql -At -c FUNCTION_VOLATILITY_QUERY的输出（schema.函数名|provolatile） -> 非VOLATILE的函数名集合；
+    # 不带schema调用的函数只有在所有同名函数都非VOLATILE时才计入
+    volatility = {}
+    for line in lines:
+        name, sep, kind = line.strip().rpartition('|')
+        if not sep or not name:
+            continue
+        name = name.lower()
+        for key in (name, name.split('.')[-1]):
+            volatility.setdefault(key, set()).add(kind.strip())
+    return frozenset(name for name, kinds in volatility.items() if kinds <= NON_VOLATILE)
+
+
+def function_writes(name, write_overrides=(), read_overrides=(), non_volatile=()):
+    # 无法确认只读的函数一律视为写入：发往读取实例的写入函数会执行失败
+    base = name.split('.')[-1]
+    if name in write_overrides or base in write_overrides:
+        return True
+    if name in read_overrides or base in read_overrides:
+        return False
+    if any(re.fullmatch(pattern, base) for pattern in WRITE_FUNCTIONS):
+        return True
+    # 内置函数不带schema或以pg_catalog调用，同名的自定义函数可能写入
+    if base in STABLE_BUILTINS and (name == base or name.startswith('pg_catalog.')):
+        return False
+    return name not in non_volatile
+
+
+def query_pattern(text):
+    # 指纹 -> 匹配同一查询的正则：?匹配任意常量，空白匹配任意空白
+    parts = [PATTERN_SPECIAL.sub(r'\\\1', part).replace(' ', r'\s+') for part in text.split('?')]
+    return '.+'.join(parts) + r'\s*;?'
+
+
+class WorkloadAnalyzer:
+    def __init__(self, lag_window=0.5, write_functions=(), read_only_functions=(), non_volatile_functions=(),
+                 max_sessions=DEFAULT_MAX_SESSIONS, max_fingerprints=DEFAULT_MAX_FINGERPRINTS):
+        self.lag_window = lag_window
+        self.write_overrides = frozenset(write_functions)
+        self.read_overrides = frozenset(read_only_functions)
+        self.non_volatile = frozenset(non_volatile_functions)
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        # 读语句指纹：[执行次数, 读后写次数, 生成规则后可分流次数(transaction), 可分流次数(dml_adaptive)]
+        self.fingerprints = BoundedCounter(max_fingerprints, 4)
+        # 函数：[调用语句数]
+        self.functions = BoundedCounter(MAX_FUNCTIONS, 1)
+        self.function_kinds = {}
+        # 指纹 -> (类型, 函数, 读取的表, 写入的表)，同一查询只解析一次
+        self.parsed = {}
+        self.counts = dict(records=0, statements=0, reads=0, writes=0, other=0, current_balanced=0,
+                           balanced=0, balanced_dml_adaptive=0, read_after_write=0)
+        self.sources = set()
+
+    def session(self, key):
+        session = self.sessions.get(key)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)
+            session = self.sessions[key] = Session()
+        else:
+            self.sessions.move_to_end(key)
+        return session
+
+    def feed(self, records):
+        for source, seconds, pid, level, message in records:
+            self.counts['records'] += 1
+            if level != 'LOG':
+                continue
+            if DISCONNECTION in message:
+                self.sessions.pop((source, pid), None)
+                continue
+            match = STATEMENT.match(message)
+            if match:
+                self.sources.add(source)
+                self.statement(self.session((source, pid)), seconds, match.group(1))
+
+    def function_is_writing(self, name):
+        kind = self.function_kinds.get(name)
+        if kind is None:
+            kind = function_writes(name, self.write_overrides, self.read_overrides, self.non_volatile)
+            if len(self.function_kinds) < MAX_FUNCTIONS:
+                self.function_kinds[name] = kind
+        return kind
+
+    def parse(self, text):
+        parsed = self.parsed.get(text)
+        if parsed is None:
+            if len(self.parsed) >= self.fingerprints.capacity:
+                self.parsed.clear()
+            kind = classify(text)
+            if kind == 'read':
+                parsed = (kind, function_calls(text), read_tables(text), None)
+            else:
+                parsed = (kind, None, None, write_tables(text) if kind == 'write' else None)
+            self.parsed[text] = parsed
+        return parsed
+
+    def statement(self, session, seconds, sql):
+        text = fingerprint(sql)
+        kind, calls, tables, written = self.parse(text)
+        self.counts['statements'] += 1
+        if kind == 'begin':
+            session.in_transaction = True
+            session.transaction_wrote = False
+            session.transaction_tables = set()
+            self.counts['other'] += 1
+            return
+        if kind == 'end':
+            session.in_transaction = False
+            session.transaction_tables = set()
+            self.counts['other'] += 1
+            return
+        if kind == 'other':
+            self.counts['other'] += 1
+            return
+
+        if kind == 'write':
+            self.counts['writes'] += 1
+            if session.in_transaction:
+                session.transaction_wrote = True
+                if len(session.transaction_tables) < MAX_SESSION_TABLES:
+                    session.transaction_tables.update(written)
+            else:
+                if len(session.recent_writes) >= MAX_SESSION_TABLES:
+                    session.recent_writes = {
+                        table: at for table, at in session.recent_writes.items() if seconds - at <= self.lag_window
+                    }
+                for table in written:
+                    session.recent_writes[table] = seconds
+            return
+
+        self.counts['reads'] += 1
+        for name in calls:
+            self.functions.add(name, 1)
+        after_write = session.in_transaction and session.transaction_wrote
+        # 事务内写入后读取的表与写入的表无关时dml_adaptive仍可分流；无法解析表名时按相关处理
+        related = after_write and (not tables or bool(tables & session.transaction_tables))
+        lagging = not session.in_transaction and any(
+            seconds - session.recent_writes.get(table, float('-inf')) <= self.lag_window for table in tables
+        )
+        # 当前配置：事务内写入后的读语句和调用volatile函数的读语句发往写入实例
+        volatile = any(name.split('.')[-1] not in STABLE_BUILTINS for name in calls)
+        if not after_write and not volatile:
+            self.counts['current_balanced'] += 1
+        # 生成规则后：只有调用写入函数的读语句发往写入实例（读后写模式在汇总时扣除）
+        writing = any(self.function_is_writing(name) for name in calls)
+        balanced = not writing and not after_write
+        balanced_dml_adaptive = not writing and not related
+        self.counts['balanced'] += balanced
+        self.counts['balanced_dml_adaptive'] += balanced_dml_adaptive
+        self.counts['read_after_write'] += lagging
+        self.fingerprints.add(text, 1, int(lagging), int(balanced), int(balanced_dml_adaptive))
+
+    def rules(self, function_list='read_only', dml_adaptive=False, min_read_after_write=0.05, max_patterns=100):
+        # 读后写占执行次数的比例达到min_read_after_write的查询固定发往写入实例；
+        # 偶尔读后写的查询固定下来会损失大部分分流，只在报告中列出
+        lagging = sorted(
+            ((text, entry) for text, entry in self.fingerprints.entries.items()
+             if entry[1] and entry[1] >= min_read_after_write * entry[0]),
+            key=lambda item: item[1][1], reverse=True
+        )
+        selected = lagging[:max_patterns]
+        names = sorted(self.functions.entries)
+        if function_list == 'read_only':
+            functions = {'read_only_function_list': [
+                PATTERN_SPECIAL.sub(r'\\\1', name) for name in names if not self.function_is_writing(name)
+            ]}
+        else:
+            # write_function_list替代pgpool的volatility检查，内置的写入函数总是列出
+            observed = [PATTERN_SPECIAL.sub(r'\\\1', name) for name in names if self.function_is_writing(name)
+                        and not any(re.fullmatch(pattern, name.split('.')[-1]) for pattern in WRITE_FUNCTIONS)]
+            functions = {'write_function_list': list(WRITE_FUNCTIONS) + observed}
+        rules = dict(functions)
+        rules['primary_routing_query_pattern_list'] = [query_pattern(text) for text, _ in selected]
+        rules['disable_load_balance_on_write'] = 'dml_adaptive' if dml_adaptive else 'transaction'
+        occasional = sum(1 for entry in self.fingerprints.entries.values() if 0 < entry[1] < min_read_after_write * entry[0])
+        return rules, selected, lagging[max_patterns:], occasional
+
+
+def file_lines(paths):
+    for path in paths:
+        if path == '-':
+            for line in sys.stdin:
+                yield path, line
+            continue
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                yield path, line
+
+
+def cloudwatch_lines(logs, log_group, start, end):
+    # 每个事件是一条完整记录（可能包含多行SQL），来源为日志流（每个实例一个）
+    paginator = logs.get_paginator('filter_log_events')
+    for page in paginator.paginate(logGroupName=log_group, startTime=int(start * 1000), endTime=int(end * 1000),
+                                   filterPattern=CLOUDWATCH_FILTER):
+        for event in page['events']:
+            for line in event['message'].split('\n'):
+                yield event['logStreamName'], line
+
+
+def parse_time(value):
+    moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+def percent(part, whole):
+    return f"{100.0 * part / whole:.1f}%" if whole else "-"
+
+
+def print_report(analyzer, rules, selected, skipped, occasional, readers, reader_weight, writer_weight):
+    counts = analyzer.counts
+    routed = counts['reads'] + counts['writes']
+    balanced_key = 'balanced_dml_adaptive' if rules['disable_load_balance_on_write'] == 'dml_adaptive' else 'balanced'
+    # 读后写模式的查询全部发往写入实例
+    pinned = sum(entry[3 if balanced_key == 'balanced_dml_adaptive' else 2] for _, entry in selected)
+    balanced = counts[balanced_key] - pinned
+    reader_share = readers * reader_weight / (readers * reader_weight + writer_weight) if readers else 0.0
+
+    print(f"记录数: {counts['records']}，来源: {len(analyzer.sources)}，语句数: {counts['statements']}")
+    print(f"  读: {counts['reads']}，写: {counts['writes']}，事务控制及其他: {counts['other']}")
+    print(f"当前配置可分流的读语句: {counts['current_balanced']} ({percent(counts['current_balanced'], routed)})")
+    print(f"生成规则后可分流的读语句: {balanced} ({percent(balanced, routed)})")
+    print(f"按权重（{readers}个读取实例 × {reader_weight}，写入实例 {writer_weight}）估算发往读取实例的语句: "
+          f"当前 {percent(counts['current_balanced'] * reader_share, routed)}，"
+          f"生成规则后 {percent(balanced * reader_share, routed)}")
+    if rules['disable_load_balance_on_write'] == 'transaction' and counts['balanced_dml_adaptive'] > counts['balanced']:
+        gain = counts['balanced_dml_adaptive'] - counts['balanced']
+        print(f"事务内写入后读取无关表的语句: {gain}，使用--dml-adaptive可分流")
+    print(f"读后写（{analyzer.lag_window}秒内读取本会话写入的表）: {counts['read_after_write']}次，"
+          f"固定发往写入实例的查询模式: {len(selected)}个")
+    if skipped:
+        print(f"  另有{len(skipped)}个读后写查询超过--max-patterns未列出")
+    if occasional:
+        print(f"  另有{occasional}个查询偶尔读后写（低于--min-read-after-write），仍可分流，可能读到复制延迟前的数据")
+    writing = sorted(name for name in analyzer.functions.entries if analyzer.function_is_writing(name))
+    print(f"读语句调用的函数: {len(analyzer.functions.entries)}个，其中写入: {', '.join(writing) or '无'}")
+    dropped = analyzer.fingerprints.dropped + analyzer.functions.dropped
+    if dropped:
+        print(f"超过指纹或函数数量上限，{dropped}次执行只计入总数")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析SQL负载，生成pgpool的读写路由规则")
+    parser.add_argument('--log-file', action='append', default=[], help="本地日志文件（.gz自动解压，-为标准输入），可重复")
+    parser.add_argument('--log-group', default=None, help="CloudWatch日志组，例如堆栈输出的PgpoolLogGroupName")
+    parser.add_argument('--cluster-id', default=None, help="Aurora集群标识符，读取/aws/rds/cluster/<id>/postgresql")
+    parser.add_argument('--region', default=None, help="CloudWatch日志所在区域")
+    parser.add_argument('--hours', type=float, default=24, help="读取最近多少小时的CloudWatch日志")
+    parser.add_argument('--start', default=None, help="CloudWatch日志开始时间（ISO 8601，默认UTC）")
+    parser.add_argument('--end', default=None, help="CloudWatch日志结束时间（ISO 8601，默认当前时间）")
+    parser.add_argument('--function-list', choices=['read_only', 'write'], default='read_only',
+                        help="生成read_only_function_list（未列出的函数发往写入实例）或write_function_list")
+    parser.add_argument('--write-function', action='append', default=[], help="确定会写入的函数，可重复")
+    parser.add_argument('--read-only-function', action='append', default=[], help="确定只读的函数，可重复")
+    parser.add_argument('--function-volatility', default=None,
+                        help="函数volatility文件：psql -At -c \"<查询>\"的输出，查询见FUNCTION_VOLATILITY_QUERY；"
+                             "其中非VOLATILE的函数视为只读")
+    parser.add_argument('--lag-window', type=float, default=0.5, help="读后写检测窗口（秒），应大于读取实例的复制延迟")
+    parser.add_argument('--min-read-after-write', type=float, default=0.05, help="读后写占查询执行次数的比例达到多少时固定发往写入实例")
+    parser.add_argument('--max-patterns', type=int, default=100, help="primary_routing_query_pattern_list的最大条目数")
+    parser.add_argument('--dml-adaptive', action='store_true', help="disable_load_balance_on_write使用dml_adaptive")
+    parser.add_argument('--max-sessions', type=int, default=DEFAULT_MAX_SESSIONS, help="同时跟踪的会话数上限")
+    parser.add_argument('--max-fingerprints', type=int, default=DEFAULT_MAX_FINGERPRINTS, help="跟踪的查询指纹数上限")
+    parser.add_argument('--readers', type=int, default=1, help="读取实例数，用于估算发往读取实例的比例")
+    parser.add_argument('--reader-weight', type=int, default=10, help="读取实例权重")
+    parser.add_argument('--writer-weight', type=int, default=1, help="写入实例权重")
+    parser.add_argument('--output', default='routing_rules.json', help="路由规则输出文件")
+    args = parser.parse_args()
+
+    if bool(args.log_file) == bool(args.log_group or args.cluster_id):
+        parser.error("需要指定--log-file，或--log-group/--cluster-id之一")
+    if args.log_group and args.cluster_id:
+        parser.error("--log-group和--cluster-id只能指定一个")
+
+    if args.log_file:
+        lines = file_lines(args.log_file)
+    else:
+        import boto3
+        log_group = args.log_group or f"/aws/rds/cluster/{args.cluster_id}/postgresql"
+        end = parse_time(args.end) if args.end else time.time()
+        start = parse_time(args.start) if args.start else end - args.hours * 3600
+        print(f"读取CloudWatch日志组 {log_group}...")
+        lines = cloudwatch_lines(boto3.client('logs', region_name=args.region), log_group, start, end)
+
+    non_volatile = frozenset()
+    if args.function_volatility:
+        with open(args.function_volatility) as f:
+            non_volatile = load_function_volatility(f)
+
+    analyzer = WorkloadAnalyzer(
+        lag_window=args.lag_window,
+        write_functions=args.write_function,
+        read_only_functions=args.read_only_function,
+        non_volatile_functions=non_volatile,
+        max_sessions=args.max_sessions,
+        max_fingerprints=args.max_fingerprints,
+    )
+    try:
+        analyzer.feed(read_records(lines))
+    except Exception as e:
+        print(f"读取日志失败: {e}")
+        sys.exit(1)
+    if not analyzer.counts['statements']:
+        print("日志中没有语句记录：pgpool日志需要logging_profile=debug，Aurora日志需要记录全部语句")
+        sys.exit(1)
+
+    rules, selected, skipped, occasional = analyzer.rules(
+        function_list=args.function_list,
+        dml_adaptive=args.dml_adaptive,
+        min_read_after_write=args.min_read_after_write,
+        max_patterns=args.max_patterns,
+    )
+    print_report(analyzer, rules, selected, skipped, occasional, args.readers, args.reader_weight, args.writer_weight)
+
+    # 与CDK堆栈相同的校验和渲染
+    settings = routing_settings(rules)
+    with open(args.output, 'w') as f:
+        json.dump(rules, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+    print(f"路由规则已写入 {args.output}（部署时使用-c routing_rules={args.output}），pgpool.conf中为:")
+    for key, value in settings.items():
+        print(f"  {key} = {format_value(value)}")
+
+
+if __name__ == '__main__':
+    main()
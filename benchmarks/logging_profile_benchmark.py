@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from pgbench_benchmark import WORKLOADS, run_pgbench
+
+# 与CDK堆栈共用的日志配置和pgpool.conf处理模块（pgpool_aurora_cdk/pgpool_aurora_cdk）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pgpool_aurora_cdk'))
+from pgpool_aurora_cdk.agents.configure import DEFAULT_PGPOOL_CONF
+from pgpool_aurora_cdk.agents.pgpool_conf import apply_settings, read_conf, write_conf
+from pgpool_aurora_cdk.logging_profiles import LOGGING_PROFILES, logging_settings
+
+
+# 对比pgpool日志配置（debug/standard/production）的吞吐：在pgpool所在主机上依次把每个配置
+# 写入pgpool.conf并重启pgpool，用pgbench_benchmark的同一套参数压测，记录TPS、p95延迟和
+# 压测期间写入的日志量。结束后恢复原来的pgpool.conf。需要root权限（写pgpool.conf、重启pgpool）。
+
+
+def log_bytes(log_dir):
+    total = 0
+    for name in os.listdir(log_dir):
+        path = os.path.join(log_dir, name)
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def apply_profile(pgpool_conf, original, profile, restart_command, settle, run, sleep=time.sleep):
+    write_conf(pgpool_conf, apply_settings(original, logging_settings(profile)))
+    result = run(restart_command, shell=True, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"重启pgpool失败（{profile}）: {result.stderr.strip()}")
+    # 等待pgpool子进程就绪
+    sleep(settle)
+
+
+def benchmark_profile(args, profile, run):
+    results = []
+    before = log_bytes(args.log_dir)
+    for count in args.client_counts:
+        print(f"  {count}个客户端，{args.duration}秒...")
+        results.append(run_pgbench(args, count, run))
+    return {
+        'profile': profile,
+        'settings': logging_settings(profile),
+        'log_bytes': log_bytes(args.log_dir) - before,
+        'runs': results,
+    }
+
+
+def print_table(profiles):
+    counts = [r['clients'] for r in profiles[0]['runs']]
+    print(f"{'日志配置':<12}" + ''.join(f"{f'TPS@{c}':>12}" for c in counts) + f"{'p95(ms)':>10}{'日志(KB)':>12}")
+    for p in profiles:
+        last = p['runs'][-1]
+        print(f"{p['profile']:<14}" + ''.join(f"{r.get('tps', 0):>12.1f}" for r in p['runs'])
+              + f"{last.get('latency_p95_ms') or 0:>11.2f}{p['log_bytes'] / 1024:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="依次切换pgpool日志配置并运行pgbench，对比各配置的TPS")
+    parser.add_argument('--host', default='127.0.0.1', help="pgpool地址，默认本机")
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--dbname', default='postgres')
+    parser.add_argument('--profiles', default=','.join(LOGGING_PROFILES), help="逗号分隔的日志配置")
+    parser.add_argument('--clients', default='32,128', help="逗号分隔的客户端数")
+    parser.add_argument('--duration', type=int, default=60, help="每个客户端数的压测时长（秒）")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="pgbench线程数上限")
+    parser.add_argument('--workload', choices=sorted(WORKLOADS) + ['mix'], default='select-only')
+    parser.add_argument('--read-ratio', type=float, default=0.9, help="mix负载中只读事务的比例")
+    parser.add_argument('--script', default=None, help="自定义pgbench脚本，指定后忽略--workload")
+    parser.add_argument('--protocol', choices=['simple', 'extended', 'prepared'], default='simple', help="pgbench -M")
+    parser.add_argument('--connect', action='store_true', help="每个事务新建连接（pgbench -C），放大连接日志的开销")
+    parser.add_argument('--sampling-rate', type=float, default=1.0, help="事务日志采样率，长时间压测时可降低")
+    parser.add_argument('--pgpool-conf', default=DEFAULT_PGPOOL_CONF)
+    parser.add_argument('--log-dir', default='/var/log/pgpool', help="pgpool日志目录，用于统计日志量")
+    parser.add_argument('--restart-command', default='systemctl restart pgpool', help="应用配置后执行的命令")
+    parser.add_argument('--settle', type=int, default=5, help="重启后等待的秒数")
+    parser.add_argument('--output', default=None, help="JSON报告路径")
+    args = parser.parse_args()
+    run = subprocess.run
+
+    profiles = args.profiles.split(',')
+    for profile in profiles:
+        if profile not in LOGGING_PROFILES:
+            parser.error(f"未知的日志配置 {profile}，可选 {', '.join(LOGGING_PROFILES)}")
+    args.client_counts = [int(c) for c in args.clients.split(',')]
+
+    original = read_conf(args.pgpool_conf)
+    report = {
+        'target': f"{args.host}:{args.port}/{args.dbname}",
+        'workload': os.path.basename(args.script) if args.script else args.workload,
+        'protocol': args.protocol,
+        'connect_per_transaction': args.connect,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'profiles': [],
+    }
+    try:
+        for profile in profiles:
+            print(f"日志配置 {profile}：")
+            apply_profile(args.pgpool_conf, original, profile, args.restart_command, args.settle, run)
+            report['profiles'].append(benchmark_profile(args, profile, run))
+    except (OSError, RuntimeError) as e:
+        print(f"压测失败: {e}")
+        sys.exit(1)
+    finally:
+        # 恢复原来的pgpool.conf
+        write_conf(args.pgpool_conf, original)
+        run(args.restart_command, shell=True)
+
+    print_table(report['profiles'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"报告已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
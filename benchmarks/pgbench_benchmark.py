@@ -0,0 +1,313 @@
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+# 与CDK堆栈共用的实例元数据模块（pgpool_aurora_cdk/pgpool_aurora_cdk）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pgpool_aurora_cdk'))
+from pgpool_aurora_cdk.agents.imds import availability_zone
+
+# 用pgbench对pgpool配置做可复现的压测：对目标端点（PgpoolAuroraStack输出的NLB地址，
+# 或本地pgpool + PostgreSQL）按客户端数逐级压测，记录TPS、p50/p95/p99延迟、连接建立时间，
+# 以及通过SHOW POOL_NODES得到的各后端select_cnt增量，输出可对比的JSON/CSV报告。
+# 数据库密码通过PGPASSWORD或~/.pgpass提供，不出现在命令行中。
+
+WORKLOADS = {
+    'select-only': ['-b', 'select-only'],
+    'tpcb-like': ['-b', 'tpcb-like'],
+    'simple-update': ['-b', 'simple-update'],
+}
+
+CSV_FIELDS = [
+    'label', 'workload', 'clients', 'duration', 'transactions', 'failed', 'tps',
+    'latency_avg_ms', 'latency_p50_ms', 'latency_p95_ms', 'latency_p99_ms', 'connection_time_ms', 'select_cnt',
+]
+
+
+def workload_args(args):
+    if args.script:
+        return ['-f', args.script]
+    if args.workload == 'mix':
+        # 读写混合：按read-ratio给select-only和tpcb-like分配权重
+        read_weight = round(args.read_ratio * 100)
+        return ['-b', f'select-only@{read_weight}', '-b', f'tpcb-like@{100 - read_weight}']
+    return list(WORKLOADS[args.workload])
+
+
+def connection_args(args):
+    return ['-h', args.host, '-p', str(args.port), '-U', args.user]
+
+
+def parse_pgbench_output(text):
+    result = {}
+    patterns = {
+        'transactions': r'number of transactions actually processed: (\d+)',
+        'failed': r'number of failed transactions: (\d+)',
+        'latency_avg_ms': r'latency average = ([\d.]+) ms',
+        # pgbench 14+：initial connection time；-C模式下为average connection time
+        'connection_time_ms': r'(?:initial|average) connection time = ([\d.]+) ms',
+        # pgbench 14+为without initial connection time，旧版本为excluding connections establishing
+        'tps': r'tps = ([\d.]+) \((?:without initial connection time|excluding connections establishing)\)',
+    }
+    for key, pattern in patterns.items():
+        match = re.search(pattern, text)
+        if match:
+            value = match.group(1)
+            result[key] = float(value) if '.' in value else int(value)
+    if 'tps' not in result:
+        match = re.search(r'tps = ([\d.]+)', text)
+        if match:
+            result['tps'] = float(match.group(1))
+    return result
+
+
+def read_latencies(log_prefix):
+    # pgbench --log每行：client_id transaction_no time script_no time_epoch time_us，time为微秒；
+    # 失败或跳过的事务time列为failed/skipped
+    latencies = []
+    for path in glob.glob(f"{log_prefix}.*"):
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3 and fields[2].isdigit():
+                    latencies.append(int(fields[2]) / 1000.0)
+    latencies.sort()
+    return latencies
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # 最近秩法
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return round(sorted_values[rank - 1], 3)
+
+
+def parse_pool_nodes(text):
+    # psql -A -F, 输出的SHOW POOL_NODES，返回 hostname:port -> select_cnt
+    lines = [line for line in text.splitlines() if line and not line.startswith('(')]
+    if not lines:
+        return {}
+    header = lines[0].split(',')
+    if 'select_cnt' not in header:
+        return {}
+    counts = {}
+    for line in lines[1:]:
+        row = dict(zip(header, line.split(',')))
+        if row.get('select_cnt', '').isdigit():
+            counts[f"{row['hostname']}:{row['port']}"] = int(row['select_cnt'])
+    return counts
+
+
+def pool_nodes(args, run):
+    # 直连PostgreSQL时没有SHOW POOL_NODES，返回None
+    result = run(
+        ['psql'] + connection_args(args) + ['-d', args.dbname, '-X', '-A', '-F', ',', '-c', 'SHOW POOL_NODES'],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return None
+    return parse_pool_nodes(result.stdout)
+
+
+def select_cnt_delta(before, after):
+    if before is None or after is None:
+        return None
+    return {node: count - before.get(node, 0) for node, count in sorted(after.items())}
+
+
+def run_pgbench(args, clients, run):
+    log_dir = tempfile.mkdtemp(prefix='pgbench-')
+    log_prefix = os.path.join(log_dir, 'pgbench_log')
+    command = ['pgbench'] + connection_args(args) + [
+        '-c', str(clients),
+        '-j', str(min(clients, args.jobs)),
+        '-T', str(args.duration),
+        '-M', args.protocol,
+        '-n',
+        '--log', f'--log-prefix={log_prefix}',
+    ]
+    if args.sampling_rate < 1:
+        command.append(f'--sampling-rate={args.sampling_rate}')
+    if args.connect:
+        # 每个事务新建连接，测量经NLB和pgpool的连接建立开销
+        command.append('-C')
+    command += workload_args(args) + [args.dbname]
+
+    before = pool_nodes(args, run)
+    result = run(command, capture_output=True, text=True)
+    after = pool_nodes(args, run)
+    if result.returncode != 0:
+        raise RuntimeError(f"pgbench失败（{clients}个客户端）: {result.stderr.strip()}")
+
+    summary = parse_pgbench_output(result.stdout)
+    latencies = read_latencies(log_prefix)
+    for path in glob.glob(f"{log_prefix}.*"):
+        os.remove(path)
+    os.rmdir(log_dir)
+    summary.update(
+        clients=clients,
+        duration=args.duration,
+        latency_p50_ms=percentile(latencies, 50),
+        latency_p95_ms=percentile(latencies, 95),
+        latency_p99_ms=percentile(latencies, 99),
+        select_cnt=select_cnt_delta(before, after),
+    )
+    return summary
+
+
+def client_az():
+    # 压测客户端所在的可用区（在EC2上运行时），用于对比AZ亲和与跨AZ路由的延迟
+    try:
+        return availability_zone()
+    except OSError:
+        return None
+
+
+def pgbench_version(run):
+    result = run(['pgbench', '--version'], capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+def write_reports(report, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    json_path = os.path.join(output_dir, 'report.json')
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    csv_path = os.path.join(output_dir, 'report.csv')
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for run_result in report['runs']:
+            row = dict(run_result, label=report['label'], workload=report['workload'])
+            if row.get('select_cnt') is not None:
+                row['select_cnt'] = ';'.join(f"{node}={count}" for node, count in row['select_cnt'].items())
+            writer.writerow(row)
+    return json_path, csv_path
+
+
+def compare(report, baseline):
+    # 按客户端数对比TPS和p50/p95延迟，用于AMI晋级前与上一版本的报告对比，或对比AZ亲和与跨AZ路由
+    base_runs = {r['clients']: r for r in baseline['runs']}
+    print(f"与基线 {baseline['label']} 对比：")
+    print(f"{'客户端':>8}{'TPS':>12}{'基线TPS':>12}{'变化':>9}{'p50(ms)':>10}{'基线p50':>10}{'p95(ms)':>10}{'基线p95':>10}")
+    regressions = 0
+    for r in report['runs']:
+        base = base_runs.get(r['clients'])
+        if not base or not base.get('tps'):
+            continue
+        change = r.get('tps', 0) / base['tps'] - 1
+        if change < -0.05:
+            regressions += 1
+        print(f"{r['clients']:>8}{r.get('tps', 0):>14.1f}{base['tps']:>14.1f}{change:>+10.1%}"
+              f"{r.get('latency_p50_ms') or 0:>11.2f}{base.get('latency_p50_ms') or 0:>12.2f}"
+              f"{r.get('latency_p95_ms') or 0:>11.2f}{base.get('latency_p95_ms') or 0:>12.2f}")
+    return regressions
+
+
+def benchmark(args, clients, run):
+    report = {
+        'label': args.label,
+        'target': f"{args.host}:{args.port}/{args.dbname}",
+        'workload': os.path.basename(args.script) if args.script else args.workload,
+        'read_ratio': args.read_ratio if args.workload == 'mix' and not args.script else None,
+        'protocol': args.protocol,
+        'connect_per_transaction': args.connect,
+        'pgbench_version': pgbench_version(run),
+        'client_az': client_az(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'runs': [],
+    }
+    for count in clients:
+        print(f"压测 {args.host}:{args.port} {count} 个客户端，{args.duration}秒...")
+        result = run_pgbench(args, count, run)
+        report['runs'].append(result)
+        print(f"  TPS {result.get('tps', 0):.1f}，p50 {result['latency_p50_ms']} ms，"
+              f"p95 {result['latency_p95_ms']} ms，p99 {result['latency_p99_ms']} ms")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按客户端数逐级运行pgbench，输出pgpool配置的可对比压测报告")
+    parser.add_argument('--host', required=True, help="目标端点（NLB地址或本地pgpool）")
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--dbname', default='postgres')
+    parser.add_argument('--clients', default='1,8,32,64,128', help="逗号分隔的客户端数")
+    parser.add_argument('--duration', type=int, default=60, help="每个客户端数的压测时长（秒）")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="pgbench线程数上限")
+    parser.add_argument('--workload', choices=sorted(WORKLOADS) + ['mix'], default='mix')
+    parser.add_argument('--read-ratio', type=float, default=0.9, help="mix负载中只读事务的比例")
+    parser.add_argument('--script', default=None, help="自定义pgbench脚本，指定后忽略--workload")
+    parser.add_argument('--protocol', choices=['simple', 'extended', 'prepared'], default='simple', help="pgbench -M")
+    parser.add_argument('--connect', action='store_true', help="每个事务新建连接（pgbench -C）")
+    parser.add_argument('--sampling-rate', type=float, default=1.0, help="事务日志采样率，长时间压测时可降低")
+    parser.add_argument('--init', action='store_true', help="压测前执行pgbench -i初始化测试表")
+    parser.add_argument('--scale', type=int, default=50, help="pgbench -i的规模因子")
+    parser.add_argument('--label', default='pgpool', help="报告标签，例如AMI ID")
+    parser.add_argument('--output-dir', default=None, help="报告目录，默认benchmark-results/<label>-<时间>")
+    parser.add_argument('--baseline', default=None, help="用于对比的基线report.json")
+    parser.add_argument('--compare-port', type=int, default=None,
+                        help="先以相同参数压测同一地址的另一端口作为基线（例如共享监听器5432），"
+                             "再压测--port（例如只读监听器5433）并对比")
+    args = parser.parse_args()
+    run = subprocess.run
+
+    if not 0 <= args.read_ratio <= 1:
+        parser.error("--read-ratio必须在0到1之间")
+    clients = [int(c) for c in args.clients.split(',')]
+
+    if args.compare_port and args.baseline:
+        parser.error("--compare-port和--baseline不能同时使用")
+    # 两个端口执行相同负载，只读监听器拒绝写入，因此只能对比只读负载
+    if args.compare_port and (args.script or args.workload != 'select-only'):
+        parser.error("--compare-port需要--workload select-only（只读监听器不接受写入）")
+    # 对比端口的同参数副本；只读监听器不接受写入，初始化也经对比端口执行
+    compare_args = None
+    if args.compare_port:
+        compare_args = argparse.Namespace(**dict(vars(args), port=args.compare_port,
+                                                 label=f"{args.label}-port{args.compare_port}"))
+
+    try:
+        if args.init:
+            print(f"初始化pgbench测试表，规模因子 {args.scale}...")
+            init_args = ['-i', '-s', str(args.scale), args.dbname]
+            result = run(['pgbench'] + connection_args(compare_args or args) + init_args, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"pgbench -i失败: {result.stderr.strip()}")
+
+        compare_report = benchmark(compare_args, clients, run) if compare_args else None
+        report = benchmark(args, clients, run)
+    except (OSError, RuntimeError) as e:
+        print(f"压测失败: {e}")
+        sys.exit(1)
+
+    output_dir = args.output_dir or os.path.join(
+        'benchmark-results', f"{args.label}-{time.strftime('%Y%m%d%H%M%S', time.gmtime())}"
+    )
+    json_path, csv_path = write_reports(report, output_dir)
+    print(f"报告已写入 {json_path} 和 {csv_path}")
+    if compare_report:
+        json_path, csv_path = write_reports(compare_report, os.path.join(output_dir, f"port{args.compare_port}"))
+        print(f"对比端口的报告已写入 {json_path} 和 {csv_path}")
+
+    baseline = compare_report
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline:
+        regressions = compare(report, baseline)
+        if regressions:
+            print(f"{regressions}个客户端数的TPS比基线下降超过5%")
+            sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
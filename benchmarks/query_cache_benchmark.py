@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 与pgbench压测共用pgbench输出解析和SHOW POOL_NODES统计
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pgbench_benchmark import parse_pgbench_output, parse_pool_nodes, select_cnt_delta
+
+# 经由pgpool实测共享查询缓存（CDK堆栈的query_cache选项）的效果：
+# 对开启query_cache的堆栈中每个pgpool实例并行运行同一个pgbench脚本（模拟NLB把客户端分散到各实例），
+# 负载为仪表盘类读多写少的查询：查询按Zipf分布重复，写入按比例随机修改某张表。
+# 同一负载运行两轮：
+#   no-cache：查询带/*NO QUERY CACHE*/注释，pgpool不读写缓存，所有读取都发往后端
+#   shared：查询经共享memcached缓存
+# 命中数取自各实例SHOW POOL_CACHE的num_cache_hits增量，读节点查询数取自SHOW POOL_NODES的select_cnt增量。
+# 数据库密码通过PGPASSWORD或~/.pgpass提供，不出现在命令行中。
+
+NO_CACHE_HINT = '/*NO QUERY CACHE*/ '
+TABLE_PREFIX = 'qcache_bench_'
+
+
+def table_branches(args, statement):
+    # pgbench不能参数化表名，按:t分支到各张表
+    lines = []
+    for table in range(args.tables):
+        keyword = '\\if' if table == 0 else '\\elif'
+        lines.append(f"{keyword} :t = {table}")
+        lines.append(statement.format(table=f"{TABLE_PREFIX}{table}"))
+    lines.append('\\endif')
+    return lines
+
+
+def read_script(args, cached):
+    hint = '' if cached else NO_CACHE_HINT
+    return '\n'.join([
+        f"\\set k random_zipfian(1, {args.distinct}, {args.zipf})",
+        f"\\set t :k % {args.tables}",
+        f"\\set id 1 + :k / {args.tables} % {args.rows}",
+    ] + table_branches(args, f"SELECT {hint}v FROM {{table}} WHERE id = :id;")) + '\n'
+
+
+def write_script(args):
+    return '\n'.join([
+        f"\\set t random(0, {args.tables - 1})",
+        f"\\set id random(1, {args.rows})",
+    ] + table_branches(args, "UPDATE {table} SET v = v + 1 WHERE id = :id;")) + '\n'
+
+
+def connection_args(args, host):
+    address, _, port = host.partition(':')
+    return ['-h', address, '-p', port or str(args.port), '-U', args.user]
+
+
+def psql(args, host, sql, run):
+    return run(
+        ['psql'] + connection_args(args, host) + ['-d', args.dbname, '-X', '-A', '-F', ',', '-c', sql],
+        capture_output=True, text=True,
+    )
+
+
+def parse_pool_cache(text):
+    # psql -A -F, 输出的SHOW POOL_CACHE，返回num_cache_hits和num_selects（未命中、发往后端的可缓存查询）
+    lines = [line for line in text.splitlines() if line and not line.startswith('(')]
+    if len(lines) < 2:
+        return None
+    row = dict(zip(lines[0].split(','), lines[1].split(',')))
+    try:
+        return {'hits': int(row['num_cache_hits']), 'selects': int(row['num_selects'])}
+    except (KeyError, ValueError):
+        return None
+
+
+def pool_stats(args, run):
+    # 每个pgpool实例的缓存计数和后端select_cnt；未开启memory_cache_enabled时SHOW POOL_CACHE失败
+    stats = {}
+    for host in args.hosts:
+        cache = psql(args, host, 'SHOW POOL_CACHE', run)
+        nodes = psql(args, host, 'SHOW POOL_NODES', run)
+        stats[host] = {
+            'cache': parse_pool_cache(cache.stdout) if cache.returncode == 0 else None,
+            'select_cnt': parse_pool_nodes(nodes.stdout) if nodes.returncode == 0 else None,
+        }
+    return stats
+
+
+def script_transactions(text):
+    # 多脚本时pgbench按脚本输出事务数，第1个脚本为读取
+    counts = re.findall(r'SQL script \d+: .*\n(?: - weight: .*\n)? - (\d+) transactions', text)
+    return [int(count) for count in counts]
+
+
+def run_phase(args, mode, script_dir, run):
+    read_path = os.path.join(script_dir, f"read-{mode}.sql")
+    with open(read_path, 'w') as f:
+        f.write(read_script(args, cached=mode == 'shared'))
+    write_path = os.path.join(script_dir, 'write.sql')
+    with open(write_path, 'w') as f:
+        f.write(write_script(args))
+    write_weight = round(args.write_ratio * 1000)
+
+    def pgbench(host):
+        command = ['pgbench'] + connection_args(args, host) + [
+            '-c', str(args.clients), '-j', str(args.clients), '-T', str(args.duration), '-n',
+            '-f', f"{read_path}@{1000 - write_weight}",
+        ]
+        if write_weight:
+            command += ['-f', f"{write_path}@{write_weight}"]
+        return run(command + [args.dbname], capture_output=True, text=True)
+
+    before = pool_stats(args, run)
+    with ThreadPoolExecutor(max_workers=len(args.hosts)) as pool:
+        results = list(pool.map(pgbench, args.hosts))
+    after = pool_stats(args, run)
+
+    phase = {'mode': mode, 'reads': 0, 'writes': 0, 'tps': 0.0, 'hits': None, 'reader_selects': None, 'hosts': {}}
+    for host, result in zip(args.hosts, results):
+        if result.returncode != 0:
+            raise RuntimeError(f"pgbench失败（{host}）: {result.stderr.strip()}")
+        summary = parse_pgbench_output(result.stdout)
+        counts = script_transactions(result.stdout) or [summary.get('transactions', 0)]
+        cache_before, cache_after = before[host]['cache'], after[host]['cache']
+        hits = cache_after['hits'] - cache_before['hits'] if cache_before and cache_after else None
+        selects = select_cnt_delta(before[host]['select_cnt'], after[host]['select_cnt'])
+        phase['hosts'][host] = dict(summary, hits=hits, select_cnt=selects)
+        phase['reads'] += counts[0]
+        phase['writes'] += sum(counts[1:])
+        phase['tps'] += summary.get('tps', 0)
+        if hits is not None:
+            phase['hits'] = (phase['hits'] or 0) + hits
+        if selects is not None:
+            # 各实例的select_cnt只统计经本实例发出的查询，按实例累加
+            phase['reader_selects'] = (phase['reader_selects'] or 0) + sum(selects.values())
+    phase['hit_rate'] = phase['hits'] / phase['reads'] if phase['hits'] is not None and phase['reads'] else None
+    return phase
+
+
+def initialize(args, run):
+    # 经第一个pgpool实例在写入实例上建表并填充数据
+    statements = []
+    for table in range(args.tables):
+        name = f"{TABLE_PREFIX}{table}"
+        statements.append(
+            f"DROP TABLE IF EXISTS {name}; CREATE TABLE {name} (id int PRIMARY KEY, v bigint NOT NULL DEFAULT 0); "
+            f"INSERT INTO {name} (id) SELECT generate_series(1, {args.rows});"
+        )
+    result = psql(args, args.hosts[0], ' '.join(statements), run)
+    if result.returncode != 0:
+        raise RuntimeError(f"初始化测试表失败: {result.stderr.strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="经由pgpool对比关闭与开启共享memcached查询缓存时的命中率和读节点查询数")
+    parser.add_argument('--hosts', required=True,
+                        help="逗号分隔的pgpool实例地址（host或host:port），SHOW POOL_CACHE需直连每个实例而不是NLB")
+    parser.add_argument('--port', type=int, default=9999, help="--hosts未指定端口时使用的pgpool端口")
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--dbname', default='postgres')
+    parser.add_argument('--clients', type=int, default=8, help="每个pgpool实例的客户端数")
+    parser.add_argument('--duration', type=int, default=60, help="每轮压测时长（秒）")
+    parser.add_argument('--distinct', type=int, default=5000, help="不同查询的数量")
+    parser.add_argument('--zipf', type=float, default=1.1, help="查询重复度的Zipf指数（pgbench random_zipfian）")
+    parser.add_argument('--tables', type=int, default=50, help="查询涉及的表数量")
+    parser.add_argument('--rows', type=int, default=1000, help="每张表的行数")
+    parser.add_argument('--write-ratio', type=float, default=0.002, help="写入语句比例（按千分比取整）")
+    parser.add_argument('--init', action='store_true', help="压测前创建并填充测试表")
+    parser.add_argument('--output', default=None, help="JSON报告路径")
+    args = parser.parse_args()
+    run = subprocess.run
+
+    if not 0 <= args.write_ratio < 1:
+        parser.error("--write-ratio必须在0到1之间")
+    args.hosts = [host for host in args.hosts.split(',') if host]
+
+    results = {}
+    try:
+        if args.init:
+            print(f"初始化{args.tables}张测试表，每张{args.rows}行...")
+            initialize(args, run)
+        with tempfile.TemporaryDirectory(prefix='query-cache-') as script_dir:
+            for mode in ('no-cache', 'shared'):
+                print(f"压测 {mode}：{len(args.hosts)}个pgpool实例，每个{args.clients}个客户端，{args.duration}秒...")
+                results[mode] = run_phase(args, mode, script_dir, run)
+    except (OSError, RuntimeError) as e:
+        print(f"压测失败: {e}")
+        sys.exit(1)
+
+    if results['shared']['hits'] is None:
+        print("SHOW POOL_CACHE失败：确认堆栈开启了query_cache且--hosts为各pgpool实例的地址")
+    print(f"{len(args.hosts)}个pgpool实例，Zipf {args.zipf:g}，{args.distinct}个不同查询，写入比例 {args.write_ratio:g}")
+    print(f"{'模式':<12}{'读取':>10}{'命中率':>9}{'读节点查询':>12}{'TPS':>10}")
+    for mode, phase in results.items():
+        hit_rate = f"{phase['hit_rate']:.1%}" if phase['hit_rate'] is not None else '-'
+        selects = phase['reader_selects'] if phase['reader_selects'] is not None else '-'
+        print(f"{mode:<12}{phase['reads']:>12}{hit_rate:>10}{selects:>14}{phase['tps']:>12.1f}")
+    baseline, shared = results['no-cache'], results['shared']
+    if baseline['reader_selects'] and shared['reader_selects'] is not None and shared['reads']:
+        # 两轮的吞吐不同，按每次读取的读节点查询数比较
+        reduction = 1 - (shared['reader_selects'] / shared['reads']) / (baseline['reader_selects'] / baseline['reads'])
+        print(f"共享缓存使每次读取的读节点查询减少 {reduction:.1%}")
+
+    if args.output:
+        report = {
+            'hosts': args.hosts,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'workload': {key: getattr(args, key) for key in
+                         ('clients', 'duration', 'distinct', 'zipf', 'tables', 'rows', 'write_ratio')},
+            'phases': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"报告已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
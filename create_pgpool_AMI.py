@@ -1,82 +1,237 @@
+import argparse
 import boto3
+import hashlib
+import os
+import re
 import time
 import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# 与CDK堆栈共用的实例类型、连接数计算和日志配置模块（pgpool_aurora_cdk/pgpool_aurora_cdk）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pgpool_aurora_cdk'))
+from pgpool_aurora_cdk.agents.pgpool_conf import format_value
+from pgpool_aurora_cdk.instance_types import DEFAULT_INSTANCE_TYPES
+from pgpool_aurora_cdk.logging_profiles import DEFAULT_LOGGING_PROFILE, LOGGING_PROFILES, logging_settings
+from pgpool_aurora_cdk.sizing import (PROCESS_MANAGEMENT_MODES, pgpool_sizing, supports_process_management,
+                                      validate_process_management)
+
+# 用户数据脚本写入串口控制台的标记行
+READY_MARKER = 'PGPOOL_AMI_BUILD_READY'
+FAILED_MARKER = 'PGPOOL_AMI_BUILD_FAILED'
+STATS_MARKER = 'PGPOOL_AMI_BUILD_STATS'
+
+PGPOOL_VERSION = '4.5.6'
+
+BUILD_PHASES = ('cache_lookup', 'launch', 'status_checks', 'install', 'stop', 'image')
+
+# AMI缓存标签：相同构建输入（用户数据、pgpool版本、基础AMI）的哈希
+CACHE_TAG_KEY = 'pgpool-build-hash'
+
+BUILD_PROFILES = ('default', 'optimized', 'lto')
+
+# pgpool-II的configure选项；memcached用于CDK堆栈可选的共享查询缓存
+CONFIGURE_OPTIONS = '--with-openssl --with-memcached=/usr'
+
+# 各架构的可移植指令集基线：AMI可能运行在ASG中任何实例族上（包括更早的实例族），
+# 按目标实例族生成的-march/-mcpu指令会在不支持的CPU上触发SIGILL
+PORTABLE_MARCH = {
+    'x86_64': '-march=x86-64-v2',
+    'arm64': '-march=armv8.2-a',
+}
+
+# 目标实例族对应的指令调度调优参数（Amazon Linux 2023自带gcc 11支持的取值），不改变指令集
+TUNING_FLAGS = {
+    ('x86_64', 't3'): '-mtune=skylake-avx512',
+    ('x86_64', 'c5'): '-mtune=skylake-avx512',
+    ('x86_64', 'm5'): '-mtune=skylake-avx512',
+    ('x86_64', 'r5'): '-mtune=skylake-avx512',
+    ('x86_64', 't3a'): '-mtune=znver1',
+    ('x86_64', 'c5a'): '-mtune=znver2',
+    ('x86_64', 'm5a'): '-mtune=znver1',
+    ('x86_64', 'r5a'): '-mtune=znver1',
+    ('x86_64', 'c6i'): '-mtune=icelake-server',
+    ('x86_64', 'm6i'): '-mtune=icelake-server',
+    ('x86_64', 'r6i'): '-mtune=icelake-server',
+    ('x86_64', 'c6a'): '-mtune=znver3',
+    ('x86_64', 'm6a'): '-mtune=znver3',
+    ('x86_64', 'r6a'): '-mtune=znver3',
+    ('x86_64', 'c7i'): '-mtune=sapphirerapids',
+    ('x86_64', 'm7i'): '-mtune=sapphirerapids',
+    ('x86_64', 'r7i'): '-mtune=sapphirerapids',
+    ('x86_64', 'c7a'): '-mtune=znver3',
+    ('x86_64', 'm7a'): '-mtune=znver3',
+    ('x86_64', 'r7a'): '-mtune=znver3',
+    ('arm64', 't4g'): '-mtune=neoverse-n1',
+    ('arm64', 'c6g'): '-mtune=neoverse-n1',
+    ('arm64', 'c6gn'): '-mtune=neoverse-n1',
+    ('arm64', 'm6g'): '-mtune=neoverse-n1',
+    ('arm64', 'r6g'): '-mtune=neoverse-n1',
+    ('arm64', 'c7g'): '-mtune=neoverse-v1',
+    ('arm64', 'c7gn'): '-mtune=neoverse-v1',
+    ('arm64', 'm7g'): '-mtune=neoverse-v1',
+    ('arm64', 'r7g'): '-mtune=neoverse-v1',
+    ('arm64', 'c8g'): '-mtune=neoverse-v1',
+    ('arm64', 'm8g'): '-mtune=neoverse-v1',
+    ('arm64', 'r8g'): '-mtune=neoverse-v1',
+}
+
+# 各架构默认的构建实例类型
+DEFAULT_BUILD_INSTANCE_TYPES = {
+    'x86_64': 't3.micro',
+    'arm64': 't4g.micro',
+}
+
+
+class AmiBuildError(Exception):
+    pass
+
+
+class PhaseTimer:
+    # 记录AMI构建各阶段耗时（秒）
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.clock() - start
+
+    def report(self):
+        print("各阶段耗时:")
+        for name in BUILD_PHASES:
+            if name in self.timings:
+                print(f"  {name:<14}{self.timings[name]:>8.1f}s")
+        print(f"  {'total':<14}{sum(self.timings.values()):>8.1f}s")
+
+
+def _console_output(ec2, instance_id, latest=True):
+    # Nitro实例支持Latest=True获取实时输出，其它实例回退到缓冲输出
+    if latest:
+        try:
+            return ec2.get_console_output(InstanceId=instance_id, Latest=True).get('Output') or '', True
+        except Exception:
+            pass
+    return ec2.get_console_output(InstanceId=instance_id).get('Output') or '', False
+
+
+def parse_build_stats(output):
+    # 解析编译阶段写入控制台的统计行，例如 compile_seconds=123 pgpool_bytes=456
+    match = re.search(rf'{STATS_MARKER}\s+(.*)$', output, re.M)
+    if not match:
+        return {}
+    stats = {}
+    for field in match.group(1).split():
+        key, _, value = field.partition('=')
+        stats[key] = int(value) if value.isdigit() else value
+    return stats
+
+
+def wait_for_build_ready(ec2, instance_id, timeout=1800, initial_delay=5, max_delay=30,
+                         sleep=time.sleep, clock=time.monotonic):
+    # 轮询控制台输出中的就绪/失败标记，指数退避直到超时；返回编译阶段统计
+    deadline = clock() + timeout
+    delay = initial_delay
+    latest = True
+    while True:
+        output, latest = _console_output(ec2, instance_id, latest)
+        failure = re.search(rf'{FAILED_MARKER}:?\s*(.*)$', output, re.M)
+        if failure:
+            raise AmiBuildError(f"安装脚本失败: {failure.group(1).strip()}")
+        if re.search(rf'{READY_MARKER}\s*$', output, re.M):
+            return parse_build_stats(output)
+        remaining = deadline - clock()
+        if remaining <= 0:
+            raise AmiBuildError(f"等待安装脚本完成超时（{timeout}秒）")
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def render_log_settings(settings):
+    # 按pgpool.conf格式渲染日志参数（与实例启动时的配置步骤一致）
+    return '\n'.join(f"{name} = {format_value(value)}" for name, value in settings.items())
+
+
+def render_process_management(settings, pgpool_version):
+    # 进程管理参数（pgpool-II 4.4起支持）；旧版本不写入，按原有的静态预创建方式运行
+    validate_process_management(settings, pgpool_version)
+    if not supports_process_management(pgpool_version):
+        return ''
+    keys = ('process_management_mode', 'process_management_strategy', 'min_spare_children', 'max_spare_children')
+    return '\n'.join(f"{key} = {format_value(settings[key])}" for key in keys if key in settings)
+
+
+def render_user_data(cluster_endpoint, reader_endpoint, pgpool_version=PGPOOL_VERSION,
+                     cflags='-O2', ldflags='', artifact_fetch_url='', artifact_upload_url='', pgpool_settings=None,
+                     logging_profile=DEFAULT_LOGGING_PROFILE):
+    # 渲染构建实例的用户数据脚本
+    # artifact_fetch_url可下载时直接安装已编译的产物，否则编译并上传到artifact_upload_url
+    # pgpool_settings为pgpool_sizing计算的连接参数；CDK堆栈在实例启动时会按实际实例类型重新计算
+    # logging_profile为pgpool日志配置（debug/standard/production），CDK堆栈启动时按logging_profile参数覆盖
+    settings = dict(num_init_children=32, max_pool=4, child_life_time=300, connection_life_time=0)
+    settings.update(pgpool_settings or {})
+    process_settings = render_process_management(settings, pgpool_version)
+    log_settings = render_log_settings(logging_settings(logging_profile))
+    return fr'''#!/bin/bash
+# 构建结果通过串口控制台通知AMI创建脚本（get_console_output轮询）
+fail() {{
+    echo "{FAILED_MARKER}: $1" > /dev/console
+    exit 1
+}}
 
-def create_pgpool_ami(region_name, cluster_endpoint="your-aurora-cluster-endpoint", reader_endpoint="your-aurora-reader-endpoint", db_user='pdadmin', db_password='1qaz2wsx', instance_type='t3.micro'):
-    # 初始化EC2客户端
-    ec2 = boto3.client('ec2', region_name=region_name)
-    
-    # 查找最新的Amazon Linux 2023 AMI
-    response = ec2.describe_images(
-        Owners=['amazon'],
-        Filters=[
-            {'Name': 'name', 'Values': ['al2023-ami-2023*-x86_64']},
-            {'Name': 'state', 'Values': ['available']}
-        ]
-    )
-    
-    # 按创建日期排序，获取最新的AMI
-    amis = sorted(response['Images'], key=lambda x: x['CreationDate'], reverse=True)
-    if not amis:
-        print("未找到Amazon Linux 2023 AMI")
-        return None
-    
-    base_ami_id = amis[0]['ImageId']
-    print(f"使用基础AMI: {base_ami_id}")
-    
-    # 创建安全组
-    try:
-        sg_response = ec2.create_security_group(
-            GroupName=f'pgpool-build-sg-{int(time.time())}',
-            Description='Security group for Pgpool AMI building'
-        )
-        security_group_id = sg_response['GroupId']
-        
-        # 添加SSH访问规则
-        ec2.authorize_security_group_ingress(
-            GroupId=security_group_id,
-            IpPermissions=[
-                {
-                    'IpProtocol': 'tcp',
-                    'FromPort': 22,
-                    'ToPort': 22,
-                    'IpRanges': [{'CidrIp': '0.0.0.0/0'}]
-                }
-            ]
-        )
-    except Exception as e:
-        print(f"创建安全组时出错: {str(e)}")
-        security_group_id = 'sg-default'  # 使用默认安全组
-    
-    # 准备用户数据脚本
-    user_data = fr'''#!/bin/bash
 # 更新系统
-dnf update -y
+dnf update -y || fail "dnf update"
 
 # 安装必要的依赖
-# Install required packages for pgdoctor and pgpool
-dnf install -y gcc make wget git postgresql15 libpq-devel openssl-devel pam-devel readline-devel systemd-devel
-dnf install -y libmicrohttpd-devel check-devel
-
-# 下载并解压Pgpool
-cd /tmp
-wget "https://www.pgpool.net/mediawiki/download.php?f=pgpool-II-4.5.6.tar.gz" -O pgpool-II-4.5.6.tar.gz
-tar xzf pgpool-II-4.5.6.tar.gz
-sudo dnf install libtool
-cd pgpool-II-4.5.6
-autoreconf -fi
-
+dnf install -y gcc make wget git libtool postgresql15 libpq-devel openssl-devel pam-devel readline-devel systemd-devel libmemcached-awesome-devel || fail "dnf install build dependencies"
+# CDK堆栈的主机代理（pgpool_aurora_cdk.agents）运行时依赖，预装以免启动时再安装
+dnf install -y python3-boto3 || fail "dnf install python3-boto3"
+# CloudWatch agent：CDK堆栈启动时配置，异步上传pgpool日志
+dnf install -y amazon-cloudwatch-agent || fail "dnf install amazon-cloudwatch-agent"
 
 # 创建pgpool系统用户和家目录
 useradd -r -m -s /sbin/nologin pgpool
 
-# 编译和安装Pgpool
-./configure --prefix=/usr/local --with-openssl
-echo "Configure完成，检查配置结果..."
-cat config.log | grep "binary dir"
-
-make
-sudo make install
+# 编译阶段：pgpool安装到暂存目录，打包为可复用的产物
+STAGE=/tmp/pgpool-stage
+ARTIFACT=/tmp/pgpool-artifact.tar.gz
+JOBS=$(nproc)
+COMPILE_START=$SECONDS
+BUILD_SOURCE=compiled
+if [ -n "{artifact_fetch_url}" ] && curl -fsS -o $ARTIFACT "{artifact_fetch_url}"; then
+    echo "使用已编译的产物，跳过编译"
+    mkdir -p $STAGE
+    tar xzf $ARTIFACT -C $STAGE || fail "extract build artifact"
+    BUILD_SOURCE=artifact
+else
+    # 下载并解压Pgpool
+    cd /tmp
+    wget "https://www.pgpool.net/mediawiki/download.php?f=pgpool-II-{pgpool_version}.tar.gz" -O pgpool-II-{pgpool_version}.tar.gz || fail "download pgpool-II"
+    tar xzf pgpool-II-{pgpool_version}.tar.gz || fail "extract pgpool-II"
+    cd pgpool-II-{pgpool_version}
+    autoreconf -fi || fail "autoreconf pgpool-II"
+
+    # 编译和安装Pgpool
+    ./configure --prefix=/usr/local {CONFIGURE_OPTIONS} CFLAGS="{cflags}" LDFLAGS="{ldflags}" || fail "configure pgpool-II"
+    echo "Configure完成，检查配置结果..."
+    grep "binary dir" config.log
+
+    make -j$JOBS || fail "make pgpool-II"
+    make install DESTDIR=$STAGE || fail "make install pgpool-II"
+
+    tar czf $ARTIFACT -C $STAGE . || fail "package build artifact"
+    if [ -n "{artifact_upload_url}" ]; then
+        curl -fsS -T $ARTIFACT "{artifact_upload_url}" || echo "上传编译产物失败，继续构建"
+    fi
+fi
+COMPILE_SECONDS=$((SECONDS - COMPILE_START))
+cp -a $STAGE/. / || fail "install pgpool-II"
+echo "{STATS_MARKER} source=$BUILD_SOURCE compile_seconds=$COMPILE_SECONDS jobs=$JOBS pgpool_bytes=$(stat -c %s /usr/local/bin/pgpool)" > /dev/console
 
 # 配置共享库
 echo "/usr/local/lib" > /etc/ld.so.conf.d/pgpool.conf
@@ -85,17 +240,12 @@ ldconfig
 # 创建必要的目录
 mkdir -p /run/pgpool
 mkdir -p /var/log/pgpool
-mkdir -p /var/run/pgdoctor
-mkdir -p /var/log/pgdoctor
 
 # 设置目录权限
 chown -R pgpool:pgpool /run/pgpool
 chown -R pgpool:pgpool /var/log/pgpool
-chown -R pgpool:pgpool /var/run/pgdoctor
-chown -R pgpool:pgpool /var/log/pgdoctor
 chmod 755 /run/pgpool
 chmod 755 /var/log/pgpool
-chmod 755 /var/log/pgdoctor
 
 # 创建符号链接以保持兼容性
 ln -sf /run/pgpool /var/run/pgpool
@@ -112,15 +262,9 @@ logdir = '/var/log/pgpool'
 #log_destination = 'syslog,stderr'
 log_destination = 'stderr'
 log_line_prefix = '%t: pid %p: '   # printf-style string to output at beginning of each log line.
-log_connections = off
-log_disconnections = off
-log_hostname = on
-log_statement = on
-#log_error_verbosity = VERBOSE
-#log_min_messages = debug5
+# 日志配置：{logging_profile}
+{log_settings}
 #client_min_messages = debug5
-log_per_node_statement = on
-log_client_messages = off
 log_standby_delay = 'if_over_threshold'
 syslog_facility = 'LOCAL0'
 syslog_ident = 'pgpool'
@@ -167,10 +311,17 @@ backend_data_directory1 = '/tmp'
 backend_application_name1 = 'replica'
 
 # Connection settings
-num_init_children = 32
-max_pool = 4
+num_init_children = {settings['num_init_children']}
+max_pool = {settings['max_pool']}
+child_life_time = {settings['child_life_time']}
+connection_life_time = {settings['connection_life_time']}
+{process_settings}
 authentication_timeout = 60
-allow_clear_text_frontend_auth
+allow_clear_text_frontend_auth = on
+
+# Query cache settings (CDK stack enables the shared memcached cache at boot)
+memory_cache_enabled = off
+memqcache_method = 'memcached'
 
 # SSL settings
 ssl = off
@@ -219,162 +370,497 @@ RestartSec=5
 WantedBy=multi-user.target
 EOF
 
-
-# 安装pgdoctor健康检查服务
-cd /tmp
-git clone https://github.com/WangYunzhang/pgdoctor.git
-cd pgdoctor
-
-# 编译和安装pgdoctor
-make
-sudo make install
-
-# 确保pgdoctor相关目录和文件的所有权正确
-chown pgpool:pgpool /usr/local/bin/pgdoctor
-chmod 755 /usr/local/bin/pgdoctor
-
-# 配置pgdoctor - 不使用引号以避免连接字符串解析错误
-cat > /etc/pgdoctor.cfg << EOF
-# Runtime settings
-http_port = 8071
-syslog_facility = local7
-
-# PostgreSQL connection settings
-pg_host = 127.0.0.1
-pg_port = 9999
-pg_user = {db_user}
-pg_password = {db_password}
-pg_database = postgres
-pg_connection_timeout = 3
-
-# Health check queries through pgpool to Aurora
-"SELECT 1"
-EOF
-
-# 设置配置文件权限
-chown pgpool:pgpool /etc/pgdoctor.cfg
-chmod 600 /etc/pgdoctor.cfg
-
-# 更新pgdoctor服务配置
-cat > /etc/systemd/system/pgdoctor.service << "EOF"
-[Unit]
-Description=PostgreSQL Health Check Service
-After=pgpool.service
-Requires=pgpool.service
-
-[Service]
-TimeoutStartSec=0
-Type=simple
-ExecStart=/usr/local/bin/pgdoctor
-Restart=on-failure
-RestartSec=5
-User=pgpool
-Group=pgpool
-RuntimeDirectory=pgdoctor
-LogsDirectory=pgdoctor
-RuntimeDirectoryMode=0755
-LogsDirectoryMode=0755
-
-[Install]
-WantedBy=multi-user.target
-EOF
-
-# 启用服务
+# 服务保持禁用：AMI中的pgpool.conf只有占位后端，由CDK堆栈的启动步骤写入最终配置后一次性启用并启动，
+# 避免实例启动时先以占位配置启动、再改配置重启
 systemctl daemon-reload
-systemctl enable pgpool.service
-systemctl enable pgdoctor.service
 
 # 清理
-rm -rf /tmp/pgpool-II-4.5.6*
-rm -rf /tmp/pgdoctor
+rm -rf /tmp/pgpool-II-{pgpool_version}*
+rm -rf $STAGE $ARTIFACT
 
 # 通知AMI创建脚本实例已准备好
 touch /tmp/ami_ready
+echo "{READY_MARKER}" > /dev/console
 '''
-    
-    # 启动EC2实例
-    instance_response = ec2.run_instances(
-        ImageId=base_ami_id,
-        InstanceType=instance_type,
-        MinCount=1,
-        MaxCount=1,
-        SecurityGroupIds=[security_group_id],
-        UserData=user_data,
-        InstanceInitiatedShutdownBehavior='stop'
+
+
+def compile_flags(build_profile, architecture, target_instance_type=None):
+    # 返回(CFLAGS, LDFLAGS)；optimized/lto按目标实例族调优指令调度，指令集保持架构的可移植基线，
+    # 生成的二进制可运行在该架构的所有实例族上
+    if build_profile not in BUILD_PROFILES:
+        raise ValueError(f"不支持的编译配置: {build_profile}")
+    if build_profile == 'default':
+        return '-O2', ''
+    if not target_instance_type:
+        raise ValueError(f"编译配置 {build_profile} 需要指定目标实例类型")
+    family = target_instance_type.split('.')[0]
+    tuning = TUNING_FLAGS.get((architecture, family))
+    if not tuning:
+        raise ValueError(f"没有 {architecture} 架构实例族 {family} 的调优参数")
+    if build_profile == 'lto':
+        return f'-O2 {PORTABLE_MARCH[architecture]} {tuning} -flto=auto', '-flto=auto'
+    return f'-O2 {PORTABLE_MARCH[architecture]} {tuning}', ''
+
+
+class S3ArtifactStore:
+    # 构建实例没有实例角色，通过预签名URL下载和上传产物
+    def __init__(self, bucket, prefix='', s3_client=None, expires=7200):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.s3 = s3_client or boto3.client('s3')
+        self.expires = expires
+
+    def uri(self, key):
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+    def exists(self, key):
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except Exception:
+            return False
+
+    def fetch_url(self, key):
+        return self.s3.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': self.prefix + key}, ExpiresIn=self.expires)
+
+    def upload_url(self, key):
+        return self.s3.generate_presigned_url('put_object', Params={'Bucket': self.bucket, 'Key': self.prefix + key}, ExpiresIn=self.expires)
+
+
+def artifact_store_from_uri(uri):
+    # 产物由远端的构建实例用curl下载和上传，只支持S3（预签名URL）；本机目录对构建实例不可见
+    if not uri.startswith('s3://'):
+        raise ValueError(f"编译产物仓库必须是s3://bucket/prefix: {uri}")
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    if not bucket:
+        raise ValueError(f"编译产物仓库缺少S3存储桶: {uri}")
+    return S3ArtifactStore(bucket, prefix)
+
+
+def artifact_key(pgpool_version, architecture, build_profile, cflags, ldflags):
+    flags_hash = hashlib.sha256(f"{CONFIGURE_OPTIONS}|{cflags}|{ldflags}".encode('utf-8')).hexdigest()[:8]
+    return f"pgpool-II-{pgpool_version}-al2023-{architecture}-{build_profile}-{flags_hash}.tar.gz"
+
+
+def build_cache_key(user_data, pgpool_version, base_ami_id):
+    digest = hashlib.sha256()
+    for part in (pgpool_version, base_ami_id, user_data):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def find_cached_ami(ec2, cache_key):
+    # 返回带有相同构建哈希的最新可用AMI
+    response = ec2.describe_images(
+        Owners=['self'],
+        Filters=[
+            {'Name': f'tag:{CACHE_TAG_KEY}', 'Values': [cache_key]},
+            {'Name': 'state', 'Values': ['available']}
+        ]
     )
+    images = sorted(response['Images'], key=lambda x: x['CreationDate'], reverse=True)
+    return images[0]['ImageId'] if images else None
+
+
+def prune_cached_amis(ec2, keep=3, architecture=None):
+    # 每个架构只保留最新的keep个缓存AMI，注销其余AMI并删除其快照
+    filters = [{'Name': 'tag-key', 'Values': [CACHE_TAG_KEY]}]
+    if architecture:
+        filters.append({'Name': 'architecture', 'Values': [architecture]})
+    response = ec2.describe_images(Owners=['self'], Filters=filters)
+    by_architecture = {}
+    for image in response['Images']:
+        by_architecture.setdefault(image.get('Architecture'), []).append(image)
+    pruned = []
+    for images in by_architecture.values():
+        images.sort(key=lambda x: x['CreationDate'], reverse=True)
+        for image in images[keep:]:
+            print(f"清理旧的缓存AMI: {image['ImageId']} ({image.get('Name', '')})")
+            ec2.deregister_image(ImageId=image['ImageId'])
+            for mapping in image.get('BlockDeviceMappings', []):
+                snapshot_id = mapping.get('Ebs', {}).get('SnapshotId')
+                if snapshot_id:
+                    try:
+                        ec2.delete_snapshot(SnapshotId=snapshot_id)
+                    except Exception as e:
+                        print(f"删除快照 {snapshot_id} 时出错: {str(e)}")
+            pruned.append(image['ImageId'])
+    return pruned
+
+
+def check_instance_architecture(ec2, instance_type, architecture):
+    # 构建实例的架构必须与基础AMI一致，否则run_instances会失败
+    response = ec2.describe_instance_types(InstanceTypes=[instance_type])
+    supported = response['InstanceTypes'][0]['ProcessorInfo']['SupportedArchitectures']
+    if architecture not in supported:
+        raise ValueError(f"实例类型 {instance_type} 不支持 {architecture} 架构（支持: {', '.join(supported)}）")
+
+
+def create_pgpool_ami(region_name, cluster_endpoint="your-aurora-cluster-endpoint", reader_endpoint="your-aurora-reader-endpoint", instance_type=None,
+                      architecture='x86_64', readiness='console', ready_timeout=1800, fixed_wait=300, timings=None, ec2_client=None,
+                      force=False, keep_cached=None, pgpool_version=PGPOOL_VERSION, build_profile='default',
+                      target_instance_type=None, artifact_store=None, build_stats=None,
+                      db_instance_class='db.t3.medium', pgpool_instances=4, logging_profile=DEFAULT_LOGGING_PROFILE,
+                      process_management_mode='static'):
+    # readiness='console'：轮询控制台就绪标记；readiness='sleep'：固定等待fixed_wait秒
+    # 构建输入未变化时直接返回已有的缓存AMI；force=True时强制重新构建
+    # keep_cached不为None时，构建完成后每个架构只保留最新的keep_cached个缓存AMI
+    # artifact_store中已有相同版本/架构/编译参数的产物时直接安装，否则编译后上传；build_stats接收编译耗时和二进制大小
+    # pgpool.conf的连接参数按目标实例类型、Aurora实例规格和pgpool实例数（ASG最大容量）计算
+    # logging_profile选择pgpool.conf的日志配置，不同配置生成不同的构建哈希
+    # process_management_mode='dynamic'时按需创建子进程（pgpool-II 4.4+），num_init_children为上限
+    if readiness not in ('console', 'sleep'):
+        raise ValueError(f"不支持的readiness模式: {readiness}")
+    if architecture not in DEFAULT_BUILD_INSTANCE_TYPES:
+        raise ValueError(f"不支持的架构: {architecture}")
+    instance_type = instance_type or DEFAULT_BUILD_INSTANCE_TYPES[architecture]
+    if not re.match(r'^\d+\.\d+\.\d+$', pgpool_version):
+        raise ValueError(f"无效的pgpool版本: {pgpool_version}")
+    cflags, ldflags = compile_flags(build_profile, architecture, target_instance_type)
+    pgpool_settings = pgpool_sizing(target_instance_type or DEFAULT_INSTANCE_TYPES[architecture], db_instance_class, pgpool_instances,
+                                    process_management_mode=process_management_mode)
+    validate_process_management(pgpool_settings, pgpool_version)
+    print(f"pgpool连接参数: {pgpool_settings}")
+
+    # 初始化EC2客户端
+    ec2 = ec2_client or boto3.client('ec2', region_name=region_name)
+    timer = PhaseTimer()
+    check_instance_architecture(ec2, instance_type, architecture)
     
-    instance_id = instance_response['Instances'][0]['InstanceId']
-    print(f"已启动EC2实例: {instance_id}")
-    
-    # 等待实例状态为running
-    print("等待实例启动...")
-    waiter = ec2.get_waiter('instance_running')
-    waiter.wait(InstanceIds=[instance_id])
-    
-    # 等待实例状态检查通过
-    print("等待实例状态检查通过...")
-    waiter = ec2.get_waiter('instance_status_ok')
-    waiter.wait(InstanceIds=[instance_id])
-    
-    # 等待用户数据脚本完成
-    print("等待安装脚本完成...")
-    # 这里可以使用SSM或SSH检查/tmp/ami_ready文件是否存在
-    # 为简化，我们只等待固定时间
-    time.sleep(300)  # 等待5分钟让脚本完成
-    
-    # 停止实例
-    print("停止实例...")
-    ec2.stop_instances(InstanceIds=[instance_id])
-    
-    # 等待实例停止
-    waiter = ec2.get_waiter('instance_stopped')
-    waiter.wait(InstanceIds=[instance_id])
-    
-    # 创建AMI
-    ami_name = f"pgpool-II-4.5.6-{int(time.time())}"
-    print(f"创建AMI: {ami_name}")
-    ami_response = ec2.create_image(
-        InstanceId=instance_id,
-        Name=ami_name,
-        Description='Pgpool-II 4.5.6 on Amazon Linux 2023 with health check'
+    # 查找最新的Amazon Linux 2023 AMI
+    response = ec2.describe_images(
+        Owners=['amazon'],
+        Filters=[
+            {'Name': 'name', 'Values': [f'al2023-ami-2023*-{architecture}']},
+            {'Name': 'architecture', 'Values': [architecture]},
+            {'Name': 'state', 'Values': ['available']}
+        ]
     )
     
-    ami_id = ami_response['ImageId']
-    
-    # 等待AMI可用
-    print(f"等待AMI {ami_id} 可用...")
-    waiter = ec2.get_waiter('image_available')
-    waiter.wait(ImageIds=[ami_id])
-    
-    # 清理资源
-    print("清理资源...")
-    ec2.terminate_instances(InstanceIds=[instance_id])
+    # 按创建日期排序，获取最新的AMI
+    amis = sorted(response['Images'], key=lambda x: x['CreationDate'], reverse=True)
+    if not amis:
+        print(f"未找到Amazon Linux 2023 {architecture} AMI")
+        return None
     
-    # 等待实例终止
-    waiter = ec2.get_waiter('instance_terminated')
-    waiter.wait(InstanceIds=[instance_id])
+    base_ami_id = amis[0]['ImageId']
+    print(f"使用基础AMI: {base_ami_id}")
+
+    # 查找相同构建输入的缓存AMI；预签名URL每次都不同，不参与哈希计算
+    cache_key = build_cache_key(
+        render_user_data(cluster_endpoint, reader_endpoint, pgpool_version, cflags, ldflags,
+                         pgpool_settings=pgpool_settings, logging_profile=logging_profile),
+        pgpool_version, base_ami_id
+    )
+    if not force:
+        with timer.phase('cache_lookup'):
+            cached_ami_id = find_cached_ami(ec2, cache_key)
+        if cached_ami_id:
+            print(f"使用缓存AMI: {cached_ami_id}（构建哈希 {cache_key[:12]}）")
+            if timings is not None:
+                timings.update(timer.timings)
+            return cached_ami_id
+
+    # 准备用户数据脚本
+    fetch_url = upload_url = ''
+    if artifact_store:
+        key = artifact_key(pgpool_version, architecture, build_profile, cflags, ldflags)
+        if artifact_store.exists(key):
+            print(f"使用编译产物: {artifact_store.uri(key)}")
+            fetch_url = artifact_store.fetch_url(key)
+        else:
+            print(f"编译产物将上传到: {artifact_store.uri(key)}")
+            upload_url = artifact_store.upload_url(key)
+    user_data = render_user_data(cluster_endpoint, reader_endpoint, pgpool_version,
+                                 cflags, ldflags, fetch_url, upload_url, pgpool_settings, logging_profile)
     
+    # 创建安全组
     try:
-        ec2.delete_security_group(GroupId=security_group_id)
+        sg_response = ec2.create_security_group(
+            GroupName=f'pgpool-build-sg-{int(time.time())}-{uuid.uuid4().hex[:8]}',
+            Description='Security group for Pgpool AMI building'
+        )
+        security_group_id = sg_response['GroupId']
+        
+        # 添加SSH访问规则
+        ec2.authorize_security_group_ingress(
+            GroupId=security_group_id,
+            IpPermissions=[
+                {
+                    'IpProtocol': 'tcp',
+                    'FromPort': 22,
+                    'ToPort': 22,
+                    'IpRanges': [{'CidrIp': '0.0.0.0/0'}]
+                }
+            ]
+        )
     except Exception as e:
-        print(f"删除安全组时出错: {str(e)}")
+        print(f"创建安全组时出错: {str(e)}")
+        security_group_id = 'sg-default'  # 使用默认安全组
+    
     
+    instance_id = None
+    try:
+        # 启动EC2实例
+        with timer.phase('launch'):
+            instance_response = ec2.run_instances(
+                ImageId=base_ami_id,
+                InstanceType=instance_type,
+                MinCount=1,
+                MaxCount=1,
+                SecurityGroupIds=[security_group_id],
+                UserData=user_data,
+                InstanceInitiatedShutdownBehavior='stop'
+            )
+
+            instance_id = instance_response['Instances'][0]['InstanceId']
+            print(f"已启动EC2实例: {instance_id}")
+
+            # 等待实例状态为running
+            print("等待实例启动...")
+            waiter = ec2.get_waiter('instance_running')
+            waiter.wait(InstanceIds=[instance_id])
+
+        # 等待实例状态检查通过
+        with timer.phase('status_checks'):
+            print("等待实例状态检查通过...")
+            waiter = ec2.get_waiter('instance_status_ok')
+            waiter.wait(InstanceIds=[instance_id])
+
+        # 等待用户数据脚本完成
+        with timer.phase('install'):
+            print("等待安装脚本完成...")
+            if readiness == 'console':
+                stats = wait_for_build_ready(ec2, instance_id, timeout=ready_timeout)
+            else:
+                time.sleep(fixed_wait)
+                stats = parse_build_stats(_console_output(ec2, instance_id)[0])
+            stats['profile'] = build_profile
+            print(f"编译统计: {stats}")
+            if build_stats is not None:
+                build_stats.update(stats)
+
+        # 停止实例
+        with timer.phase('stop'):
+            print("停止实例...")
+            ec2.stop_instances(InstanceIds=[instance_id])
+
+            # 等待实例停止
+            waiter = ec2.get_waiter('instance_stopped')
+            waiter.wait(InstanceIds=[instance_id])
+
+        # 创建AMI
+        with timer.phase('image'):
+            ami_name = f"pgpool-II-{pgpool_version}-{architecture}-{int(time.time())}"
+            print(f"创建AMI: {ami_name}")
+            cache_tags = [
+                {'Key': CACHE_TAG_KEY, 'Value': cache_key},
+                {'Key': 'pgpool-version', 'Value': pgpool_version},
+                {'Key': 'pgpool-base-ami', 'Value': base_ami_id},
+                {'Key': 'pgpool-build-profile', 'Value': build_profile},
+                {'Key': 'pgpool-cflags', 'Value': cflags},
+            ]
+            # 记录编译耗时和二进制大小，便于比较不同编译配置
+            stat_tags = {'source': 'pgpool-build-source', 'compile_seconds': 'pgpool-compile-seconds', 'pgpool_bytes': 'pgpool-binary-bytes'}
+            for name, tag_key in stat_tags.items():
+                if name in stats:
+                    cache_tags.append({'Key': tag_key, 'Value': str(stats[name])})
+            ami_response = ec2.create_image(
+                InstanceId=instance_id,
+                Name=ami_name,
+                Description=f'Pgpool-II {pgpool_version} on Amazon Linux 2023 ({architecture}) with health check',
+                TagSpecifications=[
+                    {'ResourceType': 'image', 'Tags': cache_tags},
+                    {'ResourceType': 'snapshot', 'Tags': cache_tags}
+                ]
+            )
+
+            ami_id = ami_response['ImageId']
+
+            # 等待AMI可用
+            print(f"等待AMI {ami_id} 可用...")
+            waiter = ec2.get_waiter('image_available')
+            waiter.wait(ImageIds=[ami_id])
+    finally:
+        # 无论成功或失败都清理构建实例和临时安全组
+        print("清理资源...")
+        if instance_id:
+            ec2.terminate_instances(InstanceIds=[instance_id])
+
+            # 等待实例终止
+            waiter = ec2.get_waiter('instance_terminated')
+            waiter.wait(InstanceIds=[instance_id])
+
+        if security_group_id != 'sg-default':
+            try:
+                ec2.delete_security_group(GroupId=security_group_id)
+            except Exception as e:
+                print(f"删除安全组时出错: {str(e)}")
+
+        timer.report()
+        if timings is not None:
+            timings.update(timer.timings)
+
+    if keep_cached is not None:
+        prune_cached_amis(ec2, keep=keep_cached, architecture=architecture)
+
     print(f"AMI创建完成: {ami_id}")
     return ami_id
 
+def _default_client_factory(region_name):
+    # boto3默认会话不是线程安全的，每个线程使用独立的会话
+    return boto3.session.Session().client('ec2', region_name=region_name)
+
+
+def build_pipeline(regions, architectures=('x86_64',), copy=False, max_workers=None, client_factory=None, **build_kwargs):
+    # 并发构建多个区域/架构的AMI；copy=True时每个架构只在第一个区域构建，再并行copy_image到其余区域
+    # 单个区域失败不会中断其它区域，构建资源由create_pgpool_ami自行清理
+    # 未显式指定instance_type时按架构选择默认构建实例类型
+    client_factory = client_factory or _default_client_factory
+    started = time.monotonic()
+    results = []
+
+    def build(target):
+        region_name, architecture = target
+        result = {'region': region_name, 'architecture': architecture, 'ami_id': None, 'status': 'failed', 'seconds': 0.0, 'error': None,
+                  'stats': {}}
+        start = time.monotonic()
+        timings = {}
+        try:
+            result['ami_id'] = create_pgpool_ami(region_name, ec2_client=client_factory(region_name),
+                                                 architecture=architecture, timings=timings, build_stats=result['stats'], **build_kwargs)
+            if result['ami_id']:
+                result['status'] = 'built' if 'launch' in timings else 'cached'
+        except Exception as e:
+            result['error'] = str(e)
+        result['seconds'] = time.monotonic() - start
+        return result
+
+    def copy_to(region_name, source):
+        result = {'region': region_name, 'architecture': source['Architecture'], 'ami_id': None, 'status': 'failed', 'seconds': 0.0, 'error': None}
+        start = time.monotonic()
+        ec2 = client_factory(region_name)
+        try:
+            # 目标区域已有相同构建哈希的AMI时跳过复制
+            cache_key = {tag['Key']: tag['Value'] for tag in source.get('Tags', [])}.get(CACHE_TAG_KEY)
+            cached_ami_id = find_cached_ami(ec2, cache_key) if cache_key and not build_kwargs.get('force') else None
+            if cached_ami_id:
+                result.update(ami_id=cached_ami_id, status='cached', seconds=time.monotonic() - start)
+                return result
+            response = ec2.copy_image(
+                SourceRegion=source['region'],
+                SourceImageId=source['ImageId'],
+                Name=source['Name'],
+                Description=source.get('Description', ''),
+                CopyImageTags=True
+            )
+            result['ami_id'] = response['ImageId']
+            ec2.get_waiter('image_available').wait(ImageIds=[result['ami_id']])
+            result['status'] = 'copied'
+        except Exception as e:
+            result['error'] = str(e)
+            # 复制失败时注销未完成的AMI，避免遗留资源
+            if result['ami_id']:
+                try:
+                    ec2.deregister_image(ImageId=result['ami_id'])
+                except Exception as cleanup_error:
+                    print(f"注销AMI {result['ami_id']} 时出错: {str(cleanup_error)}")
+            result['ami_id'] = None
+        result['seconds'] = time.monotonic() - start
+        return result
+
+    if copy:
+        with ThreadPoolExecutor(max_workers=max_workers or len(architectures)) as pool:
+            sources = list(pool.map(build, [(regions[0], architecture) for architecture in architectures]))
+        results.extend(sources)
+        images = []
+        for source in sources:
+            if source['ami_id']:
+                image = client_factory(regions[0]).describe_images(ImageIds=[source['ami_id']])['Images'][0]
+                image['region'] = regions[0]
+                images.append(image)
+        copies = [(region_name, image) for image in images for region_name in regions[1:]]
+        if copies:
+            with ThreadPoolExecutor(max_workers=max_workers or len(copies)) as pool:
+                results.extend(pool.map(lambda task: copy_to(*task), copies))
+    else:
+        targets = [(region_name, architecture) for region_name in regions for architecture in architectures]
+        with ThreadPoolExecutor(max_workers=max_workers or len(targets)) as pool:
+            results.extend(pool.map(build, targets))
+
+    print_pipeline_summary(results, time.monotonic() - started)
+    return results
+
+
+def print_pipeline_summary(results, wall_clock):
+    print(f"{'region':<18}{'architecture':<14}{'ami_id':<24}{'status':<10}{'seconds':>10}")
+    for result in results:
+        print(f"{result['region']:<18}{result['architecture']:<14}{result['ami_id'] or '-':<24}{result['status']:<10}{result['seconds']:>10.1f}")
+        if result['error']:
+            print(f"    错误: {result['error']}")
+    # 串行执行时的耗时为各任务耗时之和
+    sequential = sum(result['seconds'] for result in results)
+    print(f"串行预计耗时: {sequential:.1f}s，实际耗时: {wall_clock:.1f}s，节省: {sequential - wall_clock:.1f}s")
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("用法: python create_pgpool_ami.py <region_name> [cluster_endpoint] [reader_endpoint] [db_user] [db_password] [instance_type]")
+    parser = argparse.ArgumentParser(description="创建Pgpool-II AMI")
+    parser.add_argument('region_name', help="AWS区域，多个区域用逗号分隔时并发构建")
+    parser.add_argument('cluster_endpoint', nargs='?', default="your-aurora-cluster-endpoint")
+    parser.add_argument('reader_endpoint', nargs='?', default="your-aurora-reader-endpoint")
+    # 数据库用户名和密码已不再写入AMI，保留位置参数以兼容原有命令行
+    parser.add_argument('db_user', nargs='?', default=None, help="已废弃，忽略")
+    parser.add_argument('db_password', nargs='?', default=None, help="已废弃，忽略")
+    parser.add_argument('instance_type', nargs='?', default=None, help="构建实例类型，默认x86_64为t3.micro、arm64为t4g.micro")
+    parser.add_argument('--arch', default='x86_64', help="目标架构x86_64或arm64，多个架构用逗号分隔时并发构建")
+    parser.add_argument('--copy', action='store_true', help="只在第一个区域构建，再复制到其余区域")
+    parser.add_argument('--max-workers', type=int, default=None, help="并发线程数")
+    parser.add_argument('--readiness', choices=['console', 'sleep'], default='console', help="构建完成检测方式")
+    parser.add_argument('--ready-timeout', type=int, default=1800, help="等待构建完成的超时时间（秒）")
+    parser.add_argument('--force', action='store_true', help="忽略缓存AMI，强制重新构建")
+    parser.add_argument('--keep', type=int, default=None, help="构建完成后每个架构只保留最新的N个缓存AMI")
+    parser.add_argument('--pgpool-version', default=PGPOOL_VERSION, help="pgpool-II版本")
+    parser.add_argument('--build-profile', choices=BUILD_PROFILES, default='default', help="编译配置：default(-O2)、optimized(-O2加可移植指令集基线和目标实例族的-mtune)、lto(optimized加LTO)")
+    parser.add_argument('--target-instance-type', default=None, help="运行pgpool的目标实例类型，optimized/lto编译配置据此选择调优参数")
+    parser.add_argument('--artifact-store', default=None, help="编译产物仓库，s3://bucket/prefix")
+    parser.add_argument('--db-instance-class', default='db.t3.medium', help="Aurora实例规格（db.<系列>.<大小>或db.serverless），用于计算pgpool连接参数")
+    parser.add_argument('--pgpool-instances', type=int, default=4, help="pgpool实例数（ASG最大容量），用于计算pgpool连接参数")
+    parser.add_argument('--logging-profile', choices=list(LOGGING_PROFILES), default=DEFAULT_LOGGING_PROFILE, help="pgpool日志配置：debug（记录所有语句）、standard（记录连接）、production（只记录警告和错误）")
+    parser.add_argument('--process-management-mode', choices=list(PROCESS_MANAGEMENT_MODES), default='static', help="pgpool子进程管理方式：static（启动时创建全部子进程）、dynamic（按负载创建和回收，需要pgpool-II 4.4+）")
+    args = parser.parse_args()
+
+    regions = [region.strip() for region in args.region_name.split(',') if region.strip()]
+    architectures = [architecture.strip() for architecture in args.arch.split(',') if architecture.strip()]
+    build_kwargs = dict(
+        cluster_endpoint=args.cluster_endpoint,
+        reader_endpoint=args.reader_endpoint,
+        instance_type=args.instance_type,
+        readiness=args.readiness,
+        ready_timeout=args.ready_timeout,
+        force=args.force,
+        keep_cached=args.keep,
+        pgpool_version=args.pgpool_version,
+        build_profile=args.build_profile,
+        target_instance_type=args.target_instance_type,
+        artifact_store=artifact_store_from_uri(args.artifact_store) if args.artifact_store else None,
+        db_instance_class=args.db_instance_class,
+        pgpool_instances=args.pgpool_instances,
+        logging_profile=args.logging_profile,
+        process_management_mode=args.process_management_mode
+    )
+
+    if len(regions) > 1 or len(architectures) > 1:
+        results = build_pipeline(regions, architectures=architectures, copy=args.copy, max_workers=args.max_workers, **build_kwargs)
+        if not all(result['ami_id'] for result in results):
+            sys.exit(1)
+        sys.exit(0)
+
+    try:
+        ami_id = create_pgpool_ami(regions[0], architecture=architectures[0], **build_kwargs)
+    except AmiBuildError as e:
+        print(f"AMI创建失败: {str(e)}")
         sys.exit(1)
-    
-    region = sys.argv[1]
-    cluster_endpoint = sys.argv[2] if len(sys.argv) > 2 else "your-aurora-cluster-endpoint"
-    reader_endpoint = sys.argv[3] if len(sys.argv) > 3 else "your-aurora-reader-endpoint"
-    db_user = sys.argv[4] if len(sys.argv) > 4 else 'pdadmin'
-    db_password = sys.argv[5] if len(sys.argv) > 5 else '1qaz2wsx'
-    instance_type = sys.argv[6] if len(sys.argv) > 6 else 't3.micro'
-    
-    ami_id = create_pgpool_ami(region, cluster_endpoint, reader_endpoint, db_user, db_password, instance_type)
     if ami_id:
         print(f"成功创建AMI: {ami_id}")
     else:
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import json
 import os
 import sys
 import aws_cdk as cdk
@@ -13,13 +14,78 @@ is_bootstrap = len(sys.argv) > 1 and sys.argv[1] == "bootstrap"
 vpc_id = app.node.try_get_context("vpc_id")
 subnet_ids = app.node.try_get_context("subnet_ids")
 ami_id = app.node.try_get_context("ami_id")
-instance_type = app.node.try_get_context("instance_type") or "t3.medium"
+architecture = app.node.try_get_context("architecture")
+instance_type = app.node.try_get_context("instance_type")
 disk_size = int(app.node.try_get_context("disk_size") or "20")
 min_capacity = int(app.node.try_get_context("min_capacity") or "2")
 max_capacity = int(app.node.try_get_context("max_capacity") or "4")
 desired_capacity = int(app.node.try_get_context("desired_capacity") or "2")
 db_instance_class = app.node.try_get_context("db_instance_class") or "db.t3.medium"
 db_replica_count = int(app.node.try_get_context("db_replica_count") or "1")
+reader_backends = app.node.try_get_context("reader_backends") or "instances"
+reader_weight = int(app.node.try_get_context("reader_weight") or "10")
+writer_weight = int(app.node.try_get_context("writer_weight") or "1")
+discovery_interval = int(app.node.try_get_context("discovery_interval") or "30")
+reader_autoscaling = str(app.node.try_get_context("reader_autoscaling") or "false").lower() == "true"
+min_readers = app.node.try_get_context("min_readers")
+max_readers = int(app.node.try_get_context("max_readers") or "4")
+reader_scaling_metric = app.node.try_get_context("reader_scaling_metric") or "cpu"
+reader_scaling_target = app.node.try_get_context("reader_scaling_target")
+db_max_connections = app.node.try_get_context("db_max_connections")
+query_cache = str(app.node.try_get_context("query_cache") or "false").lower() == "true"
+query_cache_node_type = app.node.try_get_context("query_cache_node_type") or "cache.t4g.small"
+query_cache_ttl = int(app.node.try_get_context("query_cache_ttl") or "60")
+query_cache_auto_invalidation = str(app.node.try_get_context("query_cache_auto_invalidation") or "true").lower() == "true"
+query_cache_tables = app.node.try_get_context("query_cache_tables")
+query_cache_exclude_tables = app.node.try_get_context("query_cache_exclude_tables")
+pool_metrics = str(app.node.try_get_context("pool_metrics") or "true").lower() == "true"
+pool_saturation_target = int(app.node.try_get_context("pool_saturation_target") or "70")
+metrics_interval = int(app.node.try_get_context("metrics_interval") or "60")
+health_check_interval = int(app.node.try_get_context("health_check_interval") or "10")
+health_saturation_threshold = int(app.node.try_get_context("health_saturation_threshold") or "95")
+boot_seconds = app.node.try_get_context("boot_seconds")
+warm_pool = str(app.node.try_get_context("warm_pool") or "false").lower() == "true"
+warm_pool_min_size = int(app.node.try_get_context("warm_pool_min_size") or "0")
+warm_pool_max_prepared = app.node.try_get_context("warm_pool_max_prepared")
+warm_pool_state = app.node.try_get_context("warm_pool_state") or "stopped"
+warm_pool_reuse_on_scale_in = str(app.node.try_get_context("warm_pool_reuse_on_scale_in") or "true").lower() == "true"
+scaling_schedules = app.node.try_get_context("scaling_schedules")
+predictive_scaling = str(app.node.try_get_context("predictive_scaling") or "false").lower() == "true"
+predictive_scaling_mode = app.node.try_get_context("predictive_scaling_mode") or "ForecastAndScale"
+predictive_scaling_metric = app.node.try_get_context("predictive_scaling_metric") or "cpu"
+predictive_scaling_buffer = app.node.try_get_context("predictive_scaling_buffer")
+logging_profile = app.node.try_get_context("logging_profile") or "production"
+log_retention_days = int(app.node.try_get_context("log_retention_days") or "30")
+slow_statement_ms = app.node.try_get_context("slow_statement_ms")
+statement_sample_rate = app.node.try_get_context("statement_sample_rate")
+process_management_mode = app.node.try_get_context("process_management_mode") or "static"
+client_tls = str(app.node.try_get_context("client_tls") or "false").lower() == "true"
+tls_certificate_secret_arn = app.node.try_get_context("tls_certificate_secret_arn")
+tls_min_protocol_version = app.node.try_get_context("tls_min_protocol_version") or "TLSv1.2"
+client_user_secret_arns = app.node.try_get_context("client_user_secret_arns")
+backend_tls = str(app.node.try_get_context("backend_tls") or "false").lower() == "true"
+az_affinity = str(app.node.try_get_context("az_affinity") or "false").lower() == "true"
+remote_reader_weight = int(app.node.try_get_context("remote_reader_weight") or "1")
+serverless_min_acu = float(app.node.try_get_context("serverless_min_acu") or "0.5")
+serverless_max_acu = float(app.node.try_get_context("serverless_max_acu") or "16")
+routing_rules = app.node.try_get_context("routing_rules")
+if isinstance(routing_rules, str):
+    # Path of the JSON file written by analyze_sql_workload.py
+    with open(routing_rules) as f:
+        routing_rules = json.load(f)
+adaptive_weights = str(app.node.try_get_context("adaptive_weights") or "false").lower() == "true"
+weight_cpu_target = float(app.node.try_get_context("weight_cpu_target") or "70")
+max_replica_lag_ms = int(app.node.try_get_context("max_replica_lag_ms") or "1000")
+adaptive_weights_interval = int(app.node.try_get_context("adaptive_weights_interval") or "30")
+capacity_check = app.node.try_get_context("capacity_check") or "warn"
+pgpool_num_init_children = app.node.try_get_context("pgpool_num_init_children")
+pgpool_max_pool = app.node.try_get_context("pgpool_max_pool")
+# 0 turns draining off, so it cannot fall back to the default like the other numbers
+drain_timeout = app.node.try_get_context("drain_timeout")
+drain_timeout = int(drain_timeout) if drain_timeout is not None else 300
+readonly_listener = str(app.node.try_get_context("readonly_listener") or "false").lower() == "true"
+readonly_listener_port = int(app.node.try_get_context("readonly_listener_port") or "5433")
+readonly_children_share = float(app.node.try_get_context("readonly_children_share") or "0.5")
 
 # Validate required parameters - skip for bootstrap
 if not ami_id and not is_bootstrap:
@@ -34,6 +100,7 @@ PgpoolAuroraStack(app, "PgpoolAuroraStack",
     vpc_id=vpc_id,
     subnet_ids=subnet_ids.split(",") if subnet_ids else None,
     ami_id=ami_id,
+    architecture=architecture,
     instance_type=instance_type,
     disk_size=disk_size,
     min_capacity=min_capacity,
@@ -41,6 +108,66 @@ PgpoolAuroraStack(app, "PgpoolAuroraStack",
     desired_capacity=desired_capacity,
     db_instance_class=db_instance_class,
     db_replica_count=db_replica_count,
+    reader_backends=reader_backends,
+    reader_weight=reader_weight,
+    writer_weight=writer_weight,
+    discovery_interval=discovery_interval,
+    reader_autoscaling=reader_autoscaling,
+    min_readers=int(min_readers) if min_readers else None,
+    max_readers=max_readers,
+    reader_scaling_metric=reader_scaling_metric,
+    reader_scaling_target=float(reader_scaling_target) if reader_scaling_target else None,
+    db_max_connections=int(db_max_connections) if db_max_connections else None,
+    query_cache=query_cache,
+    query_cache_node_type=query_cache_node_type,
+    query_cache_ttl=query_cache_ttl,
+    query_cache_auto_invalidation=query_cache_auto_invalidation,
+    query_cache_tables=query_cache_tables.split(",") if query_cache_tables else None,
+    query_cache_exclude_tables=query_cache_exclude_tables.split(",") if query_cache_exclude_tables else None,
+    pool_metrics=pool_metrics,
+    pool_saturation_target=pool_saturation_target,
+    metrics_interval=metrics_interval,
+    health_check_interval=health_check_interval,
+    health_saturation_threshold=health_saturation_threshold,
+    boot_seconds=int(boot_seconds) if boot_seconds else None,
+    warm_pool=warm_pool,
+    warm_pool_min_size=warm_pool_min_size,
+    warm_pool_max_prepared=int(warm_pool_max_prepared) if warm_pool_max_prepared else None,
+    warm_pool_state=warm_pool_state,
+    warm_pool_reuse_on_scale_in=warm_pool_reuse_on_scale_in,
+    # JSON list on the command line (-c scaling_schedules='[...]'), or a list in cdk.json
+    scaling_schedules=json.loads(scaling_schedules) if isinstance(scaling_schedules, str) else scaling_schedules,
+    predictive_scaling=predictive_scaling,
+    predictive_scaling_mode=predictive_scaling_mode,
+    predictive_scaling_metric=predictive_scaling_metric,
+    predictive_scaling_buffer=int(predictive_scaling_buffer) if predictive_scaling_buffer else None,
+    logging_profile=logging_profile,
+    log_retention_days=log_retention_days,
+    # 0 logs every statement, so only an unset value disables slow statement logging
+    slow_statement_ms=int(slow_statement_ms) if slow_statement_ms is not None else None,
+    statement_sample_rate=float(statement_sample_rate) if statement_sample_rate else None,
+    process_management_mode=process_management_mode,
+    client_tls=client_tls,
+    tls_certificate_secret_arn=tls_certificate_secret_arn,
+    tls_min_protocol_version=tls_min_protocol_version,
+    client_user_secret_arns=client_user_secret_arns.split(",") if client_user_secret_arns else None,
+    backend_tls=backend_tls,
+    az_affinity=az_affinity,
+    remote_reader_weight=remote_reader_weight,
+    serverless_min_acu=serverless_min_acu,
+    serverless_max_acu=serverless_max_acu,
+    routing_rules=routing_rules,
+    adaptive_weights=adaptive_weights,
+    weight_cpu_target=weight_cpu_target,
+    max_replica_lag_ms=max_replica_lag_ms,
+    adaptive_weights_interval=adaptive_weights_interval,
+    capacity_check=capacity_check,
+    pgpool_num_init_children=int(pgpool_num_init_children) if pgpool_num_init_children else None,
+    pgpool_max_pool=int(pgpool_max_pool) if pgpool_max_pool else None,
+    drain_timeout=drain_timeout,
+    readonly_listener=readonly_listener,
+    readonly_listener_port=readonly_listener_port,
+    readonly_children_share=readonly_children_share,
     env=cdk.Environment(
         account=os.environ.get("CDK_DEFAULT_ACCOUNT"),
         region=os.environ.get("CDK_DEFAULT_REGION")
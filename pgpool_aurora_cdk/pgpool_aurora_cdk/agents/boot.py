@@ -0,0 +1,293 @@
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import os
+import secrets
+import shutil
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+from .configure import (
+    DEFAULT_CONFIG_PATH, DEFAULT_PGPOOL_CONF, READONLY_PCP_PORT, READONLY_PGPOOL_CONF, configure_pgpool,
+    configure_readonly, load_config,
+)
+from .discovery import describe_readers
+from .drain import DRAIN_MARKER
+from .health import HEALTH_PORT
+from .imds import availability_zone, instance_id
+from .lifecycle import IN_SERVICE, WARMED_PREFIX, LifecycleHook, target_lifecycle_state
+from .metrics import DEFAULT_NAMESPACE
+
+log = logging.getLogger("pgpool-boot")
+
+PCP_CONF = "/usr/local/etc/pcp.conf"
+DEFAULT_PCPPASS = "/etc/pgpool-aurora/pcppass"
+PCP_PORT = 9898
+PCP_USER = "pgpool"
+POOL_HBA = "/usr/local/etc/pool_hba.conf"
+POOL_PASSWD = "/usr/local/etc/pool_passwd"
+# Client TLS: TLS connections only, authenticated by pgpool itself; plaintext and local connections match
+# no line and are rejected
+HOSTSSL_POOL_HBA = """\
+# TYPE  DATABASE    USER        CIDR-ADDRESS          METHOD
+hostssl all         all         0.0.0.0/0             scram-sha-256
+hostssl all         all         ::/0                  scram-sha-256
+"""
+# Grep-able prefix of the boot timeline lines (journal and console)
+TIMELINE_MARKER = "PGPOOL_BOOT_TIMELINE"
+# Written once the one-time preparation is done; later boots (warm pool activation, reboots) skip it
+PREPARED_MARKER = "/var/lib/pgpool-aurora/prepared"
+
+
+class BootTimeline:
+    # Durations of the boot phases plus the kernel uptime at the end, which is what the ASG grace
+    # period and instance warmup have to cover
+    def __init__(self, clock=time.monotonic, uptime=None):
+        self.clock = clock
+        self.uptime = uptime or system_uptime
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            seconds = self.clock() - started
+            self.phases.append((name, seconds))
+            log.info("%s phase=%s seconds=%.2f", TIMELINE_MARKER, name, seconds)
+
+    def summary(self) -> dict:
+        summary = {name: round(seconds, 2) for name, seconds in self.phases}
+        summary["uptime"] = round(self.uptime(), 2)
+        return summary
+
+
+def system_uptime() -> float:
+    with open("/proc/uptime") as f:
+        return float(f.read().split()[0])
+
+
+def write_pcp_credentials(pcp_conf: str = PCP_CONF, pcppass: str = DEFAULT_PCPPASS, owner: str = PCP_USER) -> None:
+    # pcp.conf holds the md5 of a random password (what pg_md5 prints), the agents read it from PCPPASSFILE;
+    # the read-only pgpool shares pcp.conf on its own PCP port
+    password = secrets.token_hex(16)
+    with open(pcp_conf, "w") as f:
+        f.write(f"{PCP_USER}:{hashlib.md5(password.encode()).hexdigest()}\n")
+    os.chmod(pcp_conf, 0o600)
+    shutil.chown(pcp_conf, owner, owner)
+    with open(pcppass, "w") as f:
+        for port in (PCP_PORT, READONLY_PCP_PORT):
+            f.write(f"localhost:{port}:{PCP_USER}:{password}\n")
+    os.chmod(pcppass, 0o600)
+
+
+def write_ssl_certificate(cert: str, key: str, owner: str = PCP_USER, run=subprocess.run) -> None:
+    # pgpool needs a server certificate for ssl = on even when TLS is only wanted towards the backends;
+    # without a certificate secret a self-signed one serves clients using sslmode=require
+    if os.path.exists(cert) and os.path.exists(key):
+        return
+    run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "3650",
+         "-subj", "/CN=pgpool", "-keyout", key, "-out", cert], check=True, capture_output=True)
+    os.chmod(key, 0o600)
+    shutil.chown(key, owner, owner)
+    shutil.chown(cert, owner, owner)
+
+
+def write_secret_certificate(secretsmanager, secret_arn: str, cert: str, key: str, owner: str = PCP_USER) -> None:
+    # PEM "certificate" (chain included) and "private_key" from Secrets Manager, written on every boot
+    # so a rotated certificate is served after the next boot or instance refresh
+    secret = json.loads(secretsmanager.get_secret_value(SecretId=secret_arn)["SecretString"])
+    for path, content, mode in ((cert, secret["certificate"], 0o644), (key, secret["private_key"], 0o600)):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(path, mode)
+        shutil.chown(path, owner, owner)
+
+
+def write_client_auth(secretsmanager, secret_arns: list, pool_hba: str = POOL_HBA, pool_passwd: str = POOL_PASSWD,
+                      owner: str = PCP_USER) -> None:
+    # pgpool needs the clear-text password of every user to log in to Aurora after authenticating the
+    # client with SCRAM ("TEXT" entries); written on every boot, a rotated password applies after the next one
+    entries = []
+    for secret_arn in secret_arns:
+        secret = json.loads(secretsmanager.get_secret_value(SecretId=secret_arn)["SecretString"])
+        entries.append(f"{secret['username']}:TEXT{secret['password']}\n")
+    for path, content in ((pool_hba, HOSTSSL_POOL_HBA), (pool_passwd, "".join(entries))):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(path, 0o600)
+        shutil.chown(path, owner, owner)
+
+
+def reader_placement(rds, cluster_id: str, local_zone=availability_zone):
+    # ({reader host: zone}, this host's zone) for AZ-affine reader weights. Without them the readers are
+    # weighted evenly and pgpool-discovery sets the weights on its first pass.
+    try:
+        local_az = local_zone()
+        readers = describe_readers(rds, cluster_id)
+    except Exception as e:
+        log.warning("Cannot place the Aurora readers, weighting them evenly: %s", e)
+        return {}, None
+    return {r["host"]: r["az"] for r in readers}, local_az
+
+
+def start_services(services: list, run=subprocess.run) -> None:
+    # pgpool and the agents are started here on every boot (none of them is enabled), after the
+    # configuration refresh; restart also covers AMIs that still start pgpool (and pgdoctor) by themselves
+    run(["systemctl", "disable", "--now", "pgdoctor"], capture_output=True)
+    run(["systemctl", "restart", "pgpool"], check=True)
+    if services:
+        run(["systemctl", "restart"] + services, check=True)
+
+
+def stop_services(services: list, run=subprocess.run) -> None:
+    # An instance scaled in back to the warm pool still runs pgpool and the agents
+    run(["systemctl", "stop"] + services + ["pgpool"], capture_output=True)
+
+
+def wait_ready(url: str, timeout: float = 120, interval: float = 1, clock=time.monotonic, sleep=time.sleep,
+               urlopen=urllib.request.urlopen) -> bool:
+    # Ready means pgpool-health reports healthy, i.e. the NLB health check can pass
+    deadline = clock() + timeout
+    while True:
+        try:
+            with urlopen(url, timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass
+        if clock() >= deadline:
+            return False
+        sleep(interval)
+
+
+def boot(config: dict, pgpool_conf: str = DEFAULT_PGPOOL_CONF, pcppass: str = DEFAULT_PCPPASS,
+         readonly_conf: str = READONLY_PGPOOL_CONF,
+         timeline: BootTimeline = None, run=subprocess.run, ready=wait_ready,
+         lifecycle_state=target_lifecycle_state, lifecycle: LifecycleHook = None,
+         prepared_marker: str = PREPARED_MARKER, poll_interval: float = 5, sleep=time.sleep,
+         placement=None, certificate=None, client_auth=None, drain_marker: str = DRAIN_MARKER) -> dict:
+    timeline = timeline or BootTimeline()
+    if not os.path.exists(prepared_marker):
+        with timeline.phase("prepare"):
+            write_pcp_credentials(pcppass=pcppass)
+            pgpool_settings = config.get("pgpool_settings", {})
+            if pgpool_settings.get("ssl") and not certificate:
+                write_ssl_certificate(pgpool_settings["ssl_cert"], pgpool_settings["ssl_key"], run=run)
+            os.makedirs(os.path.dirname(prepared_marker), exist_ok=True)
+            open(prepared_marker, "w").close()
+
+    # A warm pool instance stops here; a stopped one runs this again when it is started for service,
+    # a running or hibernated one keeps (or resumes) waiting. pgpool-drain restarts this step when the
+    # ASG scales the instance in back to the pool, which fires the launch hook again.
+    state = lifecycle_state()
+    activated_at = None
+    if state.startswith(WARMED_PREFIX):
+        log.info("Warm pool instance (%s), pgpool stays stopped until activation", state)
+        stop_services(config.get("services", []), run)
+        if lifecycle:
+            lifecycle.complete()
+        while not state.startswith(IN_SERVICE):
+            sleep(poll_interval)
+            state = lifecycle_state()
+        activated_at = timeline.clock()
+
+    # Fast refresh: renders the backends again, the instance may have waited while the cluster changed
+    with timeline.phase("configure"):
+        reader_zones, local_az = placement() if placement else ({}, None)
+        if certificate:
+            certificate()
+        if client_auth:
+            client_auth()
+        configure_pgpool(config, pgpool_conf, reader_zones=reader_zones, local_az=local_az)
+        if config.get("readonly"):
+            configure_readonly(config, pgpool_conf, readonly_conf, reader_zones=reader_zones, local_az=local_az)
+    with timeline.phase("start"):
+        # Left behind by pgpool-drain on an instance that went back to a running or hibernated warm pool
+        if os.path.exists(drain_marker):
+            os.unlink(drain_marker)
+        start_services(config.get("services", []), run)
+    with timeline.phase("healthy"):
+        health_port = config.get("health", {}).get("port", HEALTH_PORT)
+        is_ready = ready(f"http://127.0.0.1:{health_port}/")
+    if lifecycle:
+        lifecycle.complete()
+    summary = timeline.summary()
+    summary["ready"] = is_ready
+    # Launch-to-ready for a fresh boot, activation-to-ready for a warm instance that never rebooted
+    summary["ready_seconds"] = (
+        round(timeline.clock() - activated_at, 2) if activated_at is not None else summary["uptime"]
+    )
+    return summary
+
+
+def publish_boot_time(cloudwatch, config: dict, summary: dict) -> None:
+    metrics_config = config.get("metrics", {})
+    cloudwatch.put_metric_data(
+        Namespace=metrics_config.get("namespace", DEFAULT_NAMESPACE),
+        MetricData=[{
+            "MetricName": "BootSeconds",
+            "Dimensions": [{"Name": "Fleet", "Value": metrics_config["fleet"]}],
+            "Value": summary["ready_seconds"],
+            "Unit": "Seconds",
+        }],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the pgpool configuration and start the services at boot")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG_PATH)
+    parser.add_argument("--pgpool-conf", default=DEFAULT_PGPOOL_CONF)
+    parser.add_argument("--pcppass", default=DEFAULT_PCPPASS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(levelname)s %(message)s")
+
+    import boto3
+
+    config = load_config(args.config)
+    lifecycle = None
+    if config.get("lifecycle_hook"):
+        lifecycle = LifecycleHook(
+            boto3.client("autoscaling", region_name=config["region"]), config["lifecycle_hook"], instance_id()
+        )
+    placement = None
+    if config.get("az_affinity"):
+        rds = boto3.client("rds", region_name=config["region"])
+        placement = functools.partial(reader_placement, rds, config["cluster_identifier"])
+    certificate = None
+    tls_secret_arn = (config.get("tls") or {}).get("certificate_secret_arn")
+    if tls_secret_arn:
+        pgpool_settings = config["pgpool_settings"]
+        certificate = functools.partial(
+            write_secret_certificate, boto3.client("secretsmanager", region_name=config["region"]), tls_secret_arn,
+            pgpool_settings["ssl_cert"], pgpool_settings["ssl_key"]
+        )
+    client_auth = None
+    user_secret_arns = (config.get("client_auth") or {}).get("user_secret_arns")
+    if user_secret_arns:
+        client_auth = functools.partial(
+            write_client_auth, boto3.client("secretsmanager", region_name=config["region"]), user_secret_arns
+        )
+    summary = boot(config, args.pgpool_conf, args.pcppass, lifecycle=lifecycle, placement=placement,
+                   certificate=certificate, client_auth=client_auth)
+    fields = " ".join(f"{key}={value}" for key, value in summary.items())
+    log.info("%s %s", TIMELINE_MARKER, fields)
+    if not summary["ready"]:
+        log.warning("pgpool-health did not report healthy, boot time not published")
+        return
+    try:
+        publish_boot_time(boto3.client("cloudwatch", region_name=config["region"]), config, summary)
+    except Exception:
+        log.exception("Publishing boot time failed")
+
+
+if __name__ == "__main__":
+    main()
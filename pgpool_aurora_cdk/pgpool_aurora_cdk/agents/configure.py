@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+
+from .pgpool_conf import apply_settings, read_conf, replace_backends, write_conf
+
+DEFAULT_CONFIG_PATH = "/etc/pgpool-aurora/config.json"
+DEFAULT_PGPOOL_CONF = "/usr/local/etc/pgpool.conf"
+PGPOOL_STATUS_FILE = "/var/log/pgpool/pgpool_status"
+BACKEND_PORT = 5432
+MEMCACHED_PORT = 11211
+# Second pgpool instance behind the read-only listener, with its own ports, sockets and status file
+READONLY_PGPOOL_CONF = "/usr/local/etc/pgpool-readonly.conf"
+READONLY_PORT = 9998
+READONLY_PCP_PORT = 9897
+READONLY_RUN_DIR = "/run/pgpool-readonly"
+
+
+def load_config(path: str = DEFAULT_CONFIG_PATH) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def writer_backend(config: dict) -> dict:
+    return {
+        "hostname": config["writer_endpoint"],
+        "port": BACKEND_PORT,
+        "weight": config.get("writer_weight", 1),
+        "flag": "ALWAYS_PRIMARY|DISALLOW_TO_FAILOVER",
+        "data_directory": "/tmp",
+        "application_name": "main",
+    }
+
+
+def reader_backend(host: str, weight: int, index: int) -> dict:
+    # Instance backends may be detached when the reader goes away, so failover must be allowed
+    return {
+        "hostname": host,
+        "port": BACKEND_PORT,
+        "weight": weight,
+        "flag": "ALLOW_TO_FAILOVER",
+        "data_directory": "/tmp",
+        "application_name": f"replica{index}",
+    }
+
+
+def affine_weight(reader_weight: int, remote_reader_weight: int = None, az: str = None,
+                  local_az: str = None) -> int:
+    # With AZ affinity, readers in the pgpool host's own zone take most reads; readers in other zones
+    # keep remote_reader_weight so pgpool falls back to them when the local readers are detached
+    if remote_reader_weight is not None and local_az and az and az != local_az:
+        return remote_reader_weight
+    return reader_weight
+
+
+def render_reader_backends(config: dict, reader_zones: dict = None, local_az: str = None,
+                           first_index: int = 1) -> dict:
+    # reader_zones maps reader hosts to their availability zones (AZ affinity only)
+    reader_weight = config.get("reader_weight", 10)
+    remote_reader_weight = (config.get("az_affinity") or {}).get("remote_reader_weight")
+    if config.get("reader_backends", "instances") == "endpoint":
+        return {first_index: dict(reader_backend(config["reader_endpoint"], reader_weight, first_index),
+                                  flag="DISALLOW_TO_FAILOVER", application_name="replica")}
+    backends = {}
+    for index, host in enumerate(config.get("reader_hosts", []), start=first_index):
+        weight = affine_weight(reader_weight, remote_reader_weight, (reader_zones or {}).get(host), local_az)
+        backends[index] = reader_backend(host, weight, index)
+    return backends
+
+
+def render_backends(config: dict, reader_zones: dict = None, local_az: str = None) -> dict:
+    backends = {0: writer_backend(config)}
+    backends.update(render_reader_backends(config, reader_zones, local_az))
+    return backends
+
+
+def query_cache_settings(cache: dict) -> dict:
+    # Shared memcached query cache. Auto invalidation only reaches entries cached through this pgpool
+    # instance (the table-to-entry map is local), so the TTL bounds staleness across the fleet.
+    return {
+        "memory_cache_enabled": True,
+        "memqcache_method": "memcached",
+        "memqcache_memcached_host": cache["host"],
+        "memqcache_memcached_port": cache.get("port", MEMCACHED_PORT),
+        "memqcache_expire": cache.get("ttl", 60),
+        "memqcache_auto_cache_invalidation": cache.get("auto_invalidation", True),
+        "cache_safe_memqcache_table_list": ",".join(cache.get("include_tables", [])),
+        "cache_unsafe_memqcache_table_list": ",".join(cache.get("exclude_tables", [])),
+    }
+
+
+def configure_pgpool(config: dict, pgpool_conf: str = DEFAULT_PGPOOL_CONF,
+                     status_file: str = PGPOOL_STATUS_FILE, reader_zones: dict = None, local_az: str = None) -> None:
+    # Boot-time render, pgpool must be (re)started afterwards
+    text = replace_backends(read_conf(pgpool_conf), render_backends(config, reader_zones, local_az))
+    # Connection sizing computed by the stack for this instance type (pgpool_aurora_cdk.sizing)
+    text = apply_settings(text, config.get("pgpool_settings", {}))
+    if config.get("query_cache"):
+        text = apply_settings(text, query_cache_settings(config["query_cache"]))
+    write_conf(pgpool_conf, text)
+    # A status file left by a start with placeholder backends would mark the real ones down
+    if os.path.exists(status_file):
+        os.unlink(status_file)
+
+
+def readonly_settings(config: dict) -> dict:
+    # The read-only pgpool has the same reader backends as the main one, with the same weights, and no
+    # writer backend. All readers are in recovery, so pgpool finds no primary and balances every session
+    # over the readers; every function counts as read-only (a write fails on the reader either way) and
+    # there are no query cache lookups. pgpool-discovery and pgpool-weights keep its backends in step.
+    settings = {
+        "port": READONLY_PORT,
+        "pcp_port": READONLY_PCP_PORT,
+        "socket_dir": READONLY_RUN_DIR,
+        "pcp_socket_dir": READONLY_RUN_DIR,
+        "pid_file_name": f"{READONLY_RUN_DIR}/pgpool.pid",
+        "logdir": READONLY_RUN_DIR,
+        "log_filename": "pgpool-readonly-%Y-%m-%d_%H%M%S.log",
+        "backend_clustering_mode": "streaming_replication",
+        "load_balance_mode": True,
+        "statement_level_load_balance": False,
+        "read_only_function_list": ".*",
+        "write_function_list": "",
+        "primary_routing_query_pattern_list": "",
+        # No primary to search for or to measure the replication delay against; pgpool-weights
+        # takes lagging readers out
+        "sr_check_period": 0,
+        "search_primary_node_timeout": 1,
+        "memory_cache_enabled": False,
+    }
+    # Its share of the host's children, computed by the stack (pgpool_aurora_cdk.sizing)
+    settings.update(config["readonly"].get("pgpool_settings", {}))
+    return settings
+
+
+def configure_readonly(config: dict, pgpool_conf: str = DEFAULT_PGPOOL_CONF,
+                       readonly_conf: str = READONLY_PGPOOL_CONF, reader_zones: dict = None,
+                       local_az: str = None) -> None:
+    # Rendered from the main pgpool.conf (authentication, TLS and logging carry over), after it; the
+    # reader backends are numbered from 0
+    backends = render_reader_backends(config, reader_zones, local_az, first_index=0)
+    text = replace_backends(read_conf(pgpool_conf), backends)
+    write_conf(readonly_conf, apply_settings(text, readonly_settings(config)))
+    # pgpool runs as the owner of pgpool.conf and must be able to read its copy
+    stat = os.stat(pgpool_conf)
+    os.chmod(readonly_conf, stat.st_mode & 0o7777)
+    try:
+        os.chown(readonly_conf, stat.st_uid, stat.st_gid)
+    except PermissionError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render pgpool.conf from the stack's host configuration")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG_PATH)
+    parser.add_argument("--pgpool-conf", default=DEFAULT_PGPOOL_CONF)
+    args = parser.parse_args()
+    config = load_config(args.config)
+    configure_pgpool(config, args.pgpool_conf)
+    if config.get("readonly"):
+        configure_readonly(config, args.pgpool_conf)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import subprocess
+
+# pcp_node_info status codes
+NODE_INITIALIZING = 0
+NODE_UP = 1
+NODE_CONNECTED = 2
+NODE_DOWN = 3
+
+
+class PgpoolControlError(Exception):
+    pass
+
+
+class PgpoolControl:
+    # Thin wrapper around systemctl and the PCP client tools; the PCP password is read from PCPPASSFILE
+    def __init__(self, service: str = "pgpool", pcp_host: str = "localhost", pcp_port: int = 9898,
+                 pcp_user: str = "pgpool", bin_dir: str = "/usr/local/bin", run=subprocess.run):
+        self.service = service
+        self.pcp_host = pcp_host
+        self.pcp_port = pcp_port
+        self.pcp_user = pcp_user
+        self.bin_dir = bin_dir
+        self.run = run
+
+    def _call(self, args, timeout=30):
+        try:
+            result = self.run(args, capture_output=True, text=True, timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise PgpoolControlError(f"{args[0]} failed: {e}") from e
+        if result.returncode != 0:
+            raise PgpoolControlError(f"{' '.join(args)} exited with {result.returncode}: {result.stderr.strip()}")
+        return result.stdout
+
+    def pcp(self, command: str, *args, timeout=10) -> str:
+        return self._call([
+            f"{self.bin_dir}/{command}",
+            "-h", self.pcp_host, "-p", str(self.pcp_port), "-U", self.pcp_user, "-w",
+            *args
+        ], timeout=timeout)
+
+    def reload(self) -> None:
+        self._call(["systemctl", "reload", self.service])
+
+    def stop(self) -> None:
+        self._call(["systemctl", "stop", self.service], timeout=60)
+
+    def attach_node(self, node_id: int) -> None:
+        self.pcp("pcp_attach_node", "-n", str(node_id))
+
+    def detach_node(self, node_id: int) -> None:
+        self.pcp("pcp_detach_node", "-n", str(node_id))
+
+    def node_status(self, node_id: int) -> int:
+        # First three fields of pcp_node_info are hostname, port and status code
+        fields = self.pcp("pcp_node_info", "-n", str(node_id)).split()
+        if len(fields) < 3 or not fields[2].isdigit():
+            raise PgpoolControlError(f"Unexpected pcp_node_info output for node {node_id}: {' '.join(fields)}")
+        return int(fields[2])
@@ -0,0 +1,175 @@
+import argparse
+import logging
+import time
+
+from .configure import (DEFAULT_CONFIG_PATH, DEFAULT_PGPOOL_CONF, READONLY_PCP_PORT, READONLY_PGPOOL_CONF,
+                        affine_weight, load_config, reader_backend)
+from .control import NODE_DOWN, PgpoolControl, PgpoolControlError
+from .imds import availability_zone
+from .pgpool_conf import apply_settings, backend_settings, conf_lock, parse_backends, read_conf, write_conf
+
+log = logging.getLogger("pgpool-discovery")
+
+# Instance states in which a reader keeps serving (or is about to serve) connections
+USABLE_STATUSES = {
+    "available",
+    "backing-up",
+    "configuring-enhanced-monitoring",
+    "configuring-iam-database-auth",
+    "configuring-log-exports",
+    "maintenance",
+    "modifying",
+    "storage-optimization",
+}
+
+
+def describe_readers(rds, cluster_id: str) -> list:
+    cluster = rds.describe_db_clusters(DBClusterIdentifier=cluster_id)["DBClusters"][0]
+    writers = {m["DBInstanceIdentifier"] for m in cluster["DBClusterMembers"] if m["IsClusterWriter"]}
+    members = {m["DBInstanceIdentifier"] for m in cluster["DBClusterMembers"]}
+    readers = []
+    kwargs = {"Filters": [{"Name": "db-cluster-id", "Values": [cluster_id]}]}
+    while True:
+        response = rds.describe_db_instances(**kwargs)
+        for instance in response["DBInstances"]:
+            instance_id = instance["DBInstanceIdentifier"]
+            if instance_id in writers or instance_id not in members or not instance.get("Endpoint"):
+                continue
+            readers.append({
+                "id": instance_id,
+                "host": instance["Endpoint"]["Address"],
+                "az": instance.get("AvailabilityZone"),
+                "status": instance["DBInstanceStatus"],
+            })
+        if not response.get("Marker"):
+            return readers
+        kwargs["Marker"] = response["Marker"]
+
+
+class ReaderDiscovery:
+    # Keeps one pgpool backend per Aurora reader instance. New readers are appended and attached after a
+    # reload; readers that disappear (or become the writer) are detached. Backend slots are never removed
+    # because pgpool cannot drop backends on reload, a returning host reuses its old slot.
+    # With local_az set, readers outside the host's zone get remote_reader_weight; weights follow the
+    # readers when they move (failover, replacement) and are applied with a reload. With manage_weights off
+    # (adaptive weights) new backends start at their base weight and pgpool-weights adjusts them.
+    # With readonly_conf set, the read-only pgpool gets the same readers and weights.
+    def __init__(self, rds, cluster_id: str, control: PgpoolControl,
+                 pgpool_conf: str = DEFAULT_PGPOOL_CONF, reader_weight: int = 10,
+                 local_az: str = None, remote_reader_weight: int = None, manage_weights: bool = True,
+                 readonly_conf: str = None, readonly_control: PgpoolControl = None):
+        self.rds = rds
+        self.cluster_id = cluster_id
+        self.control = control
+        self.pgpool_conf = pgpool_conf
+        self.reader_weight = reader_weight
+        self.local_az = local_az
+        self.remote_reader_weight = remote_reader_weight
+        self.manage_weights = manage_weights
+        self.readonly_conf = readonly_conf
+        self.readonly_control = readonly_control
+
+    def weight(self, reader: dict) -> int:
+        return affine_weight(self.reader_weight, self.remote_reader_weight, reader.get("az"), self.local_az)
+
+    def reconcile(self) -> dict:
+        readers = [r for r in describe_readers(self.rds, self.cluster_id) if r["status"] in USABLE_STATUSES]
+        wanted = {r["host"]: self.weight(r) for r in readers}
+        changes = self.reconcile_pgpool(self.pgpool_conf, self.control, wanted, first_index=1)
+        # The read-only pgpool has the same readers from backend 0 on, and slots of its own
+        if self.readonly_conf:
+            readonly = self.reconcile_pgpool(self.readonly_conf, self.readonly_control, wanted, first_index=0)
+            if any(readonly.values()):
+                changes["readonly"] = readonly
+        return changes
+
+    def reconcile_pgpool(self, pgpool_conf: str, control: PgpoolControl, wanted: dict, first_index: int) -> dict:
+        # pgpool-weights rewrites the same file, hold the lock from the read until pgpool has reloaded it
+        with conf_lock(pgpool_conf):
+            text = read_conf(pgpool_conf)
+            backends = parse_backends(text)
+            slots = {b.get("hostname"): index for index, b in backends.items() if index >= first_index}
+
+            changes = {"added": [], "attached": [], "detached": [], "reweighted": []}
+            settings = {}
+            next_index = max(max(backends) + 1, first_index) if backends else first_index
+            for host in sorted(set(wanted) - set(slots)):
+                settings.update(backend_settings(next_index, reader_backend(host, wanted[host], next_index)))
+                changes["added"].append(next_index)
+                next_index += 1
+
+            for host, index in sorted(slots.items(), key=lambda item: item[1]):
+                if self.manage_weights and host in wanted and backends[index].get("weight") != str(wanted[host]):
+                    settings[f"backend_weight{index}"] = wanted[host]
+                    changes["reweighted"].append(index)
+
+            for host, index in sorted(slots.items(), key=lambda item: item[1]):
+                try:
+                    down = control.node_status(index) == NODE_DOWN
+                except PgpoolControlError as e:
+                    log.warning("Cannot read status of %s backend %d (%s): %s", control.service, index, host, e)
+                    continue
+                if host in wanted and down:
+                    changes["attached"].append(index)
+                elif host not in wanted and not down:
+                    changes["detached"].append(index)
+
+            for index in changes["detached"]:
+                log.info("Detaching %s backend %d (%s)", control.service, index, backends[index].get("hostname"))
+                control.detach_node(index)
+
+            if settings:
+                write_conf(pgpool_conf, apply_settings(text, settings))
+                control.reload()
+
+        for index in changes["added"] + changes["attached"]:
+            try:
+                control.attach_node(index)
+                log.info("Attached %s backend %d", control.service, index)
+            except PgpoolControlError as e:
+                # A just-reloaded backend may not be known yet; the next pass retries it as "down"
+                log.warning("Cannot attach %s backend %d yet: %s", control.service, index, e)
+        return changes
+
+    def run(self, interval: float = 30, sleep=time.sleep):
+        while True:
+            try:
+                changes = self.reconcile()
+                if any(changes.values()):
+                    log.info("Backend changes: %s", changes)
+            except Exception:
+                log.exception("Reader discovery pass failed")
+            sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Track Aurora reader instances as pgpool backends")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG_PATH)
+    parser.add_argument("--pgpool-conf", default=DEFAULT_PGPOOL_CONF)
+    parser.add_argument("--once", action="store_true", help="Reconcile once and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(levelname)s %(message)s")
+
+    import boto3
+
+    config = load_config(args.config)
+    discovery = ReaderDiscovery(
+        boto3.client("rds", region_name=config["region"]),
+        config["cluster_identifier"],
+        PgpoolControl(),
+        pgpool_conf=args.pgpool_conf,
+        reader_weight=config.get("reader_weight", 10),
+        local_az=availability_zone() if config.get("az_affinity") else None,
+        remote_reader_weight=(config.get("az_affinity") or {}).get("remote_reader_weight"),
+        manage_weights=not config.get("adaptive_weights"),
+        readonly_conf=READONLY_PGPOOL_CONF if config.get("readonly") else None,
+        readonly_control=PgpoolControl(service="pgpool-readonly", pcp_port=READONLY_PCP_PORT),
+    )
+    if args.once:
+        discovery.reconcile()
+    else:
+        discovery.run(config.get("discovery_interval", 30))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import logging
+import os
+import subprocess
+import time
+
+from .configure import DEFAULT_CONFIG_PATH, READONLY_PCP_PORT, load_config
+from .control import PgpoolControl, PgpoolControlError
+from .imds import instance_id
+from .lifecycle import IN_SERVICE, TERMINATED, WARMED_PREFIX, LifecycleHook, target_lifecycle_state
+from .metrics import parse_proc_info, pool_metrics
+
+log = logging.getLogger("pgpool-drain")
+
+# Present while the host drains; pgpool-health then answers 503 so the NLB sends no new clients.
+# /run is cleared on reboot.
+DRAIN_MARKER = "/run/pgpool-aurora/draining"
+
+
+class ConnectionDrainer:
+    # Drains a host the ASG is terminating (scale-in, rolling update, replacement) or scaling in back to the
+    # warm pool. The termination hook, or the launch hook of a returning instance, keeps the instance running
+    # while the client sessions finish on their own, up to the timeout; only then is pgpool stopped, so the
+    # clients do not all reconnect to the remaining hosts at once.
+    def __init__(self, controls: list, timeout: float = 300, min_wait: float = 20,
+                 poll_interval: float = 5, drain_marker: str = DRAIN_MARKER, clock=time.monotonic,
+                 sleep=time.sleep):
+        # The main pgpool and, with the read-only listener, the read-only one
+        self.controls = controls
+        self.timeout = timeout
+        # New clients may arrive until the NLB has seen enough failed health checks
+        self.min_wait = min_wait
+        self.poll_interval = poll_interval
+        self.drain_marker = drain_marker
+        self.clock = clock
+        self.sleep = sleep
+
+    def active_sessions(self) -> int:
+        # Children with a client attached, idle sessions included
+        sessions = 0
+        for control in self.controls:
+            try:
+                records = parse_proc_info(control.pcp("pcp_proc_info", "--all", "--verbose", timeout=5))
+            except PgpoolControlError as e:
+                log.warning("Cannot list the %s children, assuming no sessions: %s", control.service, e)
+                continue
+            sessions += pool_metrics(records, 0)["busy_children"]
+        return sessions
+
+    def drain(self) -> dict:
+        started = self.clock()
+        os.makedirs(os.path.dirname(self.drain_marker), exist_ok=True)
+        open(self.drain_marker, "w").close()
+        sessions = self.active_sessions()
+        log.info("Draining %d client sessions (timeout %ss)", sessions, self.timeout)
+        while True:
+            elapsed = self.clock() - started
+            if sessions == 0 and elapsed >= self.min_wait:
+                break
+            if elapsed >= self.timeout:
+                log.warning("Drain timeout, closing %d client sessions", sessions)
+                break
+            self.sleep(min(self.poll_interval, max(self.timeout - elapsed, 0)))
+            sessions = self.active_sessions()
+        for control in self.controls:
+            try:
+                control.stop()
+            except PgpoolControlError as e:
+                log.warning("Stopping %s failed: %s", control.service, e)
+        return {"seconds": round(self.clock() - started, 1), "sessions_left": sessions}
+
+
+def wait_for_scale_in(lifecycle_state=target_lifecycle_state, poll_interval: float = 5, sleep=time.sleep) -> str:
+    # The target lifecycle state turns to "Terminated" as soon as the ASG starts terminating the instance,
+    # or to "Warmed:*" when a warm pool with reuse on scale in takes it back. A warm pool state only counts
+    # once the instance has been InService: before that it is still waiting for its activation.
+    in_service = False
+    while True:
+        state = lifecycle_state()
+        if state == TERMINATED or (in_service and state.startswith(WARMED_PREFIX)):
+            return state
+        in_service = in_service or state == IN_SERVICE
+        sleep(poll_interval)
+
+
+def finish_scale_in(state: str, hook: LifecycleHook = None, run=subprocess.run) -> None:
+    if state.startswith(WARMED_PREFIX):
+        # Back in the warm pool the ASG fires the launch hook again: the boot step stops the agents,
+        # completes it and waits for the next activation
+        run(["systemctl", "restart", "--no-block", "pgpool-boot"], check=True)
+    elif hook:
+        hook.complete()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drain pgpool client sessions before the instance terminates")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG_PATH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(levelname)s %(message)s")
+
+    import boto3
+
+    config = load_config(args.config)
+    drain_config = config["drain"]
+    hook = None
+    if drain_config.get("lifecycle_hook"):
+        hook = LifecycleHook(
+            boto3.client("autoscaling", region_name=config["region"]), drain_config["lifecycle_hook"], instance_id()
+        )
+    controls = [PgpoolControl()]
+    if config.get("readonly"):
+        controls.append(PgpoolControl(service="pgpool-readonly", pcp_port=READONLY_PCP_PORT))
+    drainer = ConnectionDrainer(
+        controls,
+        timeout=drain_config.get("timeout", 300),
+        min_wait=drain_config.get("min_wait", 20),
+    )
+    state = wait_for_scale_in()
+    summary = drainer.drain()
+    log.info("Drained in %ss, %d sessions left (%s)", summary["seconds"], summary["sessions_left"], state)
+    finish_scale_in(state, hook)
+
+
+if __name__ == "__main__":
+    main()
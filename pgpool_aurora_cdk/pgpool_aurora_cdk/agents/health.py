@@ -0,0 +1,218 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .configure import BACKEND_PORT, DEFAULT_CONFIG_PATH, READONLY_PCP_PORT, READONLY_PORT, load_config
+from .control import PgpoolControl, PgpoolControlError
+from .drain import DRAIN_MARKER
+from .imds import instance_id
+from .metrics import LISTEN_PORT, listen_backlog, parse_proc_info, pool_metrics
+
+log = logging.getLogger("pgpool-health")
+
+HEALTH_PORT = 8071
+READONLY_PATH = "/readonly"
+
+HEALTHY = "healthy"
+SATURATED = "saturated"
+WRITER_UNREACHABLE = "writer-unreachable"
+PGPOOL_DOWN = "pgpool-down"
+DRAINING = "draining"
+STALE = "stale"
+
+
+class InstanceHealthReporter:
+    # The ASG uses EC2 health checks so that saturated hosts and writer failovers (both 503 for the NLB)
+    # do not get instances replaced; only a pgpool that stays down marks the instance unhealthy
+    def __init__(self, autoscaling, instance_id: str, unhealthy_after: float = 60, clock=time.monotonic):
+        self.autoscaling = autoscaling
+        self.instance_id = instance_id
+        self.unhealthy_after = unhealthy_after
+        self.clock = clock
+        self.down_since = None
+        self.reported = False
+
+    def observe(self, state: str) -> bool:
+        if state != PGPOOL_DOWN:
+            self.down_since = None
+            return False
+        now = self.clock()
+        if self.down_since is None:
+            self.down_since = now
+        if not self.reported and now - self.down_since >= self.unhealthy_after:
+            log.warning("pgpool down for %.0fs, marking %s unhealthy", now - self.down_since, self.instance_id)
+            self.autoscaling.set_instance_health(
+                InstanceId=self.instance_id, HealthStatus="Unhealthy", ShouldRespectGracePeriod=True
+            )
+            self.reported = True
+        return self.reported
+
+
+class HealthMonitor:
+    # Refreshes pgpool's state in the background; probes are answered from the last snapshot so an NLB
+    # health check never opens a backend connection or takes a pgpool child
+    def __init__(self, control: PgpoolControl, writer_host: str, writer_port: int = BACKEND_PORT,
+                 saturation_threshold: float = 95, refresh_interval: float = 2, connect_timeout: float = 1,
+                 listen_port: int = LISTEN_PORT, max_children: int = 0, run_command=subprocess.run,
+                 connect=socket.create_connection, clock=time.monotonic, reporter: InstanceHealthReporter = None,
+                 drain_marker: str = DRAIN_MARKER):
+        self.control = control
+        self.writer_host = writer_host
+        self.writer_port = writer_port
+        self.saturation_threshold = saturation_threshold
+        self.refresh_interval = refresh_interval
+        self.connect_timeout = connect_timeout
+        self.listen_port = listen_port
+        self.max_children = max_children
+        self.run_command = run_command
+        self.connect = connect
+        self.clock = clock
+        self.reporter = reporter
+        self.drain_marker = drain_marker
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    def writer_reachable(self) -> bool:
+        # A TCP handshake with the writer endpoint, no PostgreSQL session
+        try:
+            self.connect((self.writer_host, self.writer_port), timeout=self.connect_timeout).close()
+            return True
+        except OSError:
+            return False
+
+    def sample(self) -> dict:
+        snapshot = {"sampled_at": self.clock()}
+        # A draining host takes no new clients; pgpool is stopped at the end of the drain, which must
+        # not get the terminating instance reported unhealthy
+        if os.path.exists(self.drain_marker):
+            snapshot["state"] = DRAINING
+            return snapshot
+        try:
+            records = parse_proc_info(self.control.pcp("pcp_proc_info", "--all", "--verbose", timeout=5))
+        except PgpoolControlError as e:
+            snapshot.update(state=PGPOOL_DOWN, error=str(e))
+            return snapshot
+        metrics = pool_metrics(records, listen_backlog(self.listen_port, self.run_command), self.max_children)
+        snapshot.update(
+            busy_children_ratio=metrics["busy_children_ratio"],
+            waiting_clients=metrics["waiting_clients"],
+            writer_reachable=self.writer_reachable(),
+        )
+        if not snapshot["writer_reachable"]:
+            snapshot["state"] = WRITER_UNREACHABLE
+        elif metrics["waiting_clients"] > 0 or metrics["busy_children_ratio"] >= self.saturation_threshold:
+            snapshot["state"] = SATURATED
+        else:
+            snapshot["state"] = HEALTHY
+        return snapshot
+
+    def refresh(self) -> dict:
+        try:
+            snapshot = self.sample()
+        except Exception as e:
+            log.exception("Health sample failed")
+            snapshot = {"sampled_at": self.clock(), "state": PGPOOL_DOWN, "error": str(e)}
+        with self.lock:
+            previous = self.snapshot
+            self.snapshot = snapshot
+        if not previous or previous["state"] != snapshot["state"]:
+            log.info("Health state: %s", snapshot["state"])
+        if self.reporter:
+            try:
+                self.reporter.observe(snapshot["state"])
+            except Exception:
+                log.exception("Reporting instance health failed")
+        return snapshot
+
+    def status(self):
+        # (HTTP status, body); a snapshot older than a few refresh rounds means the sampler is stuck
+        with self.lock:
+            snapshot = dict(self.snapshot) if self.snapshot else None
+        if snapshot is None:
+            return 503, {"state": STALE}
+        snapshot["age"] = round(self.clock() - snapshot.pop("sampled_at"), 3)
+        if snapshot["age"] > 3 * self.refresh_interval + 10:
+            snapshot["state"] = STALE
+        return (200 if snapshot["state"] == HEALTHY else 503), snapshot
+
+    def run(self, sleep=time.sleep):
+        while True:
+            started = self.clock()
+            self.refresh()
+            sleep(max(0.0, self.refresh_interval - (self.clock() - started)))
+
+
+def health_server(monitor: HealthMonitor, port: int = HEALTH_PORT, host: str = "0.0.0.0",
+                  readonly: HealthMonitor = None) -> ThreadingHTTPServer:
+    # "/readonly" is the health check of the read-only listener's target group
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") == READONLY_PATH:
+                code, body = readonly.status() if readonly else (404, {"state": "not-configured"})
+            else:
+                code, body = monitor.status()
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve pgpool health from cached pool and writer state")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG_PATH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(levelname)s %(message)s")
+
+    import boto3
+
+    config = load_config(args.config)
+    health_config = config.get("health", {})
+    reporter = InstanceHealthReporter(
+        boto3.client("autoscaling", region_name=config["region"]),
+        instance_id(),
+        unhealthy_after=health_config.get("unhealthy_after", 60),
+    )
+    monitor = HealthMonitor(
+        PgpoolControl(),
+        config["writer_endpoint"],
+        saturation_threshold=health_config.get("saturation_threshold", 95),
+        refresh_interval=health_config.get("refresh_interval", 2),
+        max_children=config.get("pgpool_settings", {}).get("num_init_children", 0),
+        reporter=reporter,
+    )
+    monitor.refresh()
+    threading.Thread(target=monitor.run, name="refresh", daemon=True).start()
+    # The read-only pgpool is checked the same way, against the reader endpoint it forwards to; only a
+    # dead main pgpool gets the instance replaced
+    readonly = None
+    if config.get("readonly"):
+        readonly = HealthMonitor(
+            PgpoolControl(service="pgpool-readonly", pcp_port=READONLY_PCP_PORT),
+            config["reader_endpoint"],
+            saturation_threshold=health_config.get("saturation_threshold", 95),
+            refresh_interval=health_config.get("refresh_interval", 2),
+            listen_port=READONLY_PORT,
+            max_children=config["readonly"].get("pgpool_settings", {}).get("num_init_children", 0),
+        )
+        readonly.refresh()
+        threading.Thread(target=readonly.run, name="refresh-readonly", daemon=True).start()
+    health_server(monitor, health_config.get("port", HEALTH_PORT), readonly=readonly).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
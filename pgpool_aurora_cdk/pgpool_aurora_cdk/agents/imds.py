@@ -0,0 +1,24 @@
+import urllib.request
+
+IMDS_URL = "http://169.254.169.254/latest"
+
+
+def metadata(path: str, timeout: float = 2) -> str:
+    # Instance metadata over IMDSv2 (session token first)
+    token_request = urllib.request.Request(
+        f"{IMDS_URL}/api/token", method="PUT",
+        headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"},
+    )
+    with urllib.request.urlopen(token_request, timeout=timeout) as response:
+        token = response.read().decode()
+    request = urllib.request.Request(f"{IMDS_URL}/meta-data/{path}", headers={"X-aws-ec2-metadata-token": token})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read().decode()
+
+
+def instance_id() -> str:
+    return metadata("instance-id")
+
+
+def availability_zone() -> str:
+    return metadata("placement/availability-zone")
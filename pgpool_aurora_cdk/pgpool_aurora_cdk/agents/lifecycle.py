@@ -0,0 +1,42 @@
+import logging
+
+from .imds import metadata
+
+log = logging.getLogger("pgpool-lifecycle")
+
+# ASG target lifecycle states as reported by the instance metadata
+IN_SERVICE = "InService"
+WARMED_PREFIX = "Warmed:"
+TERMINATED = "Terminated"
+
+
+def target_lifecycle_state(read_metadata=metadata) -> str:
+    # ASG lifecycle state the instance is heading to, e.g. "Warmed:Stopped" or "InService"
+    try:
+        return read_metadata("autoscaling/target-lifecycle-state")
+    except OSError:
+        return IN_SERVICE
+
+
+class LifecycleHook:
+    # Completes a pending ASG lifecycle action of this instance: the launch hook keeps it out of the
+    # warm pool / InService until the boot step is done, the termination hook keeps it running while
+    # pgpool-drain waits for the client sessions
+    def __init__(self, autoscaling, hook_name: str, instance_id: str):
+        self.autoscaling = autoscaling
+        self.hook_name = hook_name
+        self.instance_id = instance_id
+
+    def complete(self) -> None:
+        instances = self.autoscaling.describe_auto_scaling_instances(InstanceIds=[self.instance_id])
+        group = instances["AutoScalingInstances"][0]["AutoScalingGroupName"]
+        try:
+            self.autoscaling.complete_lifecycle_action(
+                LifecycleHookName=self.hook_name,
+                AutoScalingGroupName=group,
+                LifecycleActionResult="CONTINUE",
+                InstanceId=self.instance_id,
+            )
+        except self.autoscaling.exceptions.ClientError as e:
+            # No pending action, e.g. after a plain reboot
+            log.info("Lifecycle hook %s not completed: %s", self.hook_name, e)
@@ -0,0 +1,159 @@
+import argparse
+import logging
+import subprocess
+import time
+
+from .configure import DEFAULT_CONFIG_PATH, load_config
+from .control import PgpoolControl, PgpoolControlError
+
+log = logging.getLogger("pgpool-metrics")
+
+DEFAULT_NAMESPACE = "PgpoolAurora"
+LISTEN_PORT = 9999
+# pcp_proc_info status of a child that has no client attached
+IDLE_CHILD_STATUS = "Wait for connection"
+
+
+def parse_proc_info(text: str) -> list:
+    # pcp_proc_info --all --verbose prints one "Field : value" block per child and pool slot;
+    # a field repeating starts the next record
+    records = []
+    record = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        key, value = key.strip(), value.strip()
+        if key in record:
+            records.append(record)
+            record = {}
+        record[key] = value
+    if record:
+        records.append(record)
+    return records
+
+
+def parse_listen_backlog(text: str) -> int:
+    # "ss -Hltn sport = :9999": Recv-Q of a listening socket is the number of clients waiting to be accepted
+    waiting = 0
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].isdigit():
+            waiting += int(fields[1])
+    return waiting
+
+
+def listen_backlog(port: int = LISTEN_PORT, run_command=subprocess.run) -> int:
+    result = run_command(["ss", "-Hltn", f"sport = :{port}"], capture_output=True, text=True, timeout=10)
+    return parse_listen_backlog(result.stdout)
+
+
+def pool_metrics(records: list, waiting_clients: int, max_children: int = 0) -> dict:
+    # In dynamic process management mode only the forked children are listed; the ratio is taken
+    # against max_children (num_init_children) so it measures the remaining headroom, not the spares
+    children = {}
+    backends = {}
+    for record in records:
+        pid = record.get("PID")
+        if not pid or pid == "0":
+            continue
+        busy = record.get("Status", IDLE_CHILD_STATUS) != IDLE_CHILD_STATUS
+        children[pid] = children.get(pid, False) or busy
+        backend_pid = record.get("Backend PID", "0")
+        if backend_pid and backend_pid != "0":
+            backend = record.get("Backend ID", "0")
+            backends[backend] = backends.get(backend, 0) + 1
+    busy_children = sum(1 for busy in children.values() if busy)
+    return {
+        "children": len(children),
+        "busy_children": busy_children,
+        "busy_children_ratio": 100.0 * busy_children / max(len(children), max_children, 1),
+        "waiting_clients": waiting_clients,
+        "backend_connections": backends,
+    }
+
+
+class PoolMetricsAgent:
+    # Samples pgpool's child usage over PCP (no client slot is needed, unlike SHOW POOL_PROCESSES through
+    # port 9999, which would queue behind the very clients being measured) and publishes it to CloudWatch
+    def __init__(self, control: PgpoolControl, cloudwatch, fleet: str, namespace: str = DEFAULT_NAMESPACE,
+                 listen_port: int = LISTEN_PORT, max_children: int = 0, run_command=subprocess.run):
+        self.control = control
+        self.cloudwatch = cloudwatch
+        self.fleet = fleet
+        self.namespace = namespace
+        self.listen_port = listen_port
+        self.max_children = max_children
+        self.run_command = run_command
+
+    def waiting_clients(self) -> int:
+        return listen_backlog(self.listen_port, self.run_command)
+
+    def collect(self) -> dict:
+        records = parse_proc_info(self.control.pcp("pcp_proc_info", "--all", "--verbose"))
+        return pool_metrics(records, self.waiting_clients(), self.max_children)
+
+    def metric_data(self, metrics: dict) -> list:
+        # Fleet-level series (one dimension) so the ASG policies see the average/maximum across instances
+        dimensions = [{"Name": "Fleet", "Value": self.fleet}]
+        data = [
+            {"MetricName": "BusyChildrenRatio", "Dimensions": dimensions,
+             "Value": metrics["busy_children_ratio"], "Unit": "Percent"},
+            {"MetricName": "BusyChildren", "Dimensions": dimensions,
+             "Value": metrics["busy_children"], "Unit": "Count"},
+            {"MetricName": "Children", "Dimensions": dimensions,
+             "Value": metrics["children"], "Unit": "Count"},
+            {"MetricName": "WaitingClients", "Dimensions": dimensions,
+             "Value": metrics["waiting_clients"], "Unit": "Count"},
+        ]
+        for backend, count in sorted(metrics["backend_connections"].items()):
+            data.append({
+                "MetricName": "BackendConnections",
+                "Dimensions": dimensions + [{"Name": "Backend", "Value": backend}],
+                "Value": count,
+                "Unit": "Count",
+            })
+        return data
+
+    def publish(self) -> dict:
+        metrics = self.collect()
+        self.cloudwatch.put_metric_data(Namespace=self.namespace, MetricData=self.metric_data(metrics))
+        return metrics
+
+    def run(self, interval: float = 60, sleep=time.sleep):
+        while True:
+            try:
+                self.publish()
+            except PgpoolControlError as e:
+                log.warning("Cannot sample pgpool: %s", e)
+            except Exception:
+                log.exception("Publishing pool metrics failed")
+            sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish pgpool pool saturation metrics to CloudWatch")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG_PATH)
+    parser.add_argument("--once", action="store_true", help="Publish once, print the sample and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(levelname)s %(message)s")
+
+    import boto3
+
+    config = load_config(args.config)
+    metrics_config = config.get("metrics", {})
+    agent = PoolMetricsAgent(
+        PgpoolControl(),
+        boto3.client("cloudwatch", region_name=config["region"]),
+        metrics_config["fleet"],
+        namespace=metrics_config.get("namespace", DEFAULT_NAMESPACE),
+        max_children=config.get("pgpool_settings", {}).get("num_init_children", 0),
+    )
+    if args.once:
+        print(agent.publish())
+    else:
+        agent.run(metrics_config.get("interval", 60))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import fcntl
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+_SETTING = re.compile(r"^\s*([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.*?)\s*$")
+# A key on its own line without "= value", as older AMIs wrote allow_clear_text_frontend_auth
+_BARE_KEY = re.compile(r"^\s*([A-Za-z_][A-Za-z0-9_]*)\s*(#.*)?$")
+_BACKEND = re.compile(r"^backend_([a-z_]+?)(\d+)$")
+
+
+def _strip_comment(value: str) -> str:
+    # Drop a trailing "# comment" that is not inside a quoted string
+    quoted = False
+    for i, char in enumerate(value):
+        if char == "'":
+            quoted = not quoted
+        elif char == "#" and not quoted:
+            return value[:i].rstrip()
+    return value
+
+
+def _unquote(value: str) -> str:
+    value = _strip_comment(value)
+    if len(value) >= 2 and value[0] == value[-1] == "'":
+        return value[1:-1].replace("''", "'")
+    return value
+
+
+def format_value(value) -> str:
+    if isinstance(value, bool):
+        return "on" if value else "off"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def parse_settings(text: str) -> dict:
+    settings = {}
+    for line in text.splitlines():
+        match = _SETTING.match(line)
+        if match and not line.lstrip().startswith("#"):
+            settings[match.group(1)] = _unquote(match.group(2))
+    return settings
+
+
+def apply_settings(text: str, settings: dict) -> str:
+    # Replace existing "key = value" (or bare "key") lines in place and append missing keys
+    pending = dict(settings)
+    lines = []
+    for line in text.splitlines():
+        match = _SETTING.match(line) or _BARE_KEY.match(line)
+        if match and not line.lstrip().startswith("#") and match.group(1) in pending:
+            key = match.group(1)
+            lines.append(f"{key} = {format_value(pending.pop(key))}")
+        else:
+            lines.append(line)
+    for key, value in pending.items():
+        lines.append(f"{key} = {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def parse_backends(text: str) -> dict:
+    # {0: {"hostname": ..., "port": "5432", "weight": "1", ...}, 1: {...}}
+    backends = {}
+    for key, value in parse_settings(text).items():
+        match = _BACKEND.match(key)
+        if match:
+            backends.setdefault(int(match.group(2)), {})[match.group(1)] = value
+    return backends
+
+
+def backend_settings(index: int, backend: dict) -> dict:
+    return {f"backend_{field}{index}": value for field, value in backend.items()}
+
+
+def replace_backends(text: str, backends: dict) -> str:
+    # Drop every backend_* line and render the given backends; only valid before pgpool starts,
+    # pgpool cannot remove backends on reload
+    lines = []
+    for line in text.splitlines():
+        match = _SETTING.match(line)
+        if match and _BACKEND.match(match.group(1)):
+            continue
+        lines.append(line)
+    text = "\n".join(lines).rstrip("\n") + "\n"
+    settings = {}
+    for index in sorted(backends):
+        settings.update(backend_settings(index, backends[index]))
+    return apply_settings(text, settings)
+
+
+def read_conf(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+@contextmanager
+def conf_lock(path: str):
+    # Serializes read-modify-write cycles of pgpool.conf between the agents (pgpool-discovery, pgpool-weights).
+    # The lock file sits next to the conf because write_conf replaces the conf file itself.
+    lock_path = os.path.join(os.path.dirname(path) or ".", f".{os.path.basename(path)}.lock")
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_conf(path: str, text: str) -> None:
+    # Atomic replace that keeps the owner and mode of the existing file
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".pgpool-conf-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            os.chmod(tmp_path, stat.st_mode & 0o7777)
+            try:
+                os.chown(tmp_path, stat.st_uid, stat.st_gid)
+            except PermissionError:
+                pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
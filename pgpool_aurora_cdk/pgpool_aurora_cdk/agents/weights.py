@@ -0,0 +1,315 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import subprocess
+import time
+
+from .configure import (BACKEND_PORT, DEFAULT_CONFIG_PATH, DEFAULT_PGPOOL_CONF, READONLY_PCP_PORT,
+                        READONLY_PGPOOL_CONF, affine_weight, load_config)
+from .control import PgpoolControl
+from .discovery import USABLE_STATUSES, describe_readers
+from .imds import availability_zone
+from .pgpool_conf import apply_settings, conf_lock, parse_backends, read_conf, write_conf
+
+log = logging.getLogger("pgpool-weights")
+
+# A signal below its target keeps the full weight; above it the weight falls linearly to the floor at the limit
+DEFAULT_CPU_TARGET = 70.0
+DEFAULT_CPU_LIMIT = 95.0
+DEFAULT_CONNECTIONS_TARGET = 0.8
+DEFAULT_CONNECTIONS_LIMIT = 0.95
+DEFAULT_LAG_TARGET_MS = 100.0
+DEFAULT_LAG_LIMIT_MS = 1000.0
+# Hot readers keep a share of the reads (the writer may be just as busy); lagging readers get none
+LOAD_FLOOR = 0.2
+LAG_FLOOR = 0.0
+# Fraction of the distance to the target weight covered per step, and the smallest change worth a reload
+DEFAULT_DAMPING = 0.3
+MIN_WEIGHT_CHANGE = 0.5
+
+REPLICA_STATUS_QUERY = "SELECT server_id, session_id, replica_lag_in_msec FROM aurora_replica_status()"
+WRITER_SESSION_ID = "MASTER_SESSION_ID"
+
+
+class LoadSourceError(Exception):
+    pass
+
+
+def load_factor(value, target: float, limit: float, floor: float) -> float:
+    if value is None or value <= target:
+        return 1.0
+    if value >= limit:
+        return floor
+    return 1.0 - (1.0 - floor) * (value - target) / (limit - target)
+
+
+def weight_value(weight: float):
+    # pgpool reads backend weights as floating point; whole numbers are written as integers
+    weight = round(max(weight, 0.0), 1)
+    return int(weight) if weight.is_integer() else weight
+
+
+def parse_replica_status(text: str) -> tuple:
+    # psql -At -F, output of REPLICA_STATUS_QUERY -> (writer instance id, {reader instance id: lag in ms})
+    writer = None
+    lags = {}
+    for line in text.splitlines():
+        fields = line.split(",")
+        if len(fields) < 3 or not fields[0]:
+            continue
+        server_id, session_id, lag = fields[0], fields[1], fields[2]
+        if session_id == WRITER_SESSION_ID:
+            writer = server_id
+        else:
+            lags[server_id] = float(lag) if lag else None
+    return writer, lags
+
+
+class AuroraLoadSource:
+    # Replica lag from aurora_replica_status() on the writer (real time, one query for all readers);
+    # CPU and connections of every instance from the AWS/RDS CloudWatch metrics
+    def __init__(self, cloudwatch, secrets, secret_arn: str, writer_host: str, port: int = BACKEND_PORT,
+                 dbname: str = "postgres", window: float = 300, run=subprocess.run, clock=time.time):
+        self.cloudwatch = cloudwatch
+        self.secrets = secrets
+        self.secret_arn = secret_arn
+        self.writer_host = writer_host
+        self.port = port
+        self.dbname = dbname
+        self.window = window
+        self.run = run
+        self.clock = clock
+        self.credentials = None
+
+    def _credentials(self) -> dict:
+        if self.credentials is None:
+            secret = self.secrets.get_secret_value(SecretId=self.secret_arn)
+            self.credentials = json.loads(secret["SecretString"])
+        return self.credentials
+
+    def replica_status(self) -> tuple:
+        credentials = self._credentials()
+        env = dict(os.environ, PGPASSWORD=credentials["password"], PGCONNECT_TIMEOUT="5")
+        args = ["psql", "-h", self.writer_host, "-p", str(self.port), "-U", credentials["username"],
+                "-d", self.dbname, "-AtX", "-F", ",", "-c", REPLICA_STATUS_QUERY]
+        try:
+            result = self.run(args, capture_output=True, text=True, timeout=15, env=env)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise LoadSourceError(f"psql failed: {e}") from e
+        if result.returncode != 0:
+            # The password may have been rotated, fetch it again on the next pass
+            self.credentials = None
+            raise LoadSourceError(f"aurora_replica_status() failed: {result.stderr.strip()}")
+        return parse_replica_status(result.stdout)
+
+    def instance_metrics(self, instance_ids: list) -> dict:
+        # Latest one-minute average of CPUUtilization and DatabaseConnections per instance
+        queries = []
+        for i, instance_id in enumerate(instance_ids):
+            for key, metric in (("cpu", "CPUUtilization"), ("connections", "DatabaseConnections")):
+                queries.append({
+                    "Id": f"{key}{i}",
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": "AWS/RDS",
+                            "MetricName": metric,
+                            "Dimensions": [{"Name": "DBInstanceIdentifier", "Value": instance_id}],
+                        },
+                        "Period": 60,
+                        "Stat": "Average",
+                    },
+                })
+        now = self.clock()
+        response = self.cloudwatch.get_metric_data(
+            MetricDataQueries=queries,
+            StartTime=datetime.datetime.fromtimestamp(now - self.window, datetime.timezone.utc),
+            EndTime=datetime.datetime.fromtimestamp(now, datetime.timezone.utc),
+            ScanBy="TimestampDescending",
+        )
+        metrics = {instance_id: {} for instance_id in instance_ids}
+        for result in response["MetricDataResults"]:
+            if result["Values"]:
+                key = result["Id"].rstrip("0123456789")
+                metrics[instance_ids[int(result["Id"][len(key):])]][key] = result["Values"][0]
+        return metrics
+
+    def sample(self, reader_ids: list) -> dict:
+        # {"writer": instance id, "instances": {instance id: {"cpu", "connections", "lag_ms"}}}
+        writer, lags = self.replica_status()
+        instance_ids = list(reader_ids) + ([writer] if writer else [])
+        instances = self.instance_metrics(instance_ids) if instance_ids else {}
+        for instance_id in reader_ids:
+            instances.setdefault(instance_id, {})["lag_ms"] = lags.get(instance_id)
+        return {"writer": writer, "instances": instances}
+
+
+class WeightController:
+    # Shifts reads away from hot or lagging readers. Each reader's weight is its base weight (reader_weight,
+    # or remote_reader_weight with AZ affinity) scaled by the worst of its CPU, connection and lag factors;
+    # the weight shed by the readers moves to the writer as long as the writer has CPU headroom.
+    # Weights move a damping fraction of the way to the target per step (a lagging reader drops to 0 at
+    # once) and are applied with a reload, which keeps the client sessions.
+    # With readonly_conf set, the read-only pgpool (readers only) gets the same reader weights.
+    def __init__(self, source, control: PgpoolControl, readers, pgpool_conf: str = DEFAULT_PGPOOL_CONF,
+                 writer_weight: float = 1, max_connections: int = None, cpu_target: float = DEFAULT_CPU_TARGET,
+                 cpu_limit: float = DEFAULT_CPU_LIMIT, connections_target: float = DEFAULT_CONNECTIONS_TARGET,
+                 connections_limit: float = DEFAULT_CONNECTIONS_LIMIT, lag_target_ms: float = DEFAULT_LAG_TARGET_MS,
+                 lag_limit_ms: float = DEFAULT_LAG_LIMIT_MS, damping: float = DEFAULT_DAMPING,
+                 readonly_conf: str = None, readonly_control: PgpoolControl = None):
+        # readers() returns {reader host: base weight} for the readers pgpool should use
+        self.source = source
+        self.control = control
+        self.readers = readers
+        self.pgpool_conf = pgpool_conf
+        self.writer_weight = writer_weight
+        self.max_connections = max_connections
+        self.cpu_target = cpu_target
+        self.cpu_limit = cpu_limit
+        self.connections_target = connections_target
+        self.connections_limit = connections_limit
+        self.lag_target_ms = lag_target_ms
+        self.lag_limit_ms = lag_limit_ms
+        self.damping = damping
+        self.readonly_conf = readonly_conf
+        self.readonly_control = readonly_control
+        # Unrounded weights per backend index, carried between steps for smooth damping
+        self.weights = {}
+
+    def cpu_factor(self, metrics: dict) -> float:
+        return load_factor(metrics.get("cpu"), self.cpu_target, self.cpu_limit, LOAD_FLOOR)
+
+    def factor(self, metrics: dict) -> float:
+        connections = metrics.get("connections")
+        usage = connections / self.max_connections if connections is not None and self.max_connections else None
+        return min(
+            self.cpu_factor(metrics),
+            load_factor(usage, self.connections_target, self.connections_limit, LOAD_FLOOR),
+            load_factor(metrics.get("lag_ms"), self.lag_target_ms, self.lag_limit_ms, LAG_FLOOR),
+        )
+
+    def targets(self, slots: dict, base_weights: dict, sample: dict) -> dict:
+        # {backend index: target weight}; slots maps reader hosts to their backend index
+        instances = sample["instances"]
+        targets = {}
+        shed = 0.0
+        for host, index in slots.items():
+            base = base_weights[host]
+            target = base * self.factor(instances.get(host.split(".")[0], {}))
+            targets[index] = target
+            shed += base - target
+        writer_metrics = instances.get(sample["writer"], {}) if sample["writer"] else {}
+        targets[0] = self.writer_weight + shed * self.cpu_factor(writer_metrics)
+        return targets
+
+    def step(self) -> dict:
+        base_weights = self.readers()
+        slots = {b.get("hostname"): index for index, b in parse_backends(read_conf(self.pgpool_conf)).items()
+                 if index > 0 and b.get("hostname") in base_weights}
+        sample = self.source.sample([host.split(".")[0] for host in slots])
+
+        # Sampling is slow and pgpool-discovery may have added backends meanwhile: read the file again under
+        # the lock (slots are never removed) and hold it until pgpool has reloaded
+        with conf_lock(self.pgpool_conf):
+            text = read_conf(self.pgpool_conf)
+            backends = parse_backends(text)
+            settings = {}
+            for index, target in sorted(self.targets(slots, base_weights, sample).items()):
+                current = self.weights.get(index)
+                if current is None:
+                    current = float(backends.get(index, {}).get("weight", target))
+                weight = 0.0 if target == 0 else current + self.damping * (target - current)
+                self.weights[index] = weight
+                applied = float(backends.get(index, {}).get("weight", 0))
+                if abs(weight - applied) >= MIN_WEIGHT_CHANGE or (weight == 0) != (applied == 0):
+                    settings[f"backend_weight{index}"] = weight_value(weight)
+
+            if settings:
+                write_conf(self.pgpool_conf, apply_settings(text, settings))
+                self.control.reload()
+
+        if self.readonly_conf:
+            self.mirror_readonly({host: self.weights[index] for host, index in slots.items()})
+        return settings
+
+    def mirror_readonly(self, weights: dict) -> dict:
+        # {reader host: weight} -> applied read-only backend settings. There is no writer to take the reads
+        # shed by the readers: when every reader is down to 0 they share the reads equally instead.
+        if weights and not any(weights.values()):
+            weights = {host: 1.0 for host in weights}
+        with conf_lock(self.readonly_conf):
+            text = read_conf(self.readonly_conf)
+            settings = {}
+            for index, backend in sorted(parse_backends(text).items()):
+                weight = weights.get(backend.get("hostname"))
+                if weight is None:
+                    continue
+                applied = float(backend.get("weight", 0))
+                if abs(weight - applied) >= MIN_WEIGHT_CHANGE or (weight == 0) != (applied == 0):
+                    settings[f"backend_weight{index}"] = weight_value(weight)
+
+            if settings:
+                write_conf(self.readonly_conf, apply_settings(text, settings))
+                self.readonly_control.reload()
+        return settings
+
+    def run(self, interval: float = 30, sleep=time.sleep):
+        while True:
+            try:
+                settings = self.step()
+                if settings:
+                    log.info("Backend weights: %s", settings)
+            except LoadSourceError as e:
+                log.warning("Cannot sample Aurora load, keeping the weights: %s", e)
+            except Exception:
+                log.exception("Weight adjustment failed")
+            sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adjust pgpool backend weights to Aurora reader load and lag")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG_PATH)
+    parser.add_argument("--pgpool-conf", default=DEFAULT_PGPOOL_CONF)
+    parser.add_argument("--once", action="store_true", help="Adjust once, print the applied weights and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(levelname)s %(message)s")
+
+    import boto3
+
+    config = load_config(args.config)
+    weights_config = config["adaptive_weights"]
+    rds = boto3.client("rds", region_name=config["region"])
+    reader_weight = config.get("reader_weight", 10)
+    remote_reader_weight = (config.get("az_affinity") or {}).get("remote_reader_weight")
+    local_az = availability_zone() if config.get("az_affinity") else None
+
+    def readers():
+        return {r["host"]: affine_weight(reader_weight, remote_reader_weight, r["az"], local_az)
+                for r in describe_readers(rds, config["cluster_identifier"]) if r["status"] in USABLE_STATUSES}
+
+    controller = WeightController(
+        AuroraLoadSource(
+            boto3.client("cloudwatch", region_name=config["region"]),
+            boto3.client("secretsmanager", region_name=config["region"]),
+            weights_config["secret_arn"],
+            config["writer_endpoint"],
+        ),
+        PgpoolControl(),
+        readers,
+        pgpool_conf=args.pgpool_conf,
+        writer_weight=config.get("writer_weight", 1),
+        max_connections=weights_config.get("max_connections"),
+        cpu_target=weights_config.get("cpu_target", DEFAULT_CPU_TARGET),
+        lag_limit_ms=weights_config.get("max_replica_lag_ms", DEFAULT_LAG_LIMIT_MS),
+        readonly_conf=READONLY_PGPOOL_CONF if config.get("readonly") else None,
+        readonly_control=PgpoolControl(service="pgpool-readonly", pcp_port=READONLY_PCP_PORT),
+    )
+    if args.once:
+        print(controller.step())
+    else:
+        controller.run(weights_config.get("interval", 30))
+
+
+if __name__ == "__main__":
+    main()
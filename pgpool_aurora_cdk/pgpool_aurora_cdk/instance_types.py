@@ -0,0 +1,74 @@
+import re
+
+ARCHITECTURES = ("x86_64", "arm64")
+
+# Default pgpool instance type per architecture
+DEFAULT_INSTANCE_TYPES = {
+    "x86_64": "t3.medium",
+    "arm64": "t4g.medium",
+}
+
+# Aurora PostgreSQL instance classes (db.<family>.<size>) per family; db.serverless is Serverless v2
+SERVERLESS_INSTANCE_CLASS = "db.serverless"
+_MEMORY_SIZES = ("large", "xlarge", "2xlarge", "4xlarge", "8xlarge", "12xlarge", "16xlarge")
+AURORA_INSTANCE_CLASSES = {
+    "t3": ("medium", "large"),
+    "t4g": ("medium", "large"),
+    "r5": _MEMORY_SIZES + ("24xlarge",),
+    "r6g": _MEMORY_SIZES,
+    "r6gd": _MEMORY_SIZES,
+    "r6i": _MEMORY_SIZES + ("24xlarge", "32xlarge"),
+    "r6id": _MEMORY_SIZES + ("24xlarge", "32xlarge"),
+    "r7g": _MEMORY_SIZES,
+    "r7i": _MEMORY_SIZES + ("24xlarge", "48xlarge"),
+    "r8g": _MEMORY_SIZES + ("24xlarge", "48xlarge"),
+    "x2g": _MEMORY_SIZES,
+}
+
+_FAMILY_PATTERN = re.compile(r"^([a-z]+)(\d+)([a-z]*)(?:-[a-z]+)?$")
+
+
+def parse_instance_type(instance_type: str):
+    # Split "c7gn.2xlarge" into ("c", 7, "gn", "2xlarge")
+    family, _, size = instance_type.partition(".")
+    match = _FAMILY_PATTERN.match(family)
+    if not match or not size:
+        raise ValueError(f"Unrecognized instance type '{instance_type}'")
+    return match.group(1), int(match.group(2)), match.group(3), size
+
+
+def instance_architecture(instance_type: str) -> str:
+    # Graviton families carry a "g" attribute after the generation (t4g, c7gn, m6gd, is4gen);
+    # a1 is the first-generation Graviton family
+    prefix, generation, attributes, _ = parse_instance_type(instance_type)
+    if (prefix, generation) == ("a", 1) or "g" in attributes:
+        return "arm64"
+    return "x86_64"
+
+
+def validate_instance_architecture(instance_type: str, architecture: str) -> None:
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Unsupported architecture '{architecture}', expected one of {', '.join(ARCHITECTURES)}")
+    actual = instance_architecture(instance_type)
+    if actual != architecture:
+        raise ValueError(
+            f"Instance type '{instance_type}' is {actual} but the pgpool AMI is {architecture}; "
+            f"use an {architecture} instance type such as {DEFAULT_INSTANCE_TYPES[architecture]}"
+        )
+
+
+def parse_db_instance_class(db_instance_class: str) -> str:
+    # "db.r7g.2xlarge" -> "r7g.2xlarge", the EC2 instance type behind a provisioned Aurora instance class
+    prefix, _, instance_type = db_instance_class.partition(".")
+    family, _, size = instance_type.partition(".")
+    if prefix != "db" or family not in AURORA_INSTANCE_CLASSES:
+        raise ValueError(
+            f"Unsupported Aurora instance class '{db_instance_class}', expected {SERVERLESS_INSTANCE_CLASS} or "
+            f"db.<family>.<size> with a family of {', '.join(AURORA_INSTANCE_CLASSES)}"
+        )
+    if size not in AURORA_INSTANCE_CLASSES[family]:
+        raise ValueError(
+            f"Unsupported Aurora instance class '{db_instance_class}', db.{family} comes in "
+            f"{', '.join(AURORA_INSTANCE_CLASSES[family])}"
+        )
+    return instance_type
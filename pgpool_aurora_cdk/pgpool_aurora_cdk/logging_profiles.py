@@ -0,0 +1,44 @@
+# pgpool.conf logging settings per profile. Statement logging writes every query (twice with
+# log_per_node_statement) and log_hostname does a reverse DNS lookup per connection, so only the
+# debug profile keeps them; slow statements are logged by Aurora (log_min_duration_statement) and
+# connection usage is published by pgpool-metrics.
+LOGGING_PROFILES = {
+    "debug": {
+        "log_statement": True,
+        "log_per_node_statement": True,
+        "log_hostname": True,
+        "log_connections": True,
+        "log_disconnections": True,
+        "log_client_messages": False,
+        "log_min_messages": "debug1",
+        "log_error_verbosity": "verbose",
+    },
+    "standard": {
+        "log_statement": False,
+        "log_per_node_statement": False,
+        "log_hostname": False,
+        "log_connections": True,
+        "log_disconnections": True,
+        "log_client_messages": False,
+        "log_min_messages": "warning",
+        "log_error_verbosity": "default",
+    },
+    "production": {
+        "log_statement": False,
+        "log_per_node_statement": False,
+        "log_hostname": False,
+        "log_connections": False,
+        "log_disconnections": False,
+        "log_client_messages": False,
+        "log_min_messages": "warning",
+        "log_error_verbosity": "default",
+    },
+}
+
+DEFAULT_LOGGING_PROFILE = "production"
+
+
+def logging_settings(profile: str) -> dict:
+    if profile not in LOGGING_PROFILES:
+        raise ValueError(f"Unknown logging profile '{profile}', expected one of {', '.join(LOGGING_PROFILES)}")
+    return dict(LOGGING_PROFILES[profile])
@@ -1,13 +1,19 @@
 from aws_cdk import (
+    Annotations,
     Stack,
     aws_ec2 as ec2,
     aws_rds as rds,
     aws_autoscaling as autoscaling,
+    aws_applicationautoscaling as appscaling,
     aws_elasticloadbalancingv2 as elbv2,
     aws_elasticloadbalancingv2_targets as elbv2_targets,
     aws_iam as iam,
     aws_secretsmanager as secretsmanager,
     aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cloudwatch_actions,
+    aws_elasticache as elasticache,
+    aws_s3_assets as s3_assets,
+    aws_logs as logs,
     CfnOutput,
     Duration,
     RemovalPolicy,
@@ -15,22 +21,375 @@ from aws_cdk import (
 )
 from constructs import Construct
 import json
+import math
+import os
+
+from .agents.configure import READONLY_PGPOOL_CONF, READONLY_PORT, READONLY_RUN_DIR
+from .instance_types import (
+    DEFAULT_INSTANCE_TYPES,
+    SERVERLESS_INSTANCE_CLASS,
+    instance_architecture,
+    parse_db_instance_class,
+    validate_instance_architecture,
+)
+from .logging_profiles import DEFAULT_LOGGING_PROFILE, logging_settings
+from .routing import routing_settings
+from .sizing import (
+    aurora_max_connections,
+    capacity_report,
+    check_capacity,
+    pgpool_sizing,
+    split_readonly_children,
+)
+
+READER_BACKEND_MODES = ("instances", "endpoint")
+
+# CloudWatch namespace of the pool metrics published by the pgpool-metrics agent
+POOL_METRICS_NAMESPACE = "PgpoolAurora"
+
+# Aurora replica auto scaling metrics and their default target values
+READER_SCALING_METRICS = {
+    "cpu": (appscaling.PredefinedMetric.RDS_READER_AVERAGE_CPU_UTILIZATION, 70),
+    "connections": (appscaling.PredefinedMetric.RDS_READER_AVERAGE_DATABASE_CONNECTIONS, 500),
+}
+
+# Host agents (pgpool_aurora_cdk.agents) are installed under this prefix on every pgpool instance
+AGENTS_PREFIX = "/opt/pgpool-aurora"
+HOST_CONFIG_PATH = "/etc/pgpool-aurora/config.json"
+PCPPASS_PATH = "/etc/pgpool-aurora/pcppass"
+
+# Launch-to-ready time assumed until a measured value is passed in as boot_seconds
+# (the boot step publishes it as the BootSeconds metric)
+DEFAULT_BOOT_SECONDS = 180
+# Head room of the health check grace period over the measured boot time
+BOOT_GRACE_FACTOR = 1.5
+MIN_BOOT_GRACE_SECONDS = 60
+
+
+def boot_grace(boot_seconds: int) -> Duration:
+    return Duration.seconds(max(MIN_BOOT_GRACE_SECONDS, math.ceil(boot_seconds * BOOT_GRACE_FACTOR)))
+
+
+# Warm pool instance states
+WARM_POOL_STATES = {
+    "stopped": autoscaling.PoolState.STOPPED,
+    "hibernated": autoscaling.PoolState.HIBERNATED,
+    "running": autoscaling.PoolState.RUNNING,
+}
+# Predictive scaling modes and metrics ("pool" forecasts BusyChildrenRatio published by pgpool-metrics)
+PREDICTIVE_SCALING_MODES = ("ForecastAndScale", "ForecastOnly")
+PREDICTIVE_SCALING_METRICS = ("cpu", "pool")
+# Keys of a scheduled scaling action given in scaling_schedules
+SCHEDULE_CAPACITY_KEYS = ("min_capacity", "max_capacity", "desired_capacity")
+
+# "warn" reports connections beyond the Aurora limit (at the maximum size or during the rebalancing surge)
+# as synth warnings, "strict" fails the synth
+CAPACITY_CHECK_MODES = ("warn", "strict")
+
+# pgpool log files (logging_collector) shipped to CloudWatch Logs by the CloudWatch agent
+PGPOOL_LOG_FILES = "/var/log/pgpool/pgpool-*.log"
+CLOUDWATCH_AGENT_CONFIG_PATH = "/opt/aws/amazon-cloudwatch-agent/etc/pgpool-logs.json"
+# Supported log_retention_days values
+LOG_RETENTION_DAYS = {
+    1: logs.RetentionDays.ONE_DAY,
+    3: logs.RetentionDays.THREE_DAYS,
+    7: logs.RetentionDays.ONE_WEEK,
+    14: logs.RetentionDays.TWO_WEEKS,
+    30: logs.RetentionDays.ONE_MONTH,
+    90: logs.RetentionDays.THREE_MONTHS,
+    180: logs.RetentionDays.SIX_MONTHS,
+    365: logs.RetentionDays.ONE_YEAR,
+}
+
+# Server certificate pgpool needs for ssl = on: written by the boot step from tls_certificate_secret_arn,
+# or self-signed when no secret is given
+PGPOOL_SSL_CERT = "/usr/local/etc/server.crt"
+PGPOOL_SSL_KEY = "/usr/local/etc/server.key"
+# Lowest TLS version pgpool accepts from clients with client_tls
+TLS_PROTOCOL_VERSIONS = ("TLSv1.2", "TLSv1.3")
+
+# Aurora Serverless v2 capacity range in ACUs (0.5 ACU steps)
+SERVERLESS_ACU_RANGE = (0.5, 256)
+
+# Launch lifecycle hook completed by the boot step (pgpool_aurora_cdk.agents.boot)
+LAUNCH_HOOK_NAME = "pgpool-launch"
+# How long the boot step waits for pgpool-health to report healthy
+BOOT_READY_TIMEOUT_SECONDS = 120
+# Termination lifecycle hook completed by pgpool-drain (pgpool_aurora_cdk.agents.drain); the hook timeout
+# adds a margin for stopping pgpool, and lifecycle hooks time out after at most 7200 seconds
+DRAIN_HOOK_NAME = "pgpool-terminate"
+DRAIN_HOOK_MARGIN_SECONDS = 60
+MAX_DRAIN_TIMEOUT_SECONDS = 7200 - DRAIN_HOOK_MARGIN_SECONDS
+
+# Second pgpool instance per host behind the read-only listener (rendered by the boot step from pgpool.conf)
+READONLY_PGPOOL_UNIT = f"""
+cat > /etc/systemd/system/pgpool-readonly.service << 'EOF'
+[Unit]
+Description=Pgpool-II read-only listener
+After=network.target
+
+[Service]
+Type=forking
+User=pgpool
+Group=pgpool
+ExecStart=/usr/local/bin/pgpool -f {READONLY_PGPOOL_CONF}
+ExecStop=/usr/local/bin/pgpool -f {READONLY_PGPOOL_CONF} -m fast stop
+ExecReload=/usr/local/bin/pgpool -f {READONLY_PGPOOL_CONF} reload
+PIDFile={READONLY_RUN_DIR}/pgpool.pid
+RuntimeDirectory={os.path.basename(READONLY_RUN_DIR)}
+RuntimeDirectoryMode=0755
+Restart=on-failure
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+EOF
+"""
+
+
+def agent_unit(name: str, description: str, module: str, args: str = "") -> str:
+    # Shell snippet that installs a systemd unit running one of the host agents; the unit is not enabled,
+    # the boot step starts it on every boot once pgpool is configured
+    return f"""
+cat > /etc/systemd/system/{name}.service << 'EOF'
+[Unit]
+Description={description}
+After=pgpool.service
+Wants=pgpool.service
+
+[Service]
+Environment=PYTHONPATH={AGENTS_PREFIX}
+Environment=PCPPASSFILE={PCPPASS_PATH}
+ExecStart=/usr/bin/python3 -m pgpool_aurora_cdk.agents.{module} {HOST_CONFIG_PATH} {args}
+Restart=always
+RestartSec=10
+
+[Install]
+WantedBy=multi-user.target
+EOF
+"""
 
 class PgpoolAuroraStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, 
                  vpc_id: str = None,
                  subnet_ids: list = None,
                  ami_id: str = None,
-                 instance_type: str = "t3.medium",
+                 architecture: str = None,
+                 instance_type: str = None,
                  disk_size: int = 20,
                  min_capacity: int = 2,
                  max_capacity: int = 4,
                  desired_capacity: int = 2,
                  db_instance_class: str = "db.t3.medium",
                  db_replica_count: int = 1,
+                 reader_backends: str = "instances",
+                 reader_weight: int = 10,
+                 writer_weight: int = 1,
+                 discovery_interval: int = 30,
+                 reader_autoscaling: bool = False,
+                 min_readers: int = None,
+                 max_readers: int = 4,
+                 reader_scaling_metric: str = "cpu",
+                 reader_scaling_target: float = None,
+                 db_max_connections: int = None,
+                 query_cache: bool = False,
+                 query_cache_node_type: str = "cache.t4g.small",
+                 query_cache_ttl: int = 60,
+                 query_cache_auto_invalidation: bool = True,
+                 query_cache_tables: list = None,
+                 query_cache_exclude_tables: list = None,
+                 pool_metrics: bool = True,
+                 pool_saturation_target: int = 70,
+                 metrics_interval: int = 60,
+                 health_check_interval: int = 10,
+                 health_saturation_threshold: int = 95,
+                 boot_seconds: int = None,
+                 warm_pool: bool = False,
+                 warm_pool_min_size: int = 0,
+                 warm_pool_max_prepared: int = None,
+                 warm_pool_state: str = "stopped",
+                 warm_pool_reuse_on_scale_in: bool = True,
+                 scaling_schedules: list = None,
+                 predictive_scaling: bool = False,
+                 predictive_scaling_mode: str = "ForecastAndScale",
+                 predictive_scaling_metric: str = "cpu",
+                 predictive_scaling_buffer: int = None,
+                 logging_profile: str = DEFAULT_LOGGING_PROFILE,
+                 log_retention_days: int = 30,
+                 slow_statement_ms: int = None,
+                 statement_sample_rate: float = None,
+                 process_management_mode: str = "static",
+                 client_tls: bool = False,
+                 tls_certificate_secret_arn: str = None,
+                 tls_min_protocol_version: str = "TLSv1.2",
+                 client_user_secret_arns: list = None,
+                 backend_tls: bool = False,
+                 az_affinity: bool = False,
+                 remote_reader_weight: int = 1,
+                 serverless_min_acu: float = 0.5,
+                 serverless_max_acu: float = 16,
+                 routing_rules: dict = None,
+                 adaptive_weights: bool = False,
+                 weight_cpu_target: float = 70,
+                 max_replica_lag_ms: int = 1000,
+                 adaptive_weights_interval: int = 30,
+                 capacity_check: str = "warn",
+                 pgpool_num_init_children: int = None,
+                 pgpool_max_pool: int = None,
+                 drain_timeout: int = 300,
+                 readonly_listener: bool = False,
+                 readonly_listener_port: int = 5433,
+                 readonly_children_share: float = 0.5,
                  **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # Resolve the pgpool instance type for the AMI architecture (x86_64 or arm64)
+        if not instance_type:
+            instance_type = DEFAULT_INSTANCE_TYPES[architecture or "x86_64"]
+        if architecture:
+            validate_instance_architecture(instance_type, architecture)
+        else:
+            architecture = instance_architecture(instance_type)
+
+        if not 5 <= health_check_interval <= 300:
+            raise ValueError("health_check_interval must be between 5 and 300 seconds")
+
+        if boot_seconds is None:
+            boot_seconds = DEFAULT_BOOT_SECONDS
+        elif boot_seconds <= 0:
+            raise ValueError("boot_seconds must be positive")
+
+        if not 0 <= drain_timeout <= MAX_DRAIN_TIMEOUT_SECONDS:
+            raise ValueError(f"drain_timeout must be between 0 and {MAX_DRAIN_TIMEOUT_SECONDS} seconds")
+
+        if readonly_listener:
+            if readonly_listener_port == 5432 or not 1 <= readonly_listener_port <= 65535:
+                raise ValueError("readonly_listener_port must be a port other than 5432")
+            if not 0 < readonly_children_share < 1:
+                raise ValueError("readonly_children_share must be between 0 and 1")
+            # The read-only pgpool balances over the reader instances only; without readers the reader
+            # endpoint resolves to the writer and the "read-only" port would send its load there
+            if db_replica_count < 1:
+                raise ValueError("readonly_listener requires db_replica_count >= 1")
+
+        if warm_pool and warm_pool_state not in WARM_POOL_STATES:
+            raise ValueError(
+                f"Unsupported warm_pool_state '{warm_pool_state}', expected one of {', '.join(WARM_POOL_STATES)}"
+            )
+
+        for schedule in scaling_schedules or []:
+            if not schedule.get("name") or not schedule.get("cron"):
+                raise ValueError("Every scaling schedule needs a name and a cron expression")
+            if not any(schedule.get(key) is not None for key in SCHEDULE_CAPACITY_KEYS):
+                raise ValueError(
+                    f"Scaling schedule '{schedule['name']}' sets none of {', '.join(SCHEDULE_CAPACITY_KEYS)}"
+                )
+
+        # Scheduled actions can raise the group above max_capacity; pgpool is sized for the largest fleet
+        pgpool_fleet_size = max(
+            [max_capacity] + [schedule[key] for schedule in scaling_schedules or []
+                              for key in SCHEDULE_CAPACITY_KEYS if schedule.get(key) is not None]
+        )
+        if capacity_check not in CAPACITY_CHECK_MODES:
+            raise ValueError(
+                f"Unsupported capacity_check '{capacity_check}', expected one of {', '.join(CAPACITY_CHECK_MODES)}"
+            )
+        for name, value in (("pgpool_num_init_children", pgpool_num_init_children),
+                            ("pgpool_max_pool", pgpool_max_pool)):
+            if value is not None and value < 1:
+                raise ValueError(f"{name} must be a positive integer, got {value}")
+
+        if predictive_scaling:
+            if predictive_scaling_mode not in PREDICTIVE_SCALING_MODES:
+                raise ValueError(
+                    f"Unsupported predictive_scaling_mode '{predictive_scaling_mode}', "
+                    f"expected one of {', '.join(PREDICTIVE_SCALING_MODES)}"
+                )
+            if predictive_scaling_metric not in PREDICTIVE_SCALING_METRICS:
+                raise ValueError(
+                    f"Unsupported predictive_scaling_metric '{predictive_scaling_metric}', "
+                    f"expected one of {', '.join(PREDICTIVE_SCALING_METRICS)}"
+                )
+            if predictive_scaling_metric == "pool" and not pool_metrics:
+                raise ValueError("predictive_scaling_metric='pool' requires pool_metrics")
+            # Launch forecast capacity early enough for it to finish booting
+            if predictive_scaling_buffer is None:
+                predictive_scaling_buffer = min(boot_seconds, 3600)
+            if not 0 <= predictive_scaling_buffer <= 3600:
+                raise ValueError("predictive_scaling_buffer must be between 0 and 3600 seconds")
+
+        if tls_certificate_secret_arn and not client_tls:
+            raise ValueError("tls_certificate_secret_arn requires client_tls")
+        if client_user_secret_arns and not client_tls:
+            raise ValueError("client_user_secret_arns requires client_tls")
+        if tls_min_protocol_version not in TLS_PROTOCOL_VERSIONS:
+            raise ValueError(
+                f"Unsupported tls_min_protocol_version '{tls_min_protocol_version}', "
+                f"expected one of {', '.join(TLS_PROTOCOL_VERSIONS)}"
+            )
+
+        pgpool_log_settings = logging_settings(logging_profile)
+        # Read/write routing lists generated by analyze_sql_workload.py
+        pgpool_routing_settings = routing_settings(routing_rules or {})
+        if log_retention_days not in LOG_RETENTION_DAYS:
+            raise ValueError(
+                f"Unsupported log_retention_days {log_retention_days}, "
+                f"expected one of {', '.join(str(days) for days in LOG_RETENTION_DAYS)}"
+            )
+        if slow_statement_ms is not None and slow_statement_ms < 0:
+            raise ValueError("slow_statement_ms must not be negative")
+        if statement_sample_rate is not None and not 0 < statement_sample_rate <= 1:
+            raise ValueError("statement_sample_rate must be greater than 0 and at most 1")
+
+        # db.serverless runs every Aurora instance on Serverless v2 between the min and max ACUs;
+        # anything else must be a provisioned db.<family>.<size> class
+        serverless = db_instance_class == SERVERLESS_INSTANCE_CLASS
+        if serverless:
+            low, high = SERVERLESS_ACU_RANGE
+            if not low <= serverless_min_acu <= serverless_max_acu <= high:
+                raise ValueError(f"Serverless v2 needs {low} <= serverless_min_acu <= serverless_max_acu <= {high}")
+            if (serverless_min_acu * 2) % 1 or (serverless_max_acu * 2) % 1:
+                raise ValueError("Serverless v2 capacity must be a multiple of 0.5 ACU")
+        else:
+            db_instance_type = ec2.InstanceType(parse_db_instance_class(db_instance_class))
+
+        if reader_backends not in READER_BACKEND_MODES:
+            raise ValueError(
+                f"Unsupported reader_backends '{reader_backends}', expected one of {', '.join(READER_BACKEND_MODES)}"
+            )
+        if az_affinity:
+            # Zones are known per reader instance only, the reader endpoint spans all of them
+            if reader_backends != "instances":
+                raise ValueError("az_affinity requires reader_backends='instances'")
+            if not 0 <= remote_reader_weight <= reader_weight:
+                raise ValueError("remote_reader_weight must be between 0 and reader_weight")
+
+        if reader_autoscaling:
+            # Aurora replica auto scaling only adds readers to a cluster that already has one
+            if min_readers is None:
+                min_readers = max(db_replica_count, 1)
+            if db_replica_count < 1 or not 1 <= min_readers <= max_readers:
+                raise ValueError(
+                    "Reader auto scaling needs db_replica_count >= 1 and 1 <= min_readers <= max_readers"
+                )
+            if reader_scaling_metric not in READER_SCALING_METRICS:
+                raise ValueError(
+                    f"Unsupported reader_scaling_metric '{reader_scaling_metric}', "
+                    f"expected one of {', '.join(READER_SCALING_METRICS)}"
+                )
+            # New readers only receive pgpool traffic through the discovery service
+            if reader_backends != "instances":
+                raise ValueError("Reader auto scaling requires reader_backends='instances'")
+
+        if adaptive_weights:
+            # Load and lag are known per reader instance, not for the reader endpoint
+            if reader_backends != "instances":
+                raise ValueError("adaptive_weights requires reader_backends='instances'")
+            if not 0 < weight_cpu_target < 95:
+                raise ValueError("weight_cpu_target must be between 0 and 95 percent")
+            if max_replica_lag_ms <= 100:
+                raise ValueError("max_replica_lag_ms must be above 100 ms")
+
         # Import VPC if provided, otherwise create a new one
         if vpc_id:
             vpc = ec2.Vpc.from_lookup(self, "ImportedVPC", vpc_id=vpc_id)
@@ -112,11 +471,23 @@ class PgpoolAuroraStack(Stack):
             "Allow NLB to access Pgpool on port 9999"
         )
 
-        # Allow NLB to access pgdoctor health check
+        if readonly_listener:
+            nlb_sg.add_ingress_rule(
+                ec2.Peer.any_ipv4(),
+                ec2.Port.tcp(readonly_listener_port),
+                "Allow read-only PostgreSQL traffic from internet"
+            )
+            pgpool_sg.add_ingress_rule(
+                nlb_sg,
+                ec2.Port.tcp(READONLY_PORT),
+                f"Allow NLB to access the read-only Pgpool on port {READONLY_PORT}"
+            )
+
+        # Allow NLB to access the pgpool-health service
         pgpool_sg.add_ingress_rule(
             nlb_sg,
             ec2.Port.tcp(8071),
-            "Allow NLB to access pgdoctor health check on port 8071"
+            "Allow NLB to access the health check on port 8071"
         )
 
         # Create database credentials in Secrets Manager with Aurora PostgreSQL compatible password
@@ -133,33 +504,109 @@ class PgpoolAuroraStack(Stack):
             )
         )
 
-        # Create Aurora PostgreSQL cluster
-        aurora_cluster = rds.DatabaseCluster(
-            self, "AuroraPostgreSQLCluster",
-            engine=rds.DatabaseClusterEngine.aurora_postgres(
-                version=rds.AuroraPostgresEngineVersion.VER_15_4
-            ),
-            instance_props=rds.InstanceProps(
+        # Size pgpool's connection settings for this instance type, fleet size and Aurora class
+        aurora_connections = db_max_connections or aurora_max_connections(
+            db_instance_class, (serverless_min_acu, serverless_max_acu) if serverless else None
+        )
+        pgpool_settings = pgpool_sizing(
+            instance_type,
+            db_instance_class,
+            pgpool_fleet_size,
+            db_max_connections=aurora_connections,
+            process_management_mode=process_management_mode,
+            num_init_children=pgpool_num_init_children,
+            max_pool=pgpool_max_pool
+        )
+        # Check the worst-case fan-out per Aurora instance before anything is deployed
+        connection_capacity = capacity_report(pgpool_settings, pgpool_fleet_size, aurora_connections)
+        for warning in check_capacity(connection_capacity, strict=capacity_check == "strict"):
+            Annotations.of(self).add_warning_v2("pgpool-aurora:connectionCapacity", warning)
+        # The read-only pgpool takes its children out of the same host budget, so the check above holds
+        readonly_pgpool_settings = None
+        if readonly_listener:
+            pgpool_settings, readonly_pgpool_settings = split_readonly_children(
+                pgpool_settings, instance_type, readonly_children_share
+            )
+        # Without client TLS clients authenticate against Aurora itself: pgpool passes their password
+        # through (no passwords in pool_passwd), which only works with pool_hba off
+        pgpool_settings["allow_clear_text_frontend_auth"] = not client_tls
+        # pgpool only logs warnings and errors unless a more verbose logging profile is selected
+        pgpool_settings.update(pgpool_log_settings)
+        # ssl = on makes pgpool answer the clients' SSLRequest and negotiate TLS on its backend connections
+        # as well; pooled backend connections are reused across client sessions, so the backend handshake
+        # is paid once per cached connection.
+        if client_tls or backend_tls:
+            pgpool_settings.update(ssl=True, ssl_cert=PGPOOL_SSL_CERT, ssl_key=PGPOOL_SSL_KEY)
+        if client_tls:
+            # pool_hba (written by the boot step) only accepts hostssl connections, so plaintext clients are
+            # rejected; pgpool authenticates the clients with SCRAM against pool_passwd
+            pgpool_settings.update(ssl_min_protocol_version=tls_min_protocol_version, enable_pool_hba=True,
+                                   pool_passwd="pool_passwd")
+        pgpool_settings.update(pgpool_routing_settings)
+
+        # pgpool cannot log by duration, so slow and sampled statements are logged by Aurora
+        aurora_engine = rds.DatabaseClusterEngine.aurora_postgres(
+            version=rds.AuroraPostgresEngineVersion.VER_15_4
+        )
+        cluster_parameters = {}
+        if slow_statement_ms is not None:
+            cluster_parameters["log_min_duration_statement"] = str(slow_statement_ms)
+        if statement_sample_rate is not None:
+            cluster_parameters["log_min_duration_sample"] = "0"
+            cluster_parameters["log_statement_sample_rate"] = str(statement_sample_rate)
+        # Backend TLS is enforced by Aurora, not just preferred by pgpool
+        if backend_tls:
+            cluster_parameters["rds.force_ssl"] = "1"
+        if cluster_parameters:
+            aurora_parameter_group = rds.ParameterGroup(
+                self, "ClusterParameterGroup",
+                engine=aurora_engine,
+                description="Aurora PostgreSQL parameters for pgpool",
+                parameters=cluster_parameters
+            )
+        else:
+            aurora_parameter_group = rds.ParameterGroup.from_parameter_group_name(
+                self, "ParameterGroup",
+                parameter_group_name="default.aurora-postgresql15"
+            )
+
+        # Serverless v2 instances scale between the min and max ACUs with the load; readers scale with
+        # the writer so a failover never lands on a reader sized for a lighter load
+        if serverless:
+            cluster_instances = dict(
                 vpc=vpc,
                 vpc_subnets=subnet_selection,
-                # 直接使用db_instance_class，不需要再包装到InstanceType中，避免双重"db."前缀
-                instance_type=ec2.InstanceType.of(
-                    ec2.InstanceClass.BURSTABLE3, 
-                    ec2.InstanceSize.MEDIUM
-                ) if db_instance_class == "db.t3.medium" else ec2.InstanceType.of(
-                    ec2.InstanceClass.MEMORY5, 
-                    ec2.InstanceSize.LARGE
-                ),
                 security_groups=[aurora_sg],
-                allow_major_version_upgrade=False,
-                auto_minor_version_upgrade=True,
-            ),
-            instances=1 + db_replica_count,  # 1 writer + N readers
+                writer=rds.ClusterInstance.serverless_v2("Writer", auto_minor_version_upgrade=True),
+                readers=[
+                    rds.ClusterInstance.serverless_v2(
+                        f"Reader{index}", scale_with_writer=True, auto_minor_version_upgrade=True
+                    )
+                    for index in range(1, db_replica_count + 1)
+                ],
+                serverless_v2_min_capacity=serverless_min_acu,
+                serverless_v2_max_capacity=serverless_max_acu,
+            )
+        else:
+            cluster_instances = dict(
+                instance_props=rds.InstanceProps(
+                    vpc=vpc,
+                    vpc_subnets=subnet_selection,
+                    instance_type=db_instance_type,
+                    security_groups=[aurora_sg],
+                    allow_major_version_upgrade=False,
+                    auto_minor_version_upgrade=True,
+                ),
+                instances=1 + db_replica_count,  # 1 writer + N readers
+            )
+
+        # Create Aurora PostgreSQL cluster
+        aurora_cluster = rds.DatabaseCluster(
+            self, "AuroraPostgreSQLCluster",
+            engine=aurora_engine,
+            **cluster_instances,
             credentials=rds.Credentials.from_secret(db_credentials),
-            parameter_group=rds.ParameterGroup.from_parameter_group_name(
-                self, "ParameterGroup",
-                parameter_group_name="default.aurora-postgresql15"
-            ),
+            parameter_group=aurora_parameter_group,
             backup=rds.BackupProps(
                 retention=Duration.days(7),
                 preferred_window="03:00-04:00"
@@ -169,6 +616,67 @@ class PgpoolAuroraStack(Stack):
             cloudwatch_logs_exports=["postgresql"]
         )
 
+        # Scale the Aurora readers on reader load; pgpool-discovery attaches the new instances
+        if reader_autoscaling:
+            reader_scaling = appscaling.ScalableTarget(
+                self, "AuroraReaderScaling",
+                service_namespace=appscaling.ServiceNamespace.RDS,
+                scalable_dimension="rds:cluster:ReadReplicaCount",
+                resource_id=f"cluster:{aurora_cluster.cluster_identifier}",
+                min_capacity=min_readers,
+                max_capacity=max_readers
+            )
+            predefined_metric, default_target = READER_SCALING_METRICS[reader_scaling_metric]
+            reader_scaling.scale_to_track_metric(
+                "ReaderTracking",
+                predefined_metric=predefined_metric,
+                target_value=reader_scaling_target or default_target,
+                # A new Aurora replica takes several minutes to become available
+                scale_out_cooldown=Duration.minutes(5),
+                scale_in_cooldown=Duration.minutes(15)
+            )
+
+        # Shared query result cache: every pgpool instance behind the NLB reads and fills the same memcached
+        query_cache_config = None
+        if query_cache:
+            cache_sg = ec2.SecurityGroup(
+                self, "QueryCacheSecurityGroup",
+                vpc=vpc,
+                description="Security group for the pgpool query cache (memcached)",
+                allow_all_outbound=True
+            )
+            cache_sg.add_ingress_rule(
+                pgpool_sg,
+                ec2.Port.tcp(11211),
+                "Allow Pgpool to access the memcached query cache"
+            )
+            cache_subnet_group = elasticache.CfnSubnetGroup(
+                self, "QueryCacheSubnetGroup",
+                description="Subnets for the pgpool query cache",
+                subnet_ids=vpc.select_subnets(
+                    subnet_type=subnet_selection.subnet_type,
+                    subnets=subnet_selection.subnets
+                ).subnet_ids
+            )
+            # pgpool talks to a single memcached host, so the cache is one node sized by node type
+            cache_cluster = elasticache.CfnCacheCluster(
+                self, "QueryCache",
+                engine="memcached",
+                cache_node_type=query_cache_node_type,
+                num_cache_nodes=1,
+                port=11211,
+                cache_subnet_group_name=cache_subnet_group.ref,
+                vpc_security_group_ids=[cache_sg.security_group_id]
+            )
+            query_cache_config = {
+                "host": cache_cluster.attr_configuration_endpoint_address,
+                "port": 11211,
+                "ttl": query_cache_ttl,
+                "auto_invalidation": query_cache_auto_invalidation,
+                "include_tables": query_cache_tables or [],
+                "exclude_tables": query_cache_exclude_tables or [],
+            }
+
         # Create IAM role for EC2 instances
         pgpool_role = iam.Role(
             self, "PgpoolRole",
@@ -181,65 +689,202 @@ class PgpoolAuroraStack(Stack):
 
         # Grant read access to the database credentials
         db_credentials.grant_read(pgpool_role)
+        # Users pgpool authenticates itself with client TLS, written to pool_passwd by the boot step
+        client_user_secrets = [db_credentials.secret_arn] if client_tls else []
+        for index, arn in enumerate(client_user_secret_arns or []):
+            secretsmanager.Secret.from_secret_complete_arn(
+                self, f"ClientUserSecret{index}", arn
+            ).grant_read(pgpool_role)
+            client_user_secrets.append(arn)
+        # PEM certificate and key for client TLS, written by the boot step
+        if tls_certificate_secret_arn:
+            secretsmanager.Secret.from_secret_complete_arn(
+                self, "TlsCertificateSecret", tls_certificate_secret_arn
+            ).grant_read(pgpool_role)
+
+        # Ship the host agents (backend rendering, reader discovery) to the pgpool instances
+        agents_asset = s3_assets.Asset(
+            self, "PgpoolAgents",
+            path=os.path.dirname(os.path.abspath(__file__)),
+            exclude=["pgpool_aurora_stack.py", "__pycache__", "*.pyc"]
+        )
+        agents_asset.grant_read(pgpool_role)
+
+        # Reader discovery follows the cluster membership through the RDS API
+        if reader_backends == "instances":
+            pgpool_role.add_to_policy(iam.PolicyStatement(
+                actions=["rds:DescribeDBClusters", "rds:DescribeDBInstances"],
+                resources=["*"]
+            ))
+
+        # Host agents run as systemd services next to pgpool
+        agent_services = [("pgpool-health", "pgpool health service for the NLB", "health")]
+        if reader_backends == "instances":
+            agent_services.append(("pgpool-discovery", "Aurora reader discovery for pgpool", "discovery"))
+        if pool_metrics:
+            agent_services.append(("pgpool-metrics", "pgpool pool saturation metrics", "metrics"))
+        if adaptive_weights:
+            agent_services.append(("pgpool-weights", "Adaptive pgpool backend weights", "weights"))
+        # Instances scaled in back to the warm pool are drained as well, and pgpool-drain hands them to the
+        # boot step, which completes the launch hook the ASG fires for them
+        reuse_warm_instances = warm_pool and warm_pool_reuse_on_scale_in
+        if drain_timeout or reuse_warm_instances:
+            agent_services.append(("pgpool-drain", "pgpool client session drain on scale-in", "drain"))
+
+        # Host configuration consumed by the agents
+        host_config = {
+            "region": self.region,
+            "cluster_identifier": aurora_cluster.cluster_identifier,
+            "writer_endpoint": aurora_cluster.cluster_endpoint.hostname,
+            "reader_endpoint": aurora_cluster.cluster_read_endpoint.hostname,
+            "reader_backends": reader_backends,
+            # Readers known at deploy time (the first instance is the initial writer)
+            "reader_hosts": [endpoint.hostname for endpoint in aurora_cluster.instance_endpoints[1:]],
+            "writer_weight": writer_weight,
+            "reader_weight": reader_weight,
+            # Readers in other zones than the pgpool host get remote_reader_weight (boot step and pgpool-discovery)
+            "az_affinity": {"remote_reader_weight": remote_reader_weight} if az_affinity else None,
+            "discovery_interval": discovery_interval,
+            # pgpool-weights scales the reader weights by reader CPU, connections and replica lag
+            # (pgpool-discovery then leaves the weights alone)
+            "adaptive_weights": {
+                "secret_arn": db_credentials.secret_arn,
+                "max_connections": aurora_connections,
+                "cpu_target": weight_cpu_target,
+                "max_replica_lag_ms": max_replica_lag_ms,
+                "interval": adaptive_weights_interval,
+            } if adaptive_weights else None,
+            "pgpool_settings": pgpool_settings,
+            # Secret with the PEM "certificate" (chain included) and "private_key" pgpool serves to clients
+            "tls": {"certificate_secret_arn": tls_certificate_secret_arn} if tls_certificate_secret_arn else None,
+            # Secrets with the "username" and "password" of the users allowed in over client TLS
+            "client_auth": {"user_secret_arns": client_user_secrets} if client_tls else None,
+            "query_cache": query_cache_config,
+            "metrics": {
+                "namespace": POOL_METRICS_NAMESPACE,
+                "fleet": self.stack_name,
+                "interval": metrics_interval,
+            },
+            "health": {
+                "port": 8071,
+                "refresh_interval": 2,
+                "saturation_threshold": health_saturation_threshold,
+                "unhealthy_after": 60,
+            },
+            # Started by the boot step after pgpool
+            "services": (["pgpool-readonly"] if readonly_listener else []) + [name for name, _, _ in agent_services],
+            # Read-only pgpool rendered from pgpool.conf at boot, with its share of the children
+            "readonly": {"pgpool_settings": readonly_pgpool_settings} if readonly_listener else None,
+            # Completed by the boot step once the instance is prepared (warm pool) or ready (InService)
+            "lifecycle_hook": LAUNCH_HOOK_NAME if warm_pool else None,
+            # pgpool-drain waits for the client sessions of a terminating instance, at least until the NLB
+            # has marked it unhealthy (two failed health checks), then completes the termination hook
+            "drain": {
+                "lifecycle_hook": DRAIN_HOOK_NAME if drain_timeout else None,
+                "timeout": drain_timeout,
+                "min_wait": 2 * health_check_interval,
+            } if drain_timeout or reuse_warm_instances else None,
+        }
+
+        # pgpool-health marks its own instance unhealthy when pgpool stays down
+        pgpool_role.add_to_policy(iam.PolicyStatement(
+            actions=["autoscaling:SetInstanceHealth"],
+            resources=["*"]
+        ))
+        if warm_pool or drain_timeout:
+            pgpool_role.add_to_policy(iam.PolicyStatement(
+                actions=["autoscaling:CompleteLifecycleAction", "autoscaling:DescribeAutoScalingInstances"],
+                resources=["*"]
+            ))
+        # pgpool-weights reads the reader CPU and connection metrics
+        if adaptive_weights:
+            pgpool_role.add_to_policy(iam.PolicyStatement(
+                actions=["cloudwatch:GetMetricData"],
+                resources=["*"]
+            ))
+
+        # pgpool logs are written locally and uploaded in the background by the CloudWatch agent
+        pgpool_log_group = logs.LogGroup(
+            self, "PgpoolLogGroup",
+            retention=LOG_RETENTION_DAYS[log_retention_days]
+        )
+        cloudwatch_agent_config = {
+            "logs": {
+                "logs_collected": {
+                    "files": {
+                        "collect_list": [{
+                            "file_path": PGPOOL_LOG_FILES,
+                            "log_group_name": pgpool_log_group.log_group_name,
+                            "log_stream_name": "{instance_id}",
+                            "timestamp_format": "%Y-%m-%d %H:%M:%S",
+                        }]
+                    }
+                }
+            }
+        }
+
+        # systemd units of the host agents (and of the read-only pgpool)
+        agent_units = "".join(agent_unit(*service) for service in agent_services)
+        if readonly_listener:
+            agent_units = READONLY_PGPOOL_UNIT + agent_units
 
         # Create launch template for Pgpool instances
         user_data = ec2.UserData.for_linux()
-        
+        agents_zip = user_data.add_s3_download_command(
+            bucket=agents_asset.bucket,
+            bucket_key=agents_asset.s3_object_key
+        )
+
         # Add user data script to configure Pgpool with Aurora endpoints
         user_data.add_commands(f"""
 #!/bin/bash
-# Get database credentials from Secrets Manager
-DB_CREDS=$(aws secretsmanager get-secret-value --secret-id {db_credentials.secret_arn} --query SecretString --output text)
-DB_USERNAME=$(echo $DB_CREDS | jq -r '.username')
-DB_PASSWORD=$(echo $DB_CREDS | jq -r '.password')
-
-# Update Pgpool configuration with Aurora endpoints
-sed -i "s/backend_hostname0 = '.*'/backend_hostname0 = '{aurora_cluster.cluster_endpoint.hostname}'/" /usr/local/etc/pgpool.conf
-sed -i "s/backend_hostname1 = '.*'/backend_hostname1 = '{aurora_cluster.cluster_read_endpoint.hostname}'/" /usr/local/etc/pgpool.conf
-
-# Ensure allow_clear_text_frontend_auth is enabled with correct value
-if grep -q "allow_clear_text_frontend_auth" /usr/local/etc/pgpool.conf; then
-    sed -i "s/allow_clear_text_frontend_auth.*/allow_clear_text_frontend_auth = on/" /usr/local/etc/pgpool.conf
-else
-    echo "allow_clear_text_frontend_auth = on" >> /usr/local/etc/pgpool.conf
-fi
-
-# Create empty pool_passwd file if it doesn't exist
-if [ ! -f /usr/local/etc/pool_passwd ]; then
-    touch /usr/local/etc/pool_passwd
-    chmod 600 /usr/local/etc/pool_passwd
-    chown pgpool:pgpool /usr/local/etc/pool_passwd
-fi
-
-# Update pgdoctor configuration
-cat > /etc/pgdoctor.cfg << EOF
-# Runtime settings
-http_port = 8071
-syslog_facility = local7
-
-# PostgreSQL connection settings
-pg_host = 127.0.0.1
-pg_port = 9999
-pg_user = $DB_USERNAME
-pg_password = $DB_PASSWORD
-pg_database = postgres
-pg_connection_timeout = 3
-
-# Health check queries through pgpool to Aurora
-"SELECT 1"
+# Install the host agents
+mkdir -p {AGENTS_PREFIX}/pgpool_aurora_cdk $(dirname {HOST_CONFIG_PATH})
+python3 -m zipfile -e {agents_zip} {AGENTS_PREFIX}/pgpool_aurora_cdk
+python3 -c "import boto3" 2>/dev/null || dnf install -y python3-boto3
+
+cat > {HOST_CONFIG_PATH} << 'EOF'
+{self.to_json_string(host_config)}
+EOF
+
+# Ship the pgpool logs to CloudWatch Logs
+[ -x /opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl ] || dnf install -y amazon-cloudwatch-agent
+cat > {CLOUDWATCH_AGENT_CONFIG_PATH} << 'EOF'
+{self.to_json_string(cloudwatch_agent_config)}
 EOF
+/opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s -c file:{CLOUDWATCH_AGENT_CONFIG_PATH}
 
-chmod 644 /etc/pgdoctor.cfg
+# Host agents
+{agent_units}
 
-# Note: We don't need to update pool_passwd file when allow_clear_text_frontend_auth = on
-# as authentication is passed through to the backend PostgreSQL server
+# Boot step, on this and every later boot (warm pool activation, reboot): prepares the PCP credentials
+# once, renders pgpool.conf, then starts pgpool and the agents (the AMI leaves them disabled) and logs
+# the boot timeline. A warm pool instance completes the launch hook and waits for activation instead.
+cat > /etc/systemd/system/pgpool-boot.service << 'EOF'
+[Unit]
+Description=pgpool configuration refresh and start
+After=network-online.target
+Wants=network-online.target
 
-# Restart services
-systemctl restart pgpool
-systemctl restart pgdoctor
+[Service]
+Type=oneshot
+RemainAfterExit=yes
+TimeoutStartSec=infinity
+Environment=PYTHONPATH={AGENTS_PREFIX}
+ExecStart=/usr/bin/python3 -m pgpool_aurora_cdk.agents.boot {HOST_CONFIG_PATH}
+StandardOutput=journal+console
+StandardError=journal+console
+
+[Install]
+WantedBy=multi-user.target
+EOF
+systemctl daemon-reload
+systemctl enable pgpool-boot
+systemctl start --no-block pgpool-boot
         """)
 
         # Create launch template
+        hibernated = warm_pool and warm_pool_state == "hibernated"
         launch_template = ec2.LaunchTemplate(
             self, "PgpoolLaunchTemplate",
             launch_template_name="PgpoolLaunchTemplate",
@@ -250,13 +895,16 @@ systemctl restart pgdoctor
             user_data=user_data,
             role=pgpool_role,
             security_group=pgpool_sg,
+            # Hibernation needs an encrypted root volume large enough for the instance memory
+            hibernation_configured=True if hibernated else None,
             block_devices=[
                 ec2.BlockDevice(
                     device_name="/dev/xvda",
                     volume=ec2.BlockDeviceVolume.ebs(
                         volume_size=disk_size,
                         volume_type=ec2.EbsDeviceVolumeType.GP3,
-                        delete_on_termination=True
+                        delete_on_termination=True,
+                        encrypted=True if hibernated else None
                     )
                 )
             ]
@@ -271,23 +919,170 @@ systemctl restart pgdoctor
             min_capacity=min_capacity,
             max_capacity=max_capacity,
             desired_capacity=desired_capacity,
-            health_check=autoscaling.HealthCheck.elb(
-                grace=Duration.minutes(5)
+            # EC2 checks: the NLB health check also fails for saturated hosts and during writer failover,
+            # which must not replace instances; pgpool-health reports a dead pgpool itself
+            # Grace, warmup and rolling update pause follow the measured boot time
+            health_checks=autoscaling.HealthChecks.ec2(
+                grace_period=boot_grace(boot_seconds)
             ),
+            default_instance_warmup=Duration.seconds(boot_seconds),
             update_policy=autoscaling.UpdatePolicy.rolling_update(
                 min_instances_in_service=1,
                 max_batch_size=1,
-                pause_time=Duration.minutes(5)
+                pause_time=boot_grace(boot_seconds)
             )
         )
 
+        # Warm pool of pre-initialized instances: the boot step prepares them and completes the launch
+        # hook; on activation only the configuration refresh and the service start run
+        if warm_pool:
+            asg.add_warm_pool(
+                min_size=warm_pool_min_size,
+                max_group_prepared_capacity=warm_pool_max_prepared,
+                pool_state=WARM_POOL_STATES[warm_pool_state],
+                reuse_on_scale_in=warm_pool_reuse_on_scale_in
+            )
+            # Holds new instances in Pending:Wait until the boot step is done, both when they enter the
+            # warm pool and when they are activated; an instance whose boot step never finishes is abandoned.
+            # Instances scaled in back to the pool wait in Warmed:Pending:Wait until pgpool-drain is done.
+            launch_hook_seconds = boot_grace(boot_seconds).to_seconds() + BOOT_READY_TIMEOUT_SECONDS
+            if reuse_warm_instances:
+                launch_hook_seconds = max(launch_hook_seconds, drain_timeout + DRAIN_HOOK_MARGIN_SECONDS)
+            asg.add_lifecycle_hook(
+                "LaunchHook",
+                lifecycle_hook_name=LAUNCH_HOOK_NAME,
+                lifecycle_transition=autoscaling.LifecycleTransition.INSTANCE_LAUNCHING,
+                default_result=autoscaling.DefaultResult.ABANDON,
+                heartbeat_timeout=Duration.seconds(launch_hook_seconds)
+            )
+
+        # Holds terminating instances in Terminating:Wait while pgpool-drain lets the client sessions finish;
+        # instances that cannot drain (e.g. stopped in the warm pool) continue when the hook times out
+        if drain_timeout:
+            asg.add_lifecycle_hook(
+                "TerminateHook",
+                lifecycle_hook_name=DRAIN_HOOK_NAME,
+                lifecycle_transition=autoscaling.LifecycleTransition.INSTANCE_TERMINATING,
+                default_result=autoscaling.DefaultResult.CONTINUE,
+                heartbeat_timeout=Duration.seconds(drain_timeout + DRAIN_HOOK_MARGIN_SECONDS)
+            )
+
         # Add CloudWatch alarms for the ASG
         asg.scale_on_cpu_utilization(
             "CpuScaling",
             target_utilization_percent=70,
-            cooldown=Duration.minutes(5)
+            estimated_instance_warmup=Duration.seconds(boot_seconds)
         )
 
+        # pgpool runs out of children long before CPU saturates, so scale on pool usage as well
+        if pool_metrics:
+            fleet_dimensions = {"Fleet": self.stack_name}
+            busy_children_ratio = cloudwatch.Metric(
+                namespace=POOL_METRICS_NAMESPACE,
+                metric_name="BusyChildrenRatio",
+                dimensions_map=fleet_dimensions,
+                statistic="Average",
+                period=Duration.minutes(1)
+            )
+            waiting_clients = cloudwatch.Metric(
+                namespace=POOL_METRICS_NAMESPACE,
+                metric_name="WaitingClients",
+                dimensions_map=fleet_dimensions,
+                statistic="Maximum",
+                period=Duration.minutes(1)
+            )
+            asg.scale_to_track_metric(
+                "PoolSaturationTracking",
+                metric=busy_children_ratio,
+                target_value=pool_saturation_target,
+                estimated_instance_warmup=Duration.seconds(boot_seconds)
+            )
+            # Clients queued in the listen backlog mean every child is taken: add capacity right away.
+            # asg.scale_on_metric always hands the deprecated cooldown to the step action, so build it directly;
+            # steps are relative to the alarm threshold of 1 waiting client
+            waiting_clients_scaling = autoscaling.StepScalingAction(
+                asg,
+                "WaitingClientsScaling",
+                auto_scaling_group=asg,
+                adjustment_type=autoscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+                metric_aggregation_type=autoscaling.MetricAggregationType.MAXIMUM,
+                estimated_instance_warmup=Duration.seconds(boot_seconds)
+            )
+            waiting_clients_scaling.add_adjustment(adjustment=1, lower_bound=0, upper_bound=19)
+            waiting_clients_scaling.add_adjustment(adjustment=2, lower_bound=19)
+            waiting_clients.create_alarm(
+                asg,
+                "WaitingClientsAlarm",
+                threshold=1,
+                evaluation_periods=1,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+                alarm_description="Clients waiting for a pgpool child"
+            ).add_alarm_action(cloudwatch_actions.AutoScalingAction(waiting_clients_scaling))
+
+        # Scheduled capacity for the known daily/weekly ramps, e.g.
+        # {"name": "morning", "cron": "0 7 * * MON-FRI", "min_capacity": 4, "time_zone": "Asia/Shanghai"}
+        for schedule in scaling_schedules or []:
+            asg.scale_on_schedule(
+                f"Schedule-{schedule['name']}",
+                schedule=autoscaling.Schedule.expression(schedule["cron"]),
+                time_zone=schedule.get("time_zone"),
+                **{key: schedule[key] for key in SCHEDULE_CAPACITY_KEYS if schedule.get(key) is not None}
+            )
+
+        # Predictive scaling forecasts the periodic load from up to 14 days of history and launches
+        # capacity ahead of it; the target tracking policies above still handle unforecast load
+        if predictive_scaling:
+            if predictive_scaling_metric == "pool":
+                def pool_metric_query(query_id: str, metric_name: str, stat: str):
+                    return autoscaling.CfnScalingPolicy.MetricDataQueryProperty(
+                        id=query_id,
+                        metric_stat=autoscaling.CfnScalingPolicy.MetricStatProperty(
+                            metric=autoscaling.CfnScalingPolicy.MetricProperty(
+                                namespace=POOL_METRICS_NAMESPACE,
+                                metric_name=metric_name,
+                                dimensions=[autoscaling.CfnScalingPolicy.MetricDimensionProperty(
+                                    name="Fleet", value=self.stack_name
+                                )]
+                            ),
+                            stat=stat
+                        ),
+                        return_data=True
+                    )
+
+                # Scaling metric: average busy children ratio per instance; load: busy children of the fleet
+                metric_specification = autoscaling.CfnScalingPolicy.PredictiveScalingMetricSpecificationProperty(
+                    target_value=pool_saturation_target,
+                    customized_scaling_metric_specification=(
+                        autoscaling.CfnScalingPolicy.PredictiveScalingCustomizedScalingMetricProperty(
+                            metric_data_queries=[pool_metric_query("scaling", "BusyChildrenRatio", "Average")]
+                        )
+                    ),
+                    customized_load_metric_specification=(
+                        autoscaling.CfnScalingPolicy.PredictiveScalingCustomizedLoadMetricProperty(
+                            metric_data_queries=[pool_metric_query("load", "BusyChildren", "Sum")]
+                        )
+                    )
+                )
+            else:
+                metric_specification = autoscaling.CfnScalingPolicy.PredictiveScalingMetricSpecificationProperty(
+                    target_value=70,
+                    predefined_metric_pair_specification=(
+                        autoscaling.CfnScalingPolicy.PredictiveScalingPredefinedMetricPairProperty(
+                            predefined_metric_type="ASGCPUUtilization"
+                        )
+                    )
+                )
+            autoscaling.CfnScalingPolicy(
+                self, "PredictiveScaling",
+                auto_scaling_group_name=asg.auto_scaling_group_name,
+                policy_type="PredictiveScaling",
+                predictive_scaling_configuration=autoscaling.CfnScalingPolicy.PredictiveScalingConfigurationProperty(
+                    metric_specifications=[metric_specification],
+                    mode=predictive_scaling_mode,
+                    scheduling_buffer_time=predictive_scaling_buffer
+                )
+            )
+
         # Create Network Load Balancer
         nlb = elbv2.NetworkLoadBalancer(
             self, "PgpoolNLB",
@@ -296,37 +1091,59 @@ systemctl restart pgdoctor
                 subnet_type=ec2.SubnetType.PUBLIC
             ),
             internet_facing=True,
-            cross_zone_enabled=True,
+            # AZ affinity: clients resolve the NLB address of their own zone and the NLB only forwards
+            # to pgpool hosts in that zone (other zones only when it has no healthy target)
+            cross_zone_enabled=not az_affinity,
+            client_routing_policy=elbv2.ClientRoutingPolicy.AVAILABILITY_ZONE_AFFINITY if az_affinity else None,
             security_groups=[nlb_sg]  # Attach security group directly to NLB
         )
 
-        # Add listener for Pgpool
-        pgpool_listener = nlb.add_listener(
-            "PgpoolListener",
-            port=5432,
-            protocol=elbv2.Protocol.TCP
-        )
+        # Add listener for Pgpool. Always TCP: PostgreSQL clients start TLS in-band with an SSLRequest,
+        # which an NLB TLS listener cannot answer, so client_tls is terminated by pgpool itself
+        def add_pgpool_listener(listener_id: str, port: int):
+            return nlb.add_listener(
+                listener_id,
+                port=port,
+                protocol=elbv2.Protocol.TCP
+            )
+
+        # pgpool-health answers from cached state, so short intervals add no backend load;
+        # saturated hosts return 503 and stop receiving new connections
+        def pgpool_health_check(path: str):
+            return elbv2.HealthCheck(
+                port="8071",
+                protocol=elbv2.Protocol.HTTP,
+                path=path,
+                healthy_threshold_count=2,
+                unhealthy_threshold_count=2,
+                timeout=Duration.seconds(min(5, health_check_interval - 1)),
+                interval=Duration.seconds(health_check_interval)
+            )
 
         # Add target group for Pgpool
-        pgpool_target_group = pgpool_listener.add_targets(
+        add_pgpool_listener("PgpoolListener", 5432).add_targets(
             "PgpoolTargets",
             port=9999,
             protocol=elbv2.Protocol.TCP,
             targets=[asg],
-            health_check=elbv2.HealthCheck(
-                port="8071",
-                protocol=elbv2.Protocol.HTTP,
-                path="/",
-                healthy_threshold_count=2,
-                unhealthy_threshold_count=2,
-                timeout=Duration.seconds(5),
-                interval=Duration.seconds(30)
-            ),
+            health_check=pgpool_health_check("/"),
             deregistration_delay=Duration.seconds(60)
         )
 
+        # Read-only listener: the second pgpool on every host, reader endpoint only
+        if readonly_listener:
+            add_pgpool_listener("PgpoolReadOnlyListener", readonly_listener_port).add_targets(
+                "PgpoolReadOnlyTargets",
+                port=READONLY_PORT,
+                protocol=elbv2.Protocol.TCP,
+                targets=[asg],
+                health_check=pgpool_health_check("/readonly"),
+                deregistration_delay=Duration.seconds(60)
+            )
+
         # Add tags
         Tags.of(self).add("Project", "PgpoolAurora")
+        Tags.of(launch_template).add("Architecture", architecture)
         Tags.of(asg).add("Name", "Pgpool-Instance")
         Tags.of(aurora_cluster).add("Name", "Aurora-PostgreSQL-Cluster")
 
@@ -337,6 +1154,13 @@ systemctl restart pgdoctor
             description="Network Load Balancer endpoint for Pgpool"
         )
 
+        if readonly_listener:
+            CfnOutput(
+                self, "NLBReadOnlyPort",
+                value=str(readonly_listener_port),
+                description="Port of the read-only listener on the NLB endpoint (readers only)"
+            )
+
         CfnOutput(
             self, "AuroraClusterEndpoint",
             value=aurora_cluster.cluster_endpoint.hostname,
@@ -354,3 +1178,21 @@ systemctl restart pgdoctor
             value=db_credentials.secret_arn,
             description="ARN of the database credentials secret"
         )
+
+        CfnOutput(
+            self, "PgpoolLogGroupName",
+            value=pgpool_log_group.log_group_name,
+            description="CloudWatch Logs group of the pgpool logs"
+        )
+
+        CfnOutput(
+            self, "ConnectionCapacity",
+            value=json.dumps(connection_capacity),
+            description="Worst-case backend connections and headroom per Aurora instance, client concurrency ceiling"
+        )
+
+        CfnOutput(
+            self, "AuroraLogGroupName",
+            value=f"/aws/rds/cluster/{aurora_cluster.cluster_identifier}/postgresql",
+            description="CloudWatch Logs group of the exported Aurora PostgreSQL logs"
+        )
@@ -0,0 +1,52 @@
+import re
+
+# pgpool.conf routing lists and their separators; patterns are regular expressions matched
+# case-insensitively against function names or whole queries
+ROUTING_LISTS = {
+    "read_only_function_list": ",",
+    "write_function_list": ",",
+    "primary_routing_query_pattern_list": ";",
+}
+DISABLE_LOAD_BALANCE_ON_WRITE = ("transaction", "trans_transaction", "always", "dml_adaptive")
+
+# Functions that write or depend on session state on the writer; with write_function_list set
+# pgpool no longer checks function volatility, so these are always part of it
+WRITE_FUNCTIONS = (
+    "nextval", "setval", "currval", "lastval",
+    "pg_advisory_.*", "pg_try_advisory_.*", "lo_.*",
+    "pg_notify", "set_config", "txid_current", "pg_current_xact_id", "pg_logical_emit_message",
+)
+
+
+def routing_settings(rules: dict) -> dict:
+    # Routing rules (as written by analyze_sql_workload.py) -> pgpool.conf settings
+    unknown = set(rules) - set(ROUTING_LISTS) - {"disable_load_balance_on_write"}
+    if unknown:
+        raise ValueError(f"Unknown routing rules: {', '.join(sorted(unknown))}")
+    # pgpool accepts only one of the two function lists
+    if rules.get("read_only_function_list") and rules.get("write_function_list"):
+        raise ValueError("read_only_function_list and write_function_list are mutually exclusive")
+
+    settings = {}
+    for key, separator in ROUTING_LISTS.items():
+        if key not in rules:
+            continue
+        for pattern in rules[key]:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"Invalid pattern in {key}: {pattern!r} ({e})")
+            if separator == "," and "," in pattern:
+                raise ValueError(f"Function pattern {pattern!r} in {key} must not contain ','")
+        # A literal ';' inside a query pattern is written as '\;'
+        settings[key] = separator.join(pattern.replace(";", "\\;") for pattern in rules[key])
+
+    mode = rules.get("disable_load_balance_on_write")
+    if mode is not None:
+        if mode not in DISABLE_LOAD_BALANCE_ON_WRITE:
+            raise ValueError(
+                f"Unsupported disable_load_balance_on_write '{mode}', "
+                f"expected one of {', '.join(DISABLE_LOAD_BALANCE_ON_WRITE)}"
+            )
+        settings["disable_load_balance_on_write"] = mode
+    return settings
@@ -0,0 +1,258 @@
+import math
+
+from .instance_types import SERVERLESS_INSTANCE_CLASS, parse_db_instance_class, parse_instance_type
+
+# Burstable sizes have their own vCPU/memory table: size -> (vCPUs, GiB)
+BURSTABLE_SIZES = {
+    "nano": (2, 0.5),
+    "micro": (2, 1),
+    "small": (2, 2),
+    "medium": (2, 4),
+    "large": (2, 8),
+    "xlarge": (4, 16),
+    "2xlarge": (8, 32),
+}
+
+# Memory per vCPU of the other families, by family prefix
+GIB_PER_VCPU = {
+    "a": 2,
+    "c": 2,
+    "m": 4,
+    "r": 8,
+    "x": 16,
+    "z": 8,
+}
+
+# Aurora PostgreSQL default: max_connections = LEAST(DBInstanceClassMemory / 9531392, 5000);
+# DBInstanceClassMemory is the class memory minus what the engine reserves (roughly 10%)
+AURORA_CONNECTION_BYTES = 9531392
+AURORA_MAX_CONNECTIONS = 5000
+AURORA_USABLE_MEMORY = 0.9
+# Serverless v2 derives max_connections from the memory of its maximum capacity (2 GiB per ACU); with a
+# minimum below 1 ACU it is capped at 2000
+GIB_PER_ACU = 2
+LOW_MIN_CAPACITY_MAX_CONNECTIONS = 2000
+DEFAULT_SERVERLESS_CAPACITY = (0.5, 16)
+
+# Backend connections kept free for superusers, monitoring and pgpool's own health checks
+MIN_RESERVED_CONNECTIONS = 10
+RESERVED_CONNECTIONS_RATIO = 0.05
+
+# pgpool child budget on the pgpool host
+CHILDREN_PER_VCPU = 32
+CHILD_MEMORY_MIB = 8
+SYSTEM_MEMORY_MIB = 512
+MIN_CHILDREN = 8
+MAX_POOL = 4
+
+# process_management_mode: "static" pre-forks num_init_children; "dynamic" (pgpool 4.4+) keeps between
+# min_spare_children and max_spare_children idle children and treats num_init_children as the ceiling
+PROCESS_MANAGEMENT_MODES = ("static", "dynamic")
+DYNAMIC_PROCESS_MANAGEMENT_VERSION = (4, 4)
+SPARE_CHILDREN_PER_VCPU = 4
+MIN_SPARE_CHILDREN = 5
+
+# Capacity check: how far EC2 Auto Scaling may exceed the group's maximum while rebalancing zones
+REBALANCE_SURGE_RATIO = 0.1
+
+
+def instance_resources(instance_type: str):
+    # (vCPUs, memory MiB) of an EC2 instance type, or of a "db." instance class
+    if instance_type.startswith("db."):
+        instance_type = instance_type[len("db."):]
+    prefix, _, _, size = parse_instance_type(instance_type)
+    if prefix == "t":
+        if size not in BURSTABLE_SIZES:
+            raise ValueError(f"Unrecognized burstable instance size '{instance_type}'")
+        vcpus, gib = BURSTABLE_SIZES[size]
+        return vcpus, int(gib * 1024)
+    if size == "medium":
+        vcpus = 1
+    elif size == "large":
+        vcpus = 2
+    elif size == "xlarge":
+        vcpus = 4
+    elif size.endswith("xlarge") and size[:-len("xlarge")].isdigit():
+        vcpus = 4 * int(size[:-len("xlarge")])
+    else:
+        raise ValueError(f"Cannot size instance type '{instance_type}'")
+    if prefix not in GIB_PER_VCPU:
+        raise ValueError(f"Unknown memory ratio for instance family '{instance_type}'")
+    return vcpus, vcpus * GIB_PER_VCPU[prefix] * 1024
+
+
+def aurora_max_connections(db_instance_class: str, serverless_capacity: tuple = None) -> int:
+    # serverless_capacity is the (minimum, maximum) ACU pair of a db.serverless cluster
+    if db_instance_class == SERVERLESS_INSTANCE_CLASS:
+        min_capacity, max_capacity = serverless_capacity or DEFAULT_SERVERLESS_CAPACITY
+        memory_mib = max_capacity * GIB_PER_ACU * 1024
+    else:
+        _, memory_mib = instance_resources("db." + parse_db_instance_class(db_instance_class))
+    usable_bytes = memory_mib * 1024 * 1024 * AURORA_USABLE_MEMORY
+    max_connections = min(int(usable_bytes // AURORA_CONNECTION_BYTES), AURORA_MAX_CONNECTIONS)
+    if db_instance_class == SERVERLESS_INSTANCE_CLASS and min_capacity < 1:
+        return min(max_connections, LOW_MIN_CAPACITY_MAX_CONNECTIONS)
+    return max_connections
+
+
+def reserved_connections(max_connections: int) -> int:
+    return max(MIN_RESERVED_CONNECTIONS, int(max_connections * RESERVED_CONNECTIONS_RATIO))
+
+
+def spare_children(vcpus: int, children: int):
+    # Idle children kept ready in dynamic mode: a few per vCPU to absorb connection bursts while the
+    # parent forks more, at most half of the ceiling so the pool actually shrinks when idle
+    min_spare = min(max(MIN_SPARE_CHILDREN, vcpus * SPARE_CHILDREN_PER_VCPU), children // 2)
+    return min_spare, min(children, 2 * min_spare)
+
+
+def supports_process_management(pgpool_version: str) -> bool:
+    return tuple(int(part) for part in pgpool_version.split(".")[:2]) >= DYNAMIC_PROCESS_MANAGEMENT_VERSION
+
+
+def validate_process_management(settings: dict, pgpool_version: str) -> None:
+    # Rendered process management settings must be understood by the pgpool version that reads them
+    mode = settings.get("process_management_mode", "static")
+    if mode not in PROCESS_MANAGEMENT_MODES:
+        raise ValueError(
+            f"Unsupported process_management_mode '{mode}', expected one of {', '.join(PROCESS_MANAGEMENT_MODES)}"
+        )
+    if mode == "dynamic" and not supports_process_management(pgpool_version):
+        raise ValueError(
+            f"process_management_mode 'dynamic' requires pgpool-II "
+            f"{'.'.join(map(str, DYNAMIC_PROCESS_MANAGEMENT_VERSION))} or later, got {pgpool_version}"
+        )
+    if mode == "dynamic":
+        min_spare, max_spare = settings["min_spare_children"], settings["max_spare_children"]
+        if not 0 < min_spare < max_spare <= settings["num_init_children"]:
+            raise ValueError(
+                f"Spare children must satisfy 0 < min_spare_children ({min_spare}) < max_spare_children "
+                f"({max_spare}) <= num_init_children ({settings['num_init_children']})"
+            )
+
+
+def pgpool_sizing(instance_type: str, db_instance_class: str, pgpool_instances: int,
+                  db_max_connections: int = None, process_management_mode: str = "static",
+                  serverless_capacity: tuple = None, num_init_children: int = None, max_pool: int = None) -> dict:
+    # pgpool.conf connection settings for one pgpool instance. Every pgpool session connects to every
+    # backend, so each Aurora instance sees up to pgpool_instances * num_init_children * max_pool
+    # connections and that must fit into its max_connections minus the reserved connections.
+    # In dynamic mode the same budget caps the children pgpool may fork.
+    # A pinned num_init_children or max_pool is used as given, not clamped to the budget; check it with
+    # capacity_report/check_capacity.
+    if process_management_mode not in PROCESS_MANAGEMENT_MODES:
+        raise ValueError(
+            f"Unsupported process_management_mode '{process_management_mode}', "
+            f"expected one of {', '.join(PROCESS_MANAGEMENT_MODES)}"
+        )
+    vcpus, memory_mib = instance_resources(instance_type)
+    max_connections = db_max_connections or aurora_max_connections(db_instance_class, serverless_capacity)
+    budget = (max_connections - reserved_connections(max_connections)) // max(pgpool_instances, 1)
+
+    cpu_children = vcpus * CHILDREN_PER_VCPU
+    memory_children = max(memory_mib - SYSTEM_MEMORY_MIB, 0) // CHILD_MEMORY_MIB
+    children = num_init_children or min(cpu_children, memory_children, budget)
+    if children < MIN_CHILDREN:
+        raise ValueError(
+            f"{pgpool_instances} x {instance_type} against {db_instance_class} (max_connections {max_connections}) "
+            f"leaves only {children} pgpool children per instance, at least {MIN_CHILDREN} are needed"
+        )
+    max_pool = max_pool or max(1, min(MAX_POOL, budget // children))
+
+    settings = {
+        "num_init_children": children,
+        "max_pool": max_pool,
+        # Memory-bound hosts recycle idle children sooner to return their memory
+        "child_life_time": 60 if children == memory_children else 300,
+        # When Aurora connections are the limit, drop idle cached backend connections after 10 minutes
+        "connection_life_time": 600 if children * max_pool >= budget else 0,
+        "process_management_mode": process_management_mode,
+    }
+    if process_management_mode == "dynamic":
+        min_spare, max_spare = spare_children(vcpus, children)
+        settings.update(
+            process_management_strategy="gentle",
+            min_spare_children=min_spare,
+            max_spare_children=max_spare,
+        )
+    return settings
+
+
+def split_readonly_children(settings: dict, instance_type: str, share: float):
+    # (main settings, read-only settings): the read-only pgpool takes a share of the host's children with
+    # the same max_pool, so the host's memory and the connection budget per Aurora instance are unchanged
+    children = settings["num_init_children"]
+    readonly_children = int(children * share)
+    main_children = children - readonly_children
+    if min(main_children, readonly_children) < MIN_CHILDREN:
+        raise ValueError(
+            f"Splitting {children} pgpool children by {share} leaves {main_children} for the main and "
+            f"{readonly_children} for the read-only pgpool, at least {MIN_CHILDREN} each are needed"
+        )
+    main = dict(settings, num_init_children=main_children)
+    if main.get("process_management_mode") == "dynamic":
+        vcpus, _ = instance_resources(instance_type)
+        main["min_spare_children"], main["max_spare_children"] = spare_children(vcpus, main_children)
+    readonly = {
+        "num_init_children": readonly_children,
+        "max_pool": settings["max_pool"],
+        "child_life_time": settings["child_life_time"],
+        "connection_life_time": settings["connection_life_time"],
+        "process_management_mode": "static",
+    }
+    return main, readonly
+
+
+def peak_pgpool_instances(max_capacity: int) -> int:
+    # EC2 Auto Scaling may exceed the group's maximum by 10% (at least one instance) while it rebalances
+    # zones, launching before it terminates; the old hosts keep their backend connections until then
+    return max_capacity + max(1, math.ceil(max_capacity * REBALANCE_SURGE_RATIO))
+
+
+def capacity_report(settings: dict, pgpool_instances: int, max_connections: int) -> dict:
+    # Worst-case backend connections per Aurora instance: every child of every pgpool host holds up to
+    # max_pool cached connections to each backend. One client session occupies one child, so the
+    # children of the fleet are also the client concurrency ceiling.
+    per_host = settings["num_init_children"] * settings["max_pool"]
+    usable = max_connections - reserved_connections(max_connections)
+    surge_instances = peak_pgpool_instances(pgpool_instances)
+    return {
+        "pgpool_instances": pgpool_instances,
+        "num_init_children": settings["num_init_children"],
+        "max_pool": settings["max_pool"],
+        "max_connections": max_connections,
+        "usable_connections": usable,
+        "connections_per_node": pgpool_instances * per_host,
+        "headroom_per_node": usable - pgpool_instances * per_host,
+        "client_ceiling": pgpool_instances * settings["num_init_children"],
+        "rebalance_instances": surge_instances,
+        "rebalance_headroom_per_node": usable - surge_instances * per_host,
+    }
+
+
+def check_capacity(report: dict, strict: bool = False) -> list:
+    # Returns a warning when the fleet at its maximum size, or during the rebalancing surge, can open more
+    # backend connections than an Aurora instance accepts; strict raises instead. Computed settings always
+    # fit the fleet at its maximum size, so the first check only trips on pinned num_init_children/max_pool.
+    warnings = []
+    if report["headroom_per_node"] < 0:
+        message = (
+            f"{report['pgpool_instances']} pgpool instances x {report['num_init_children']} children x "
+            f"max_pool {report['max_pool']} open up to {report['connections_per_node']} connections per Aurora "
+            f"instance, more than the {report['usable_connections']} usable of max_connections "
+            f"{report['max_connections']}"
+        )
+        if strict:
+            raise ValueError(message)
+        warnings.append(message)
+    elif report["rebalance_headroom_per_node"] < 0:
+        message = (
+            f"While Auto Scaling rebalances, {report['rebalance_instances']} pgpool instances can open up to "
+            f"{report['usable_connections'] - report['rebalance_headroom_per_node']} connections per Aurora "
+            f"instance, more than the {report['usable_connections']} usable of max_connections "
+            f"{report['max_connections']}"
+        )
+        if strict:
+            raise ValueError(message)
+        warnings.append(message)
+    return warnings
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import aws_cdk as cdk
+import pytest
+from aws_cdk.assertions import Template
+
+from pgpool_aurora_cdk.pgpool_aurora_stack import PgpoolAuroraStack
+
+# create_pgpool_AMI.py and the benchmarks live at the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+ACCOUNT = "123456789012"
+REGION = "us-east-1"
+AMI_ID = "ami-0123456789abcdef0"
+
+
+class FakeClock:
+    # Monotonic clock advanced by the code under test through its sleep function
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(scope="session")
+def build_stack():
+    # Stack built with the given PgpoolAuroraStack arguments; the AMI and environment are fixed
+    def build_stack(**kwargs) -> PgpoolAuroraStack:
+        kwargs.setdefault("ami_id", AMI_ID)
+        app = cdk.App()
+        return PgpoolAuroraStack(app, "PgpoolAuroraStack", env=cdk.Environment(account=ACCOUNT, region=REGION),
+                                 **kwargs)
+    return build_stack
+
+
+@pytest.fixture(scope="session")
+def synth(build_stack):
+    # Template of a stack built with the given PgpoolAuroraStack arguments
+    def synth(**kwargs) -> Template:
+        return Template.from_stack(build_stack(**kwargs))
+    return synth
@@ -0,0 +1,239 @@
+import json
+import sys
+
+import pytest
+
+import analyze_sql_workload as workload
+from pgpool_aurora_cdk.routing import WRITE_FUNCTIONS, routing_settings
+
+
+def pgpool_line(second, pid, message, fraction=".000"):
+    return f"2024-05-01 10:00:{second:02d}{fraction}: pid {pid}: LOG:  {message}\n"
+
+
+def aurora_line(second, pid, message):
+    return f"2024-05-01 10:00:{second:02d} UTC:10.0.1.5(41234):app@orders:[{pid}]:LOG:  {message}\n"
+
+
+def lines(*values, source="pgpool.log"):
+    return [(source, value) for value in values]
+
+
+def analyze(log, **kwargs):
+    analyzer = workload.WorkloadAnalyzer(**kwargs)
+    analyzer.feed(workload.read_records(lines(*log)))
+    return analyzer
+
+
+# Streaming parser
+
+def test_read_records_joins_continuation_lines():
+    records = list(workload.read_records(lines(
+        pgpool_line(0, 101, "statement: SELECT id"),
+        "  FROM orders\n",
+        "  WHERE id = 1\n",
+        pgpool_line(1, 102, "statement: COMMIT", fraction=".250"),
+    )))
+
+    assert [(r[2], r[3], r[4]) for r in records] == [
+        ("101", "LOG", "statement: SELECT id\n  FROM orders\n  WHERE id = 1"),
+        ("102", "LOG", "statement: COMMIT"),
+    ]
+    assert records[1][1] - records[0][1] == pytest.approx(1.25)
+
+
+def test_read_records_parses_the_aurora_prefix():
+    (record,) = workload.read_records(lines(aurora_line(3, 4242, "statement: SELECT 1"), source="stream-1"))
+
+    assert record[0] == "stream-1"
+    assert record[2] == "4242"
+    assert record[4] == "statement: SELECT 1"
+
+
+def test_read_records_skips_lines_before_the_first_record_and_caps_long_records(monkeypatch):
+    monkeypatch.setattr(workload, "MAX_RECORD_CHARS", 40)
+
+    (record,) = workload.read_records(lines(
+        "tail of a rotated record\n",
+        pgpool_line(0, 101, "statement: SELECT a, b, c, d"),
+        "  FROM a_table_with_a_long_name\n",
+        "  WHERE this_line_is_dropped = 1\n",
+    ))
+
+    assert record[4] == "statement: SELECT a, b, c, d\n  FROM a_table_with_a_long_name"
+
+
+def test_fingerprint_replaces_literals_and_folds_in_lists():
+    sql = "SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2, 3) AND c = $1 -- note\n  AND d = $$z$$;"
+
+    assert workload.fingerprint(sql) == "select * from t where a = ? and b in (?) and c = ? and d = ?"
+
+
+@pytest.mark.parametrize("sql, kind", [
+    ("select * from t", "read"),
+    ("select * from t for update", "write"),
+    ("with x as (delete from t returning *) select * from x", "write"),
+    ("select a into b from t", "write"),
+    ("insert into t values (?)", "write"),
+    ("begin", "begin"),
+    ("rollback", "end"),
+    ("rollback to savepoint s", "other"),
+    ("set search_path = app", "other"),
+])
+def test_classify(sql, kind):
+    assert workload.classify(sql) == kind
+
+
+# Function classification
+
+def test_function_calls_skip_keywords_types_and_aliases():
+    text = "select count(*), app.my_fn(x), cast(y as int), coalesce(z, ?) from t as t2 (a) where exists (select ?)"
+
+    assert workload.function_calls(text) == {"count", "app.my_fn"}
+
+
+@pytest.mark.parametrize("name, kwargs, writes", [
+    # Only built-ins known to be read-only are read-only by default
+    ("count", {}, False),
+    ("pg_catalog.lower", {}, False),
+    ("my_fn", {}, True),
+    ("get_order", {}, True),
+    ("app.count", {}, True),
+    ("nextval", {}, True),
+    ("pg_advisory_xact_lock", {}, True),
+    ("my_fn", dict(read_overrides={"my_fn"}), False),
+    ("app.my_fn", dict(read_overrides={"my_fn"}), False),
+    ("count", dict(write_overrides={"count"}), True),
+    # pg_proc shows the function as non-volatile
+    ("app.my_fn", dict(non_volatile={"app.my_fn"}), False),
+    ("my_fn", dict(non_volatile={"app.other_fn"}), True),
+    ("nextval", dict(read_overrides={"setval"}, non_volatile={"nextval"}), True),
+])
+def test_function_writes(name, kwargs, writes):
+    assert workload.function_writes(name, **kwargs) is writes
+
+
+def test_load_function_volatility_requires_every_overload_to_be_non_volatile():
+    non_volatile = workload.load_function_volatility([
+        "app.price_of|s\n",
+        "app.total|i\n",
+        "app.audit|v\n",
+        "report.total|v\n",
+        "garbage\n",
+    ])
+
+    assert non_volatile == {"app.price_of", "price_of", "app.total"}
+
+
+# Generated rules
+
+ORDERS_LOG = [
+    pgpool_line(0, 101, "statement: SELECT count(*), my_fn(id) FROM orders WHERE id = 1"),
+    pgpool_line(0, 101, "statement: SELECT lower(name) FROM customers WHERE id = 2"),
+    pgpool_line(1, 102, "statement: INSERT INTO orders VALUES (3)"),
+    pgpool_line(1, 102, "statement: SELECT * FROM orders WHERE id = 3", fraction=".100"),
+    pgpool_line(5, 103, "statement: SELECT nextval('order_id')"),
+]
+
+
+def test_rules_list_only_known_read_only_functions():
+    rules, _, _, _ = analyze(ORDERS_LOG).rules()
+
+    # my_fn is user-defined and not known to be read-only: unlisted, so pgpool sends it to the writer
+    assert rules["read_only_function_list"] == ["count", "lower"]
+    routing_settings(rules)
+
+
+def test_rules_list_user_functions_confirmed_read_only():
+    analyzer = analyze(ORDERS_LOG, read_only_functions=["my_fn"])
+
+    rules, _, _, _ = analyzer.rules()
+
+    assert rules["read_only_function_list"] == ["count", "lower", "my_fn"]
+
+
+def test_write_function_list_includes_unknown_functions():
+    rules, _, _, _ = analyze(ORDERS_LOG).rules(function_list="write")
+
+    assert rules["write_function_list"] == list(WRITE_FUNCTIONS) + ["my_fn"]
+    assert "read_only_function_list" not in rules
+
+
+def test_read_after_write_pins_the_query_to_the_writer():
+    analyzer = analyze(ORDERS_LOG)
+
+    rules, selected, skipped, occasional = analyzer.rules()
+
+    assert [text for text, _ in selected] == ["select * from orders where id = ?"]
+    assert rules["primary_routing_query_pattern_list"] == [r"select\s+\*\s+from\s+orders\s+where\s+id\s+=\s+.+\s*;?"]
+    assert rules["disable_load_balance_on_write"] == "transaction"
+    assert (skipped, occasional) == ([], 0)
+    counts = analyzer.counts
+    assert (counts["reads"], counts["writes"], counts["read_after_write"]) == (4, 1, 1)
+    # Reads calling my_fn or nextval stay on the writer
+    assert counts["balanced"] == 2
+
+
+def test_dml_adaptive_balances_reads_of_unrelated_tables_after_a_write():
+    analyzer = analyze([
+        pgpool_line(0, 101, "statement: BEGIN"),
+        pgpool_line(0, 101, "statement: UPDATE orders SET state = 'paid' WHERE id = 1"),
+        pgpool_line(0, 101, "statement: SELECT * FROM customers WHERE id = 2"),
+        pgpool_line(0, 101, "statement: SELECT * FROM orders WHERE id = 1"),
+        pgpool_line(0, 101, "statement: COMMIT"),
+    ])
+
+    rules, _, _, _ = analyzer.rules(dml_adaptive=True)
+
+    assert rules["disable_load_balance_on_write"] == "dml_adaptive"
+    assert (analyzer.counts["balanced"], analyzer.counts["balanced_dml_adaptive"]) == (0, 1)
+
+
+# Bounded memory
+
+def test_bounded_counter_drops_the_least_counted_half():
+    counter = workload.BoundedCounter(4, 1)
+    for key, count in (("a", 5), ("b", 1), ("c", 3), ("d", 2)):
+        counter.add(key, count)
+
+    counter.add("e", 1)
+
+    assert sorted(counter.entries) == ["a", "c", "e"]
+    assert counter.dropped == 3
+
+
+def test_sessions_are_capped_and_closed_on_disconnection():
+    analyzer = analyze([
+        pgpool_line(0, pid, "statement: SELECT 1") for pid in range(100, 110)
+    ] + [pgpool_line(1, 109, "disconnection: session time: 0:00:01.000 user=app database=orders host=10.0.1.5")],
+        max_sessions=4)
+
+    assert len(analyzer.sessions) == 3
+    assert ("pgpool.log", "109") not in analyzer.sessions
+
+
+def test_fingerprints_and_parse_cache_stay_bounded():
+    analyzer = analyze([
+        pgpool_line(0, 101, f"statement: SELECT * FROM table_{n}") for n in range(50)
+    ], max_fingerprints=8)
+
+    assert len(analyzer.fingerprints.entries) <= 8
+    assert len(analyzer.parsed) <= 8
+    assert analyzer.counts["reads"] == 50
+    assert analyzer.fingerprints.dropped + sum(e[0] for e in analyzer.fingerprints.entries.values()) == 50
+
+
+def test_main_writes_rules_from_a_log_file(tmp_path, monkeypatch, capsys):
+    log = tmp_path / "pgpool.log"
+    log.write_text("".join(ORDERS_LOG))
+    volatility = tmp_path / "volatility.txt"
+    volatility.write_text("public.my_fn|s\n")
+    output = tmp_path / "routing_rules.json"
+    monkeypatch.setattr(sys, "argv", ["analyze_sql_workload.py", "--log-file", str(log),
+                                      "--function-volatility", str(volatility), "--output", str(output)])
+
+    workload.main()
+
+    rules = json.loads(output.read_text())
+    assert rules["read_only_function_list"] == ["count", "lower", "my_fn"]
+    assert "read_only_function_list = 'count,lower,my_fn'" in capsys.readouterr().out
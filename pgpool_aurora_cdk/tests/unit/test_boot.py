@@ -0,0 +1,360 @@
+import json
+import os
+import subprocess
+import urllib.error
+
+import pytest
+
+from pgpool_aurora_cdk.agents import boot as boot_agent
+from pgpool_aurora_cdk.agents.configure import query_cache_settings
+from pgpool_aurora_cdk.agents.lifecycle import IN_SERVICE, LifecycleHook, target_lifecycle_state
+from pgpool_aurora_cdk.agents.pgpool_conf import parse_backends, parse_settings, read_conf
+
+PGPOOL_CONF = """\
+port = 9999
+backend_hostname0 = 'placeholder-writer'
+backend_port0 = 5432
+backend_hostname1 = 'placeholder-reader'
+backend_port1 = 5432
+num_init_children = 32
+"""
+
+CONFIG = {
+    "writer_endpoint": "writer.cluster",
+    "reader_endpoint": "reader.cluster",
+    "reader_backends": "instances",
+    "reader_hosts": ["reader-1.cluster", "reader-2.cluster"],
+    "pgpool_settings": {"num_init_children": 48, "max_pool": 2},
+    "services": ["pgpool-health", "pgpool-discovery"],
+}
+
+
+class ClientError(Exception):
+    pass
+
+
+class StubAutoScaling:
+    class exceptions:
+        ClientError = ClientError
+
+    def __init__(self, pending=True):
+        self.pending = pending
+        self.completed = []
+
+    def describe_auto_scaling_instances(self, InstanceIds):
+        return {"AutoScalingInstances": [{"InstanceId": InstanceIds[0], "AutoScalingGroupName": "pgpool-asg"}]}
+
+    def complete_lifecycle_action(self, **kwargs):
+        if not self.pending:
+            raise ClientError("No active Lifecycle Action found")
+        self.completed.append(kwargs)
+
+
+class Recorder:
+    # Stands in for subprocess.run
+    def __init__(self):
+        self.commands = []
+
+    def __call__(self, args, **kwargs):
+        self.commands.append(list(args))
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+
+class Hook:
+    def __init__(self):
+        self.completions = 0
+
+    def complete(self):
+        self.completions += 1
+
+
+@pytest.fixture
+def host(tmp_path, monkeypatch):
+    # No PCP credentials or certificates are written outside tmp_path
+    monkeypatch.setattr(boot_agent, "write_pcp_credentials", lambda **kwargs: None)
+    conf = tmp_path / "pgpool.conf"
+    conf.write_text(PGPOOL_CONF)
+    return tmp_path
+
+
+def run_boot(host, clock, states, **kwargs):
+    states = list(states)
+    run = Recorder()
+    summary = boot_agent.boot(
+        CONFIG,
+        pgpool_conf=str(host / "pgpool.conf"),
+        pcppass=str(host / "pcppass"),
+        readonly_conf=str(host / "pgpool-readonly.conf"),
+        timeline=boot_agent.BootTimeline(clock=clock, uptime=lambda: 42.0),
+        run=run,
+        ready=lambda url: True,
+        lifecycle_state=lambda: states.pop(0) if len(states) > 1 else states[0],
+        prepared_marker=str(host / "prepared"),
+        sleep=clock.sleep,
+        drain_marker=str(host / "draining"),
+        **kwargs
+    )
+    return summary, run
+
+
+def test_boot_renders_the_backends_and_starts_pgpool_before_the_agents(host, clock):
+    summary, run = run_boot(host, clock, [IN_SERVICE])
+
+    text = read_conf(str(host / "pgpool.conf"))
+    backends = parse_backends(text)
+    assert [backends[i]["hostname"] for i in sorted(backends)] == [
+        "writer.cluster", "reader-1.cluster", "reader-2.cluster"
+    ]
+    assert parse_settings(text)["num_init_children"] == "48"
+    assert run.commands[1:] == [
+        ["systemctl", "restart", "pgpool"],
+        ["systemctl", "restart", "pgpool-health", "pgpool-discovery"],
+    ]
+    assert summary["ready"] is True
+    assert summary["ready_seconds"] == summary["uptime"] == 42.0
+    assert (host / "prepared").exists()
+
+
+def test_boot_prepares_only_once(host, clock, monkeypatch):
+    prepared = []
+    monkeypatch.setattr(boot_agent, "write_pcp_credentials", lambda **kwargs: prepared.append(kwargs))
+
+    run_boot(host, clock, [IN_SERVICE])
+    summary, _ = run_boot(host, clock, [IN_SERVICE])
+
+    assert len(prepared) == 1
+    assert "prepare" not in summary
+
+
+def test_warm_pool_instance_completes_the_hook_and_waits_for_activation(host, clock):
+    hook = Hook()
+    states = ["Warmed:Pending:Wait", "Warmed:Running", "Warmed:Running", IN_SERVICE]
+
+    summary, run = run_boot(host, clock, states, lifecycle=hook, poll_interval=5)
+
+    # Once when warmed, once when ready after activation
+    assert hook.completions == 2
+    assert ["systemctl", "restart", "pgpool"] in run.commands
+    assert clock.now == 15
+    # Activation-to-ready, not the uptime of an instance that waited in the pool
+    assert summary["ready_seconds"] == 0
+
+
+def test_instance_back_in_the_warm_pool_stops_its_services_before_the_hook(host, clock):
+    # pgpool-drain restarts the boot step after a scale-in back to a running warm pool
+    (host / "draining").write_text("")
+    hook = Hook()
+    states = ["Warmed:Pending:Wait", "Warmed:Running", IN_SERVICE]
+
+    summary, run = run_boot(host, clock, states, lifecycle=hook)
+
+    assert run.commands[0] == ["systemctl", "stop", "pgpool-health", "pgpool-discovery", "pgpool"]
+    assert run.commands.index(["systemctl", "restart", "pgpool"]) > 0
+    assert hook.completions == 2
+    # pgpool-health reports healthy again once the instance is activated
+    assert not (host / "draining").exists()
+
+
+def test_readonly_pgpool_is_rendered_next_to_the_main_one(host, clock, monkeypatch):
+    monkeypatch.setitem(CONFIG, "readonly", {"pgpool_settings": {"num_init_children": 16}})
+
+    run_boot(host, clock, [IN_SERVICE])
+
+    settings = parse_settings(read_conf(str(host / "pgpool-readonly.conf")))
+    # The reader instances from backend 0 on, no writer
+    assert (settings["backend_hostname0"], settings["backend_hostname1"]) == ("reader-1.cluster", "reader-2.cluster")
+    assert "backend_hostname2" not in settings
+    assert settings["backend_clustering_mode"] == "streaming_replication"
+    assert settings["load_balance_mode"] == "on"
+    assert settings["num_init_children"] == "16"
+
+
+def test_query_cache_is_rendered_for_the_main_pgpool_only(host, clock, monkeypatch):
+    monkeypatch.setitem(CONFIG, "query_cache", {"host": "cache.cluster", "port": 11211, "ttl": 30,
+                                               "auto_invalidation": False, "include_tables": ["app.prices"],
+                                               "exclude_tables": ["app.orders", "app.stock"]})
+    monkeypatch.setitem(CONFIG, "readonly", {"pgpool_settings": {}})
+
+    run_boot(host, clock, [IN_SERVICE])
+
+    settings = parse_settings(read_conf(str(host / "pgpool.conf")))
+    assert settings["memory_cache_enabled"] == "on"
+    assert settings["memqcache_method"] == "memcached"
+    assert (settings["memqcache_memcached_host"], settings["memqcache_memcached_port"]) == ("cache.cluster", "11211")
+    assert settings["memqcache_expire"] == "30"
+    assert settings["memqcache_auto_cache_invalidation"] == "off"
+    assert settings["cache_safe_memqcache_table_list"] == "app.prices"
+    assert settings["cache_unsafe_memqcache_table_list"] == "app.orders,app.stock"
+    assert parse_settings(read_conf(str(host / "pgpool-readonly.conf")))["memory_cache_enabled"] == "off"
+
+
+def test_query_cache_settings_defaults():
+    settings = query_cache_settings({"host": "cache.cluster"})
+
+    assert settings["memqcache_memcached_port"] == 11211
+    assert settings["memqcache_expire"] == 60
+    assert settings["memqcache_auto_cache_invalidation"] is True
+    assert settings["cache_safe_memqcache_table_list"] == settings["cache_unsafe_memqcache_table_list"] == ""
+
+
+def test_no_query_cache_by_default(host, clock):
+    run_boot(host, clock, [IN_SERVICE])
+
+    assert "memory_cache_enabled" not in parse_settings(read_conf(str(host / "pgpool.conf")))
+
+
+def test_lifecycle_hook_completes_the_pending_action():
+    autoscaling = StubAutoScaling()
+
+    LifecycleHook(autoscaling, "pgpool-launch", "i-123").complete()
+
+    assert autoscaling.completed == [{
+        "LifecycleHookName": "pgpool-launch",
+        "AutoScalingGroupName": "pgpool-asg",
+        "LifecycleActionResult": "CONTINUE",
+        "InstanceId": "i-123",
+    }]
+
+
+def test_lifecycle_hook_without_pending_action_is_ignored():
+    autoscaling = StubAutoScaling(pending=False)
+
+    LifecycleHook(autoscaling, "pgpool-launch", "i-123").complete()
+
+    assert autoscaling.completed == []
+
+
+def test_target_lifecycle_state_defaults_to_in_service_without_metadata():
+    def unreachable(path):
+        raise urllib.error.URLError("no route to host")
+
+    assert target_lifecycle_state(unreachable) == IN_SERVICE
+    assert target_lifecycle_state(lambda path: "Warmed:Stopped") == "Warmed:Stopped"
+
+
+class Response:
+    def __init__(self, status):
+        self.status = status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_wait_ready_polls_until_healthy(clock):
+    statuses = [OSError("connection refused"), urllib.error.HTTPError("url", 503, "saturated", {}, None), 200]
+
+    def urlopen(url, timeout):
+        status = statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return Response(status)
+
+    assert boot_agent.wait_ready("http://127.0.0.1:8071/", clock=clock, sleep=clock.sleep, urlopen=urlopen)
+    assert clock.now == 2
+
+
+def test_wait_ready_gives_up_after_the_timeout(clock):
+    def urlopen(url, timeout):
+        raise OSError("connection refused")
+
+    assert not boot_agent.wait_ready("http://127.0.0.1:8071/", timeout=10, clock=clock, sleep=clock.sleep,
+                                     urlopen=urlopen)
+    assert clock.now == 10
+
+
+def test_boot_timeline_records_phases_and_uptime(clock):
+    timeline = boot_agent.BootTimeline(clock=clock, uptime=lambda: 30.0)
+    with timeline.phase("configure"):
+        clock.sleep(1.5)
+
+    assert timeline.summary() == {"configure": 1.5, "uptime": 30.0}
+
+
+class StubSecretsManager:
+    def __init__(self, secret):
+        self.secret = secret
+        self.requests = []
+
+    def get_secret_value(self, SecretId):
+        self.requests.append(SecretId)
+        return {"SecretString": json.dumps(self.secret)}
+
+
+def test_certificate_from_secrets_manager(tmp_path, monkeypatch):
+    owners = []
+    monkeypatch.setattr(boot_agent.shutil, "chown", lambda path, user, group: owners.append((path, user)))
+    secretsmanager = StubSecretsManager({"certificate": "CERT\nCHAIN\n", "private_key": "KEY\n"})
+    cert, key = str(tmp_path / "server.crt"), str(tmp_path / "server.key")
+
+    boot_agent.write_secret_certificate(secretsmanager, "arn:secret", cert, key)
+
+    assert secretsmanager.requests == ["arn:secret"]
+    assert (tmp_path / "server.crt").read_text() == "CERT\nCHAIN\n"
+    assert (tmp_path / "server.key").read_text() == "KEY\n"
+    assert os.stat(key).st_mode & 0o777 == 0o600
+    assert owners == [(cert, "pgpool"), (key, "pgpool")]
+
+
+def test_boot_writes_the_certificate_secret_instead_of_a_self_signed_one(host, clock, monkeypatch):
+    monkeypatch.setitem(CONFIG, "pgpool_settings", dict(CONFIG["pgpool_settings"], ssl=True,
+                                                        ssl_cert=str(host / "server.crt"),
+                                                        ssl_key=str(host / "server.key")))
+    written = []
+
+    _, run = run_boot(host, clock, [IN_SERVICE], certificate=lambda: written.append(True))
+
+    assert written == [True]
+    assert not any(command[0] == "openssl" for command in run.commands)
+    assert parse_settings(read_conf(str(host / "pgpool.conf")))["ssl"] == "on"
+
+
+class UserSecrets:
+    def get_secret_value(self, SecretId):
+        username = SecretId.rsplit(":", 1)[-1]
+        return {"SecretString": json.dumps({"username": username, "password": f"{username}-pw", "port": 5432})}
+
+
+def test_client_auth_accepts_tls_connections_only(tmp_path, monkeypatch):
+    owners = []
+    monkeypatch.setattr(boot_agent.shutil, "chown", lambda path, user, group: owners.append((path, user)))
+    pool_hba, pool_passwd = str(tmp_path / "pool_hba.conf"), str(tmp_path / "pool_passwd")
+    (tmp_path / "pool_hba.conf").write_text("host    all         all         0.0.0.0/0             trust\n")
+
+    boot_agent.write_client_auth(UserSecrets(), ["arn:secret:pdadmin", "arn:secret:app"], pool_hba, pool_passwd)
+
+    rules = [line.split() for line in (tmp_path / "pool_hba.conf").read_text().splitlines()
+             if not line.startswith("#")]
+    assert rules == [["hostssl", "all", "all", "0.0.0.0/0", "scram-sha-256"],
+                     ["hostssl", "all", "all", "::/0", "scram-sha-256"]]
+    assert (tmp_path / "pool_passwd").read_text() == "pdadmin:TEXTpdadmin-pw\napp:TEXTapp-pw\n"
+    for path in (pool_hba, pool_passwd):
+        assert os.stat(path).st_mode & 0o777 == 0o600
+    assert owners == [(pool_hba, "pgpool"), (pool_passwd, "pgpool")]
+
+
+def test_boot_writes_the_client_auth_with_pool_hba_on(host, clock, monkeypatch):
+    monkeypatch.setitem(CONFIG, "pgpool_settings", dict(CONFIG["pgpool_settings"], enable_pool_hba=True,
+                                                        allow_clear_text_frontend_auth=False))
+    written = []
+
+    run_boot(host, clock, [IN_SERVICE], client_auth=lambda: written.append(True))
+
+    assert written == [True]
+    settings = parse_settings(read_conf(str(host / "pgpool.conf")))
+    assert (settings["enable_pool_hba"], settings["allow_clear_text_frontend_auth"]) == ("on", "off")
+
+
+def test_boot_creates_a_self_signed_certificate_without_a_secret(host, clock, monkeypatch):
+    monkeypatch.setitem(CONFIG, "pgpool_settings", dict(CONFIG["pgpool_settings"], ssl=True,
+                                                        ssl_cert=str(host / "server.crt"),
+                                                        ssl_key=str(host / "server.key")))
+    # openssl is not run for real, the key it would write is already there
+    (host / "server.key").write_text("KEY\n")
+    monkeypatch.setattr(boot_agent.shutil, "chown", lambda path, user, group: None)
+
+    _, run = run_boot(host, clock, [IN_SERVICE])
+
+    assert run.commands[0][:3] == ["openssl", "req", "-x509"]
@@ -0,0 +1,584 @@
+import re
+
+import pytest
+
+import create_pgpool_AMI as ami
+from pgpool_aurora_cdk.agents.configure import configure_pgpool, configure_readonly
+from pgpool_aurora_cdk.agents.pgpool_conf import apply_settings, format_value, parse_settings, read_conf
+from pgpool_aurora_cdk.logging_profiles import LOGGING_PROFILES, logging_settings
+from pgpool_aurora_cdk.sizing import PROCESS_MANAGEMENT_MODES, pgpool_sizing
+
+BUILD_OUTPUT = (
+    "cloud-init: running user data\n"
+    f"{ami.STATS_MARKER} source=compiled compile_seconds=120 jobs=2 pgpool_bytes=4096\n"
+    f"{ami.READY_MARKER}\n"
+)
+
+
+# pgpool accepts only "key = value" lines besides comments and blank lines
+CONF_LINE = re.compile(r"^[a-z_][a-z0-9_]* = \S.*$")
+
+
+def ami_pgpool_conf(**kwargs) -> str:
+    # /usr/local/etc/pgpool.conf as written by the build script
+    user_data = ami.render_user_data("writer.cluster", "reader.cluster", **kwargs)
+    start = user_data.index("cat > /usr/local/etc/pgpool.conf << EOF\n") + len("cat > /usr/local/etc/pgpool.conf << EOF\n")
+    return user_data[start:user_data.index("\nEOF\n", start) + 1]
+
+
+def assert_valid_conf(text):
+    keys = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            assert CONF_LINE.match(line), line
+            keys.append(line.split(" = ", 1)[0])
+    duplicates = {key for key in keys if keys.count(key) > 1}
+    assert not duplicates
+
+
+class Waiter:
+    def __init__(self, ec2, name):
+        self.ec2 = ec2
+        self.name = name
+
+    def wait(self, **kwargs):
+        self.ec2.calls.append(("wait", self.name))
+
+
+class StubEC2:
+    # Console output advances one entry per get_console_output call and then stays on the last one
+    def __init__(self, outputs, latest=True):
+        self.outputs = list(outputs)
+        self.latest = latest
+        self.calls = []
+
+    def get_console_output(self, InstanceId, Latest=False):
+        self.calls.append(("console", Latest))
+        if Latest and not self.latest:
+            raise Exception("Latest is not supported on this instance type")
+        output = self.outputs.pop(0) if len(self.outputs) > 1 else self.outputs[0]
+        return {"Output": output}
+
+    def describe_instance_types(self, InstanceTypes):
+        return {"InstanceTypes": [{"ProcessorInfo": {"SupportedArchitectures": ["x86_64"]}}]}
+
+    def describe_images(self, Owners, Filters=None, ImageIds=None):
+        if Owners == ["self"]:
+            return {"Images": []}
+        return {"Images": [
+            {"ImageId": "ami-old", "CreationDate": "2024-01-01T00:00:00.000Z"},
+            {"ImageId": "ami-base", "CreationDate": "2024-06-01T00:00:00.000Z"},
+        ]}
+
+    def create_security_group(self, **kwargs):
+        return {"GroupId": "sg-build"}
+
+    def authorize_security_group_ingress(self, **kwargs):
+        pass
+
+    def run_instances(self, **kwargs):
+        self.calls.append(("run_instances", kwargs["ImageId"]))
+        return {"Instances": [{"InstanceId": "i-build"}]}
+
+    def get_waiter(self, name):
+        return Waiter(self, name)
+
+    def stop_instances(self, InstanceIds):
+        self.calls.append(("stop", InstanceIds[0]))
+
+    def create_image(self, **kwargs):
+        self.calls.append(("create_image", kwargs["InstanceId"]))
+        return {"ImageId": "ami-pgpool"}
+
+    def terminate_instances(self, InstanceIds):
+        self.calls.append(("terminate", InstanceIds[0]))
+
+    def delete_security_group(self, GroupId):
+        self.calls.append(("delete_security_group", GroupId))
+
+
+def test_wait_for_build_ready_returns_stats_once_the_marker_appears(clock):
+    ec2 = StubEC2(["booting\n", "compiling\n", BUILD_OUTPUT])
+
+    stats = ami.wait_for_build_ready(ec2, "i-build", sleep=clock.sleep, clock=clock)
+
+    assert stats == {"source": "compiled", "compile_seconds": 120, "jobs": 2, "pgpool_bytes": 4096}
+    # Backoff 5s then 10s: the third poll sees the marker
+    assert clock.now == 15
+    assert len(ec2.calls) == 3
+
+
+def test_wait_for_build_ready_backoff_is_capped(clock):
+    ec2 = StubEC2(["compiling\n"] * 6 + [BUILD_OUTPUT])
+
+    ami.wait_for_build_ready(ec2, "i-build", initial_delay=5, max_delay=30, sleep=clock.sleep, clock=clock)
+
+    assert clock.now == 5 + 10 + 20 + 30 + 30 + 30
+
+
+def test_wait_for_build_ready_fails_fast_on_a_build_error(clock):
+    ec2 = StubEC2(["booting\n", f"{ami.FAILED_MARKER}: make pgpool-II\n"])
+
+    with pytest.raises(ami.AmiBuildError, match="make pgpool-II"):
+        ami.wait_for_build_ready(ec2, "i-build", sleep=clock.sleep, clock=clock)
+    assert clock.now == 5
+
+
+def test_wait_for_build_ready_times_out(clock):
+    ec2 = StubEC2(["compiling\n"])
+
+    with pytest.raises(ami.AmiBuildError, match="60"):
+        ami.wait_for_build_ready(ec2, "i-build", timeout=60, sleep=clock.sleep, clock=clock)
+    assert clock.now == 60
+
+
+def test_wait_for_build_ready_falls_back_to_buffered_console_output(clock):
+    ec2 = StubEC2(["compiling\n", BUILD_OUTPUT], latest=False)
+
+    ami.wait_for_build_ready(ec2, "i-build", sleep=clock.sleep, clock=clock)
+
+    # Latest=True is tried once, the buffered output is used from then on
+    assert [latest for _, latest in ec2.calls] == [True, False, False]
+
+
+def test_marker_inside_a_line_is_not_ready(clock):
+    ec2 = StubEC2([f"echo {ami.READY_MARKER} > /dev/console\n", BUILD_OUTPUT])
+
+    ami.wait_for_build_ready(ec2, "i-build", sleep=clock.sleep, clock=clock)
+
+    assert clock.now == 5
+
+
+def test_create_pgpool_ami_snapshots_right_after_the_marker(capsys):
+    ec2 = StubEC2([BUILD_OUTPUT])
+    timings = {}
+    stats = {}
+
+    ami_id = ami.create_pgpool_ami("us-east-1", ec2_client=ec2, timings=timings, build_stats=stats)
+
+    assert ami_id == "ami-pgpool"
+    steps = [call[0] for call in ec2.calls if call[0] != "wait"]
+    assert steps == ["run_instances", "console", "stop", "create_image", "terminate", "delete_security_group"]
+    assert ("run_instances", "ami-base") in ec2.calls
+    assert set(timings) == {"cache_lookup", "launch", "status_checks", "install", "stop", "image"}
+    assert stats["compile_seconds"] == 120 and stats["profile"] == "default"
+    assert "total" in capsys.readouterr().out
+
+
+def test_create_pgpool_ami_cleans_up_after_a_failed_build():
+    ec2 = StubEC2([f"{ami.FAILED_MARKER}: configure pgpool-II\n"])
+
+    with pytest.raises(ami.AmiBuildError):
+        ami.create_pgpool_ami("us-east-1", ec2_client=ec2)
+
+    steps = [call[0] for call in ec2.calls if call[0] != "wait"]
+    assert "create_image" not in steps
+    assert steps[-2:] == ["terminate", "delete_security_group"]
+
+
+class StubS3:
+    def __init__(self, keys=()):
+        self.keys = set(keys)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.keys:
+            raise Exception("An error occurred (404) when calling the HeadObject operation: Not Found")
+        return {}
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?method={method}&expires={ExpiresIn}"
+
+
+def test_s3_artifact_store_hands_presigned_urls_to_the_build_instance():
+    s3 = StubS3({("builds", "pgpool/a.tar.gz")})
+    store = ami.S3ArtifactStore("builds", "/pgpool/", s3_client=s3)
+
+    assert store.uri("a.tar.gz") == "s3://builds/pgpool/a.tar.gz"
+    assert store.exists("a.tar.gz") and not store.exists("b.tar.gz")
+    assert store.fetch_url("a.tar.gz") == "https://builds.s3.amazonaws.com/pgpool/a.tar.gz?method=get_object&expires=7200"
+    assert store.upload_url("b.tar.gz").endswith("/pgpool/b.tar.gz?method=put_object&expires=7200")
+
+
+@pytest.mark.parametrize("uri", ["/tmp/artifacts", "file:///tmp/artifacts", "s3://"])
+def test_artifact_store_must_be_reachable_from_the_build_instance(uri):
+    with pytest.raises(ValueError):
+        ami.artifact_store_from_uri(uri)
+
+
+def test_create_pgpool_ami_uploads_a_new_artifact():
+    ec2 = StubEC2([BUILD_OUTPUT])
+    store = ami.S3ArtifactStore("builds", "pgpool", s3_client=StubS3())
+    user_data = []
+    run_instances = ec2.run_instances
+    ec2.run_instances = lambda **kwargs: user_data.append(kwargs["UserData"]) or run_instances(**kwargs)
+
+    ami.create_pgpool_ami("us-east-1", ec2_client=ec2, artifact_store=store)
+
+    key = ami.artifact_key(ami.PGPOOL_VERSION, "x86_64", "default", "-O2", "")
+    assert f'curl -fsS -T $ARTIFACT "https://builds.s3.amazonaws.com/pgpool/{key}?method=put_object' in user_data[0]
+
+
+class CacheEC2(StubEC2):
+    # Own images with tags, filtered like describe_images; create_image registers a new one
+    def __init__(self, images=()):
+        super().__init__([BUILD_OUTPUT])
+        self.images = list(images)
+        self.deleted_snapshots = []
+
+    def describe_images(self, Owners, Filters=None, ImageIds=None):
+        if Owners != ["self"]:
+            return super().describe_images(Owners, Filters)
+        images = self.images
+        for f in Filters or []:
+            if f["Name"].startswith("tag:"):
+                key = f["Name"][len("tag:"):]
+                images = [i for i in images if {t["Key"]: t["Value"] for t in i["Tags"]}.get(key) in f["Values"]]
+            elif f["Name"] == "tag-key":
+                images = [i for i in images if any(t["Key"] in f["Values"] for t in i["Tags"])]
+            elif f["Name"] == "architecture":
+                images = [i for i in images if i["Architecture"] in f["Values"]]
+            elif f["Name"] == "state":
+                images = [i for i in images if i["State"] in f["Values"]]
+        return {"Images": images}
+
+    def create_image(self, **kwargs):
+        super().create_image(**kwargs)
+        image_id = f"ami-pgpool-{len(self.images)}"
+        self.images.append(cached_image(image_id, f"2024-07-{len(self.images) + 1:02d}T00:00:00.000Z",
+                                        tags=kwargs["TagSpecifications"][0]["Tags"]))
+        return {"ImageId": image_id}
+
+    def deregister_image(self, ImageId):
+        self.calls.append(("deregister", ImageId))
+        self.images = [i for i in self.images if i["ImageId"] != ImageId]
+
+    def delete_snapshot(self, SnapshotId):
+        if SnapshotId.endswith("-busy"):
+            raise Exception("snapshot is in use")
+        self.deleted_snapshots.append(SnapshotId)
+
+
+def cached_image(image_id, creation_date, architecture="x86_64", tags=None, state="available"):
+    return {
+        "ImageId": image_id,
+        "Name": image_id,
+        "CreationDate": creation_date,
+        "Architecture": architecture,
+        "State": state,
+        "Tags": tags or [{"Key": ami.CACHE_TAG_KEY, "Value": "hash"}],
+        "BlockDeviceMappings": [{"DeviceName": "/dev/xvda", "Ebs": {"SnapshotId": f"snap-{image_id}"}},
+                                {"DeviceName": "/dev/sdb", "VirtualName": "ephemeral0"}],
+    }
+
+
+def builds(ec2):
+    return [call for call in ec2.calls if call[0] == "run_instances"]
+
+
+def test_unchanged_build_inputs_reuse_the_cached_ami():
+    ec2 = CacheEC2()
+    first = ami.create_pgpool_ami("us-east-1", ec2_client=ec2)
+    timings = {}
+
+    second = ami.create_pgpool_ami("us-east-1", ec2_client=ec2, timings=timings)
+
+    assert second == first
+    assert len(builds(ec2)) == 1
+    assert set(timings) == {"cache_lookup"}
+
+
+def test_changed_build_inputs_miss_the_cache():
+    ec2 = CacheEC2()
+    ami.create_pgpool_ami("us-east-1", ec2_client=ec2)
+
+    ami.create_pgpool_ami("us-east-1", ec2_client=ec2, logging_profile="debug")
+
+    assert len(builds(ec2)) == 2
+
+
+def test_force_rebuilds_despite_a_cached_ami():
+    ec2 = CacheEC2()
+    first = ami.create_pgpool_ami("us-east-1", ec2_client=ec2)
+    timings = {}
+
+    second = ami.create_pgpool_ami("us-east-1", ec2_client=ec2, force=True, timings=timings)
+
+    assert second != first
+    assert len(builds(ec2)) == 2
+    assert "cache_lookup" not in timings
+
+
+def test_find_cached_ami_returns_the_newest_available_image():
+    ec2 = CacheEC2([
+        cached_image("ami-1", "2024-01-01T00:00:00.000Z"),
+        cached_image("ami-3", "2024-03-01T00:00:00.000Z"),
+        cached_image("ami-4", "2024-04-01T00:00:00.000Z", state="pending"),
+        cached_image("ami-2", "2024-02-01T00:00:00.000Z"),
+    ])
+
+    assert ami.find_cached_ami(ec2, "hash") == "ami-3"
+    assert ami.find_cached_ami(ec2, "other") is None
+
+
+def test_prune_keeps_the_newest_images_per_architecture_and_deletes_their_snapshots(capsys):
+    ec2 = CacheEC2([
+        cached_image("ami-x1", "2024-01-01T00:00:00.000Z"),
+        cached_image("ami-x2", "2024-02-01T00:00:00.000Z"),
+        cached_image("ami-x3", "2024-03-01T00:00:00.000Z"),
+        cached_image("ami-a1", "2024-01-15T00:00:00.000Z", architecture="arm64"),
+        cached_image("ami-a2", "2024-02-15T00:00:00.000Z", architecture="arm64"),
+        dict(cached_image("ami-manual", "2023-01-01T00:00:00.000Z"), Tags=[]),
+    ])
+
+    pruned = ami.prune_cached_amis(ec2, keep=1)
+
+    assert sorted(pruned) == ["ami-a1", "ami-x1", "ami-x2"]
+    assert sorted(i["ImageId"] for i in ec2.images) == ["ami-a2", "ami-manual", "ami-x3"]
+    assert sorted(ec2.deleted_snapshots) == ["snap-ami-a1", "snap-ami-x1", "snap-ami-x2"]
+
+
+def test_prune_is_limited_to_the_architecture_and_survives_a_snapshot_error(capsys):
+    busy = cached_image("ami-x1", "2024-01-01T00:00:00.000Z")
+    busy["BlockDeviceMappings"][0]["Ebs"]["SnapshotId"] = "snap-busy"
+    ec2 = CacheEC2([
+        busy,
+        cached_image("ami-x2", "2024-02-01T00:00:00.000Z"),
+        cached_image("ami-x3", "2024-03-01T00:00:00.000Z"),
+        cached_image("ami-a1", "2024-01-15T00:00:00.000Z", architecture="arm64"),
+        cached_image("ami-a2", "2024-02-15T00:00:00.000Z", architecture="arm64"),
+    ])
+
+    pruned = ami.prune_cached_amis(ec2, keep=1, architecture="x86_64")
+
+    assert sorted(pruned) == ["ami-x1", "ami-x2"]
+    assert ec2.deleted_snapshots == ["snap-ami-x2"]
+    assert "snap-busy" in capsys.readouterr().out
+
+
+def test_keep_cached_prunes_after_a_build():
+    ec2 = CacheEC2([cached_image(f"ami-old{n}", f"2024-0{n}-01T00:00:00.000Z") for n in range(1, 4)])
+
+    ami_id = ami.create_pgpool_ami("us-east-1", ec2_client=ec2, keep_cached=2)
+
+    assert sorted(i["ImageId"] for i in ec2.images) == sorted([ami_id, "ami-old3"])
+
+
+class RegionEC2(StubEC2):
+    # Build region with its own instance and security group ids; fail_on names the call that raises
+    def __init__(self, region, fail_on=None):
+        super().__init__([BUILD_OUTPUT])
+        self.region = region
+        self.fail_on = fail_on
+        self.created = []
+        self.terminated = []
+        self.security_groups = []
+        self.deleted_security_groups = []
+
+    def fail(self, call):
+        if self.fail_on == call:
+            raise Exception(f"{call} failed in {self.region}")
+
+    def create_security_group(self, **kwargs):
+        self.fail("create_security_group")
+        group_id = f"sg-{self.region}"
+        self.security_groups.append(group_id)
+        return {"GroupId": group_id}
+
+    def run_instances(self, **kwargs):
+        self.fail("run_instances")
+        instance_id = f"i-{self.region}"
+        self.created.append(instance_id)
+        return {"Instances": [{"InstanceId": instance_id}]}
+
+    def create_image(self, **kwargs):
+        self.fail("create_image")
+        return {"ImageId": f"ami-{self.region}"}
+
+    def terminate_instances(self, InstanceIds):
+        self.terminated.extend(InstanceIds)
+
+    def delete_security_group(self, GroupId):
+        self.deleted_security_groups.append(GroupId)
+
+
+def test_build_pipeline_isolates_a_failing_region_and_cleans_up_everywhere(capsys):
+    clients = {
+        "us-east-1": RegionEC2("us-east-1"),
+        "eu-west-1": RegionEC2("eu-west-1", fail_on="create_image"),
+        "ap-northeast-1": RegionEC2("ap-northeast-1", fail_on="run_instances"),
+        "us-west-2": RegionEC2("us-west-2"),
+    }
+
+    results = ami.build_pipeline(list(clients), client_factory=clients.__getitem__)
+
+    assert [(r["region"], r["ami_id"], r["status"]) for r in results] == [
+        ("us-east-1", "ami-us-east-1", "built"),
+        ("eu-west-1", None, "failed"),
+        ("ap-northeast-1", None, "failed"),
+        ("us-west-2", "ami-us-west-2", "built"),
+    ]
+    assert results[1]["error"] == "create_image failed in eu-west-1"
+    assert results[2]["error"] == "run_instances failed in ap-northeast-1"
+    for ec2 in clients.values():
+        assert ec2.terminated == ec2.created
+        assert ec2.deleted_security_groups == ec2.security_groups == [f"sg-{ec2.region}"]
+    assert "create_image failed in eu-west-1" in capsys.readouterr().out
+
+
+class CopyEC2(RegionEC2):
+    def describe_images(self, Owners=None, Filters=None, ImageIds=None):
+        if ImageIds:
+            return {"Images": [{"ImageId": ImageIds[0], "Name": "pgpool-II", "Architecture": "x86_64",
+                                "Tags": [{"Key": ami.CACHE_TAG_KEY, "Value": "hash"}]}]}
+        return super().describe_images(Owners, Filters)
+
+    def copy_image(self, **kwargs):
+        self.fail("copy_image")
+        return {"ImageId": f"ami-copy-{self.region}"}
+
+    def get_waiter(self, name):
+        if name == "image_available" and self.fail_on == "copy_wait":
+            raise Exception(f"copy to {self.region} failed")
+        return super().get_waiter(name)
+
+    def deregister_image(self, ImageId):
+        self.calls.append(("deregister", ImageId))
+
+
+def test_build_pipeline_copy_failure_deregisters_the_partial_copy():
+    clients = {
+        "us-east-1": CopyEC2("us-east-1"),
+        "eu-west-1": CopyEC2("eu-west-1", fail_on="copy_wait"),
+        "us-west-2": CopyEC2("us-west-2"),
+    }
+
+    results = ami.build_pipeline(list(clients), copy=True, client_factory=clients.__getitem__)
+
+    assert [(r["region"], r["ami_id"], r["status"]) for r in results] == [
+        ("us-east-1", "ami-us-east-1", "built"),
+        ("eu-west-1", None, "failed"),
+        ("us-west-2", "ami-copy-us-west-2", "copied"),
+    ]
+    assert ("deregister", "ami-copy-eu-west-1") in clients["eu-west-1"].calls
+    # Only the source region launched a build instance
+    assert [ec2.created for ec2 in clients.values()] == [["i-us-east-1"], [], []]
+    assert clients["us-east-1"].terminated == ["i-us-east-1"]
+
+
+def test_build_script_installs_no_pgdoctor_or_database_credentials():
+    user_data = ami.render_user_data("writer.cluster", "reader.cluster")
+
+    assert "pgdoctor" not in user_data
+    assert "pg_password" not in user_data
+    assert "pgpool_bytes=$(stat -c %s /usr/local/bin/pgpool)\"" in user_data
+
+
+def test_ami_pgpool_conf_survives_the_boot_render(tmp_path):
+    conf = tmp_path / "pgpool.conf"
+    conf.write_text(ami_pgpool_conf())
+    # The stack always sets allow_clear_text_frontend_auth, clients authenticate against Aurora itself
+    config = {
+        "writer_endpoint": "writer.cluster",
+        "reader_endpoint": "reader.cluster",
+        "reader_hosts": ["reader-1.cluster", "reader-2.cluster"],
+        "pgpool_settings": {"num_init_children": 48, "max_pool": 2, "allow_clear_text_frontend_auth": True},
+        "readonly": {"pgpool_settings": {"num_init_children": 16}},
+    }
+
+    configure_pgpool(config, str(conf), status_file=str(tmp_path / "pgpool_status"))
+    configure_readonly(config, str(conf), str(tmp_path / "pgpool-readonly.conf"))
+
+    for path in (conf, tmp_path / "pgpool-readonly.conf"):
+        text = read_conf(str(path))
+        assert_valid_conf(text)
+        assert parse_settings(text)["allow_clear_text_frontend_auth"] == "on"
+
+
+def test_apply_settings_replaces_a_bare_key():
+    text = "authentication_timeout = 60\nallow_clear_text_frontend_auth\n#ssl\n"
+
+    assert apply_settings(text, {"allow_clear_text_frontend_auth": False, "ssl": True}) == (
+        "authentication_timeout = 60\nallow_clear_text_frontend_auth = off\n#ssl\nssl = on\n"
+    )
+
+
+@pytest.mark.parametrize("process_management_mode", PROCESS_MANAGEMENT_MODES)
+@pytest.mark.parametrize("logging_profile", sorted(LOGGING_PROFILES))
+@pytest.mark.parametrize("build_profile, architecture, target_instance_type", [
+    ("default", "x86_64", None),
+    ("optimized", "x86_64", "c6i.large"),
+    ("lto", "x86_64", "m5.large"),
+    ("default", "arm64", None),
+    ("optimized", "arm64", "c7g.large"),
+    ("lto", "arm64", "m7g.large"),
+])
+def test_every_build_profile_renders_a_valid_pgpool_conf(build_profile, architecture, target_instance_type,
+                                                         logging_profile, process_management_mode):
+    # Same inputs as create_pgpool_ami
+    cflags, ldflags = ami.compile_flags(build_profile, architecture, target_instance_type)
+    settings = pgpool_sizing(target_instance_type or "t3.medium", "db.r6g.large", 4,
+                             process_management_mode=process_management_mode)
+
+    text = ami_pgpool_conf(pgpool_version=ami.PGPOOL_VERSION, cflags=cflags, ldflags=ldflags,
+                           pgpool_settings=settings, logging_profile=logging_profile)
+
+    assert_valid_conf(text)
+    parsed = parse_settings(text)
+    for key, value in dict(settings, **logging_settings(logging_profile)).items():
+        assert parsed[key] == parse_settings(f"{key} = {format_value(value)}")[key], key
+    assert parsed["backend_hostname0"] == "writer.cluster"
+
+
+@pytest.mark.parametrize("build_profile, architecture, target_instance_type, cflags, ldflags", [
+    ("default", "x86_64", None, "-O2", ""),
+    ("default", "arm64", "c7g.large", "-O2", ""),
+    ("optimized", "x86_64", "c7i.large", "-O2 -march=x86-64-v2 -mtune=sapphirerapids", ""),
+    ("optimized", "x86_64", "m5a.xlarge", "-O2 -march=x86-64-v2 -mtune=znver1", ""),
+    ("optimized", "arm64", "c7g.large", "-O2 -march=armv8.2-a -mtune=neoverse-v1", ""),
+    ("lto", "arm64", "t4g.medium", "-O2 -march=armv8.2-a -mtune=neoverse-n1 -flto=auto", "-flto=auto"),
+])
+def test_compile_flags(build_profile, architecture, target_instance_type, cflags, ldflags):
+    assert ami.compile_flags(build_profile, architecture, target_instance_type) == (cflags, ldflags)
+
+
+def test_tuned_builds_keep_the_portable_instruction_set():
+    # A binary built for the newest family must not SIGILL on the oldest one of the architecture
+    for (architecture, family), tuning in ami.TUNING_FLAGS.items():
+        cflags, _ = ami.compile_flags("optimized", architecture, f"{family}.large")
+        assert tuning.startswith("-mtune=")
+        assert [flag for flag in cflags.split() if flag.startswith(("-march=", "-mcpu="))] == [
+            ami.PORTABLE_MARCH[architecture]
+        ]
+
+
+@pytest.mark.parametrize("build_profile, architecture, target_instance_type", [
+    ("fast", "x86_64", "c6i.large"),
+    ("optimized", "x86_64", None),
+    ("optimized", "x86_64", "c7g.large"),
+    ("lto", "arm64", "x2gd.large"),
+])
+def test_compile_flags_rejects_unknown_inputs(build_profile, architecture, target_instance_type):
+    with pytest.raises(ValueError):
+        ami.compile_flags(build_profile, architecture, target_instance_type)
+
+
+def test_artifact_key_changes_with_every_build_input():
+    key = ami.artifact_key("4.5.6", "x86_64", "optimized", "-O2 -march=x86-64-v2 -mtune=znver3", "")
+
+    assert re.fullmatch(r"pgpool-II-4\.5\.6-al2023-x86_64-optimized-[0-9a-f]{8}\.tar\.gz", key)
+    assert key == ami.artifact_key("4.5.6", "x86_64", "optimized", "-O2 -march=x86-64-v2 -mtune=znver3", "")
+    others = {
+        ami.artifact_key("4.5.7", "x86_64", "optimized", "-O2 -march=x86-64-v2 -mtune=znver3", ""),
+        ami.artifact_key("4.5.6", "arm64", "optimized", "-O2 -march=x86-64-v2 -mtune=znver3", ""),
+        ami.artifact_key("4.5.6", "x86_64", "optimized", "-O2 -march=x86-64-v2 -mtune=znver1", ""),
+        ami.artifact_key("4.5.6", "x86_64", "optimized", "-O2 -march=x86-64-v2 -mtune=znver3", "-flto=auto"),
+    }
+    assert key not in others and len(others) == 4
+
+
+def test_process_management_is_left_out_before_pgpool_4_4():
+    text = ami_pgpool_conf(pgpool_version="4.3.10")
+
+    assert_valid_conf(text)
+    assert "process_management_mode" not in parse_settings(text)
@@ -0,0 +1,359 @@
+import subprocess
+import threading
+
+import pytest
+
+from pgpool_aurora_cdk.agents.configure import render_backends
+from pgpool_aurora_cdk.agents.control import NODE_DOWN, NODE_UP, PgpoolControl, PgpoolControlError
+from pgpool_aurora_cdk.agents.discovery import ReaderDiscovery, describe_readers
+from pgpool_aurora_cdk.agents.pgpool_conf import conf_lock, parse_backends, read_conf
+from pgpool_aurora_cdk.agents.weights import WeightController
+
+CLUSTER = "aurora-cluster"
+
+PGPOOL_CONF = """\
+port = 9999
+backend_hostname0 = 'aurora-cluster.cluster-endpoint'
+backend_port0 = 5432
+backend_weight0 = 1
+backend_hostname1 = 'reader-1.cluster'
+backend_port1 = 5432
+backend_weight1 = 10
+backend_hostname2 = 'reader-2.cluster'
+backend_port2 = 5432
+backend_weight2 = 10
+"""
+
+
+def instance(instance_id, az="us-east-1a", status="available"):
+    return {
+        "DBInstanceIdentifier": instance_id,
+        "Endpoint": {"Address": f"{instance_id}.cluster"},
+        "AvailabilityZone": az,
+        "DBInstanceStatus": status,
+    }
+
+
+class StubRDS:
+    # Cluster membership plus paged describe_db_instances
+    def __init__(self, writer, instances, page_size=2):
+        self.writer = writer
+        self.instances = instances
+        self.page_size = page_size
+        self.pages = 0
+
+    def describe_db_clusters(self, DBClusterIdentifier):
+        assert DBClusterIdentifier == CLUSTER
+        members = [{"DBInstanceIdentifier": i["DBInstanceIdentifier"],
+                    "IsClusterWriter": i["DBInstanceIdentifier"] == self.writer} for i in self.instances]
+        return {"DBClusters": [{"DBClusterMembers": members}]}
+
+    def describe_db_instances(self, Filters, Marker=None):
+        assert Filters == [{"Name": "db-cluster-id", "Values": [CLUSTER]}]
+        self.pages += 1
+        start = int(Marker or 0)
+        response = {"DBInstances": self.instances[start:start + self.page_size]}
+        if start + self.page_size < len(self.instances):
+            response["Marker"] = str(start + self.page_size)
+        return response
+
+
+class FakePgpool:
+    # subprocess.run stand-in for the PCP tools and systemctl; backend status by node id
+    def __init__(self, statuses):
+        self.statuses = dict(statuses)
+        self.commands = []
+
+    def __call__(self, args, **kwargs):
+        command = args[0].rsplit("/", 1)[-1]
+        self.commands.append([command] + list(args[1:]))
+        if command == "pcp_node_info":
+            node = int(args[-1])
+            if node not in self.statuses:
+                return subprocess.CompletedProcess(args, 12, "", "ERROR: invalid node id")
+            return subprocess.CompletedProcess(args, 0, f"host 5432 {self.statuses[node]} 0.5 up\n", "")
+        if command == "pcp_attach_node":
+            self.statuses[int(args[-1])] = NODE_UP
+        elif command == "pcp_detach_node":
+            self.statuses[int(args[-1])] = NODE_DOWN
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+    def ran(self, command):
+        return [c for c in self.commands if c[0] == command]
+
+
+@pytest.fixture
+def pgpool_conf(tmp_path):
+    path = tmp_path / "pgpool.conf"
+    path.write_text(PGPOOL_CONF)
+    return str(path)
+
+
+def discovery(rds, pgpool, pgpool_conf, **kwargs):
+    return ReaderDiscovery(rds, CLUSTER, PgpoolControl(run=pgpool), pgpool_conf=pgpool_conf, **kwargs)
+
+
+def test_describe_readers_skips_the_writer_and_follows_pages():
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1"), instance("reader-2", "us-east-1b"),
+                             dict(instance("reader-3"), Endpoint=None)])
+
+    readers = describe_readers(rds, CLUSTER)
+
+    assert [(r["id"], r["host"], r["az"]) for r in readers] == [
+        ("reader-1", "reader-1.cluster", "us-east-1a"),
+        ("reader-2", "reader-2.cluster", "us-east-1b"),
+    ]
+    assert rds.pages == 2
+
+
+def test_new_reader_is_appended_and_attached(pgpool_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1"), instance("reader-2"), instance("reader-3")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+
+    changes = discovery(rds, pgpool, pgpool_conf).reconcile()
+
+    assert changes == {"added": [3], "attached": [], "detached": [], "reweighted": []}
+    backend = parse_backends(read_conf(pgpool_conf))[3]
+    assert backend["hostname"] == "reader-3.cluster"
+    assert backend["weight"] == "10"
+    assert backend["flag"] == "ALLOW_TO_FAILOVER"
+    # The new slot is known to pgpool only after the reload
+    assert pgpool.ran("systemctl") == [["systemctl", "reload", "pgpool"]]
+    assert pgpool.ran("pcp_attach_node")[0][-1] == "3"
+    assert pgpool.commands.index(["systemctl", "reload", "pgpool"]) < pgpool.commands.index(
+        pgpool.ran("pcp_attach_node")[0])
+
+
+def test_removed_reader_is_detached_and_keeps_its_slot(pgpool_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+
+    changes = discovery(rds, pgpool, pgpool_conf).reconcile()
+
+    assert changes["detached"] == [2]
+    assert pgpool.statuses[2] == NODE_DOWN
+    # Nothing to write, pgpool cannot drop backends on reload
+    assert pgpool.ran("systemctl") == []
+    assert read_conf(pgpool_conf) == PGPOOL_CONF
+
+
+def test_reader_promoted_to_writer_is_detached(pgpool_conf):
+    rds = StubRDS("reader-1", [instance("writer"), instance("reader-1"), instance("reader-2")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+
+    changes = discovery(rds, pgpool, pgpool_conf).reconcile()
+
+    # The old writer instance is a reader now and gets a slot of its own; backend 0 stays on the cluster endpoint
+    assert changes["detached"] == [1]
+    assert changes["added"] == [3]
+    assert parse_backends(read_conf(pgpool_conf))[3]["hostname"] == "writer.cluster"
+
+
+def test_returning_reader_is_attached_again(pgpool_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1"), instance("reader-2")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_DOWN})
+
+    changes = discovery(rds, pgpool, pgpool_conf).reconcile()
+
+    assert changes == {"added": [], "attached": [2], "detached": [], "reweighted": []}
+    assert pgpool.statuses[2] == NODE_UP
+
+
+def test_unusable_readers_are_treated_as_gone(pgpool_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1"), instance("reader-2", status="rebooting")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+
+    assert discovery(rds, pgpool, pgpool_conf).reconcile()["detached"] == [2]
+
+
+def test_az_affinity_weights_follow_the_reader_zones(pgpool_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1", "us-east-1a"),
+                             instance("reader-2", "us-east-1b")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+
+    changes = discovery(rds, pgpool, pgpool_conf, local_az="us-east-1a", remote_reader_weight=1).reconcile()
+
+    assert changes["reweighted"] == [2]
+    backends = parse_backends(read_conf(pgpool_conf))
+    assert (backends[1]["weight"], backends[2]["weight"]) == ("10", "1")
+    assert pgpool.ran("systemctl") == [["systemctl", "reload", "pgpool"]]
+
+
+def test_weights_are_left_to_adaptive_weights(pgpool_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1", "us-east-1a"),
+                             instance("reader-2", "us-east-1b")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+
+    changes = discovery(rds, pgpool, pgpool_conf, local_az="us-east-1a", remote_reader_weight=1,
+                        manage_weights=False).reconcile()
+
+    assert changes["reweighted"] == []
+    assert read_conf(pgpool_conf) == PGPOOL_CONF
+
+
+def test_unknown_backend_status_is_skipped(pgpool_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP})
+
+    changes = discovery(rds, pgpool, pgpool_conf).reconcile()
+
+    # Node 2 cannot be queried, so it is neither detached nor attached this pass
+    assert changes["detached"] == []
+
+
+READONLY_CONF = """\
+port = 9998
+backend_hostname0 = 'reader-1.cluster'
+backend_port0 = 5432
+backend_weight0 = 10
+backend_hostname1 = 'reader-2.cluster'
+backend_port1 = 5432
+backend_weight1 = 10
+"""
+
+
+@pytest.fixture
+def readonly_conf(tmp_path):
+    path = tmp_path / "pgpool-readonly.conf"
+    path.write_text(READONLY_CONF)
+    return str(path)
+
+
+def test_new_reader_is_added_to_the_readonly_pgpool(pgpool_conf, readonly_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1"), instance("reader-3")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+    readonly = FakePgpool({0: NODE_UP, 1: NODE_UP})
+
+    changes = discovery(rds, pgpool, pgpool_conf, readonly_conf=readonly_conf,
+                        readonly_control=PgpoolControl(service="pgpool-readonly", run=readonly)).reconcile()
+
+    assert changes == {"added": [3], "attached": [], "detached": [2], "reweighted": [],
+                       "readonly": {"added": [2], "attached": [], "detached": [1], "reweighted": []}}
+    backends = parse_backends(read_conf(readonly_conf))
+    assert [backends[i]["hostname"] for i in sorted(backends)] == [
+        "reader-1.cluster", "reader-2.cluster", "reader-3.cluster"
+    ]
+    assert readonly.ran("systemctl") == [["systemctl", "reload", "pgpool-readonly"]]
+    assert readonly.statuses == {0: NODE_UP, 1: NODE_DOWN, 2: NODE_UP}
+
+
+def test_unchanged_readonly_pgpool_is_not_reported(pgpool_conf, readonly_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1"), instance("reader-2")])
+    readonly = FakePgpool({0: NODE_UP, 1: NODE_UP})
+
+    changes = discovery(rds, FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP}), pgpool_conf,
+                        readonly_conf=readonly_conf,
+                        readonly_control=PgpoolControl(service="pgpool-readonly", run=readonly)).reconcile()
+
+    assert "readonly" not in changes
+    assert readonly.ran("systemctl") == []
+
+
+class HotReaderSource:
+    # Aurora load sample with reader-1 at the CPU limit; on_sample runs while pgpool-weights is sampling
+    def __init__(self, on_sample=None):
+        self.on_sample = on_sample
+
+    def sample(self, reader_ids):
+        if self.on_sample:
+            self.on_sample()
+        return {"writer": "writer", "instances": {"reader-1": {"cpu": 95}, "reader-2": {"cpu": 10},
+                                                  "writer": {"cpu": 10}}}
+
+
+def weight_controller(pgpool, pgpool_conf, source):
+    readers = lambda: {"reader-1.cluster": 10, "reader-2.cluster": 10}
+    return WeightController(source, PgpoolControl(run=pgpool), readers, pgpool_conf=pgpool_conf)
+
+
+def test_discovery_during_a_weight_step_keeps_both_updates(pgpool_conf):
+    rds = StubRDS("writer", [instance("writer"), instance("reader-1"), instance("reader-2"), instance("reader-3")])
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+    source = HotReaderSource(on_sample=lambda: discovery(rds, pgpool, pgpool_conf).reconcile())
+
+    settings = weight_controller(pgpool, pgpool_conf, source).step()
+
+    assert "backend_weight1" in settings
+    backends = parse_backends(read_conf(pgpool_conf))
+    # The slot added by pgpool-discovery survives the weight update written after it
+    assert backends[3]["hostname"] == "reader-3.cluster"
+    assert backends[1]["weight"] == str(settings["backend_weight1"])
+
+
+def test_weight_step_waits_for_the_conf_lock(pgpool_conf):
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+    controller = weight_controller(pgpool, pgpool_conf, HotReaderSource())
+
+    with conf_lock(pgpool_conf):
+        step = threading.Thread(target=controller.step)
+        step.start()
+        step.join(0.2)
+        assert step.is_alive()
+        assert pgpool.ran("systemctl") == []
+    step.join(5)
+
+    assert not step.is_alive()
+    assert pgpool.ran("systemctl") == [["systemctl", "reload", "pgpool"]]
+    assert parse_backends(read_conf(pgpool_conf))[1]["weight"] != "10"
+
+
+def test_weight_step_mirrors_the_reader_weights_to_the_readonly_pgpool(pgpool_conf, readonly_conf):
+    pgpool = FakePgpool({0: NODE_UP, 1: NODE_UP, 2: NODE_UP})
+    readonly = FakePgpool({0: NODE_UP, 1: NODE_UP})
+    controller = weight_controller(pgpool, pgpool_conf, HotReaderSource())
+    controller.readonly_conf = readonly_conf
+    controller.readonly_control = PgpoolControl(service="pgpool-readonly", run=readonly)
+
+    settings = controller.step()
+
+    # Same hosts, different slots: reader-1 is backend 1 of pgpool and backend 0 of pgpool-readonly
+    backends = parse_backends(read_conf(readonly_conf))
+    assert backends[0]["weight"] == str(settings["backend_weight1"])
+    assert backends[1]["weight"] == "10"
+    assert readonly.ran("systemctl") == [["systemctl", "reload", "pgpool-readonly"]]
+
+
+def test_readonly_pgpool_shares_the_reads_equally_when_every_reader_is_at_zero(pgpool_conf, readonly_conf):
+    readonly = FakePgpool({0: NODE_UP, 1: NODE_UP})
+    controller = weight_controller(FakePgpool({}), pgpool_conf, HotReaderSource())
+    controller.readonly_conf = readonly_conf
+    controller.readonly_control = PgpoolControl(service="pgpool-readonly", run=readonly)
+
+    assert controller.mirror_readonly({"reader-1.cluster": 0.0, "reader-2.cluster": 0.0}) == {
+        "backend_weight0": 1, "backend_weight1": 1
+    }
+    assert controller.mirror_readonly({"reader-1.cluster": 0.0, "reader-2.cluster": 4.0}) == {
+        "backend_weight0": 0, "backend_weight1": 4
+    }
+
+
+def test_node_status_rejects_unexpected_output():
+    def run(args, **kwargs):
+        return subprocess.CompletedProcess(args, 0, "garbage\n", "")
+
+    with pytest.raises(PgpoolControlError):
+        PgpoolControl(run=run).node_status(1)
+
+
+def test_render_backends_one_per_reader_instance():
+    config = {"writer_endpoint": "writer.cluster", "reader_endpoint": "reader.cluster",
+              "reader_hosts": ["reader-1.cluster", "reader-2.cluster"], "reader_weight": 5}
+
+    backends = render_backends(config)
+
+    assert [backends[i]["hostname"] for i in sorted(backends)] == [
+        "writer.cluster", "reader-1.cluster", "reader-2.cluster"
+    ]
+    assert backends[0]["flag"] == "ALWAYS_PRIMARY|DISALLOW_TO_FAILOVER"
+    assert backends[2]["weight"] == 5
+
+
+def test_render_backends_reader_endpoint_mode():
+    config = {"writer_endpoint": "writer.cluster", "reader_endpoint": "reader.cluster",
+              "reader_backends": "endpoint", "reader_hosts": ["reader-1.cluster"]}
+
+    backends = render_backends(config)
+
+    assert sorted(backends) == [0, 1]
+    assert backends[1]["hostname"] == "reader.cluster"
+    assert backends[1]["flag"] == "DISALLOW_TO_FAILOVER"
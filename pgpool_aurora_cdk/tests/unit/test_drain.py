@@ -0,0 +1,257 @@
+import functools
+import json
+import subprocess
+import sys
+import types
+
+import pytest
+
+from pgpool_aurora_cdk.agents import drain as drain_agent
+from pgpool_aurora_cdk.agents.configure import READONLY_PCP_PORT
+from pgpool_aurora_cdk.agents.control import PgpoolControl
+from pgpool_aurora_cdk.agents.drain import ConnectionDrainer, finish_scale_in, wait_for_scale_in
+from pgpool_aurora_cdk.agents.lifecycle import IN_SERVICE, TERMINATED
+
+MAIN_PCP_PORT = 9898
+
+
+class Recorder:
+    # Stands in for subprocess.run
+    def __init__(self):
+        self.commands = []
+
+    def __call__(self, args, **kwargs):
+        self.commands.append(list(args))
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+
+class Hook:
+    def __init__(self):
+        self.completions = 0
+
+    def complete(self):
+        self.completions += 1
+
+
+class ClientError(Exception):
+    pass
+
+
+class StubAutoScaling:
+    class exceptions:
+        ClientError = ClientError
+
+    def __init__(self):
+        self.completed = []
+
+    def describe_auto_scaling_instances(self, InstanceIds):
+        return {"AutoScalingInstances": [{"InstanceId": InstanceIds[0], "AutoScalingGroupName": "pgpool-asg"}]}
+
+    def complete_lifecycle_action(self, **kwargs):
+        self.completed.append(kwargs)
+
+
+def proc_info(sessions, idle=4):
+    # pcp_proc_info --all --verbose output: children with a client attached (busy or idle in a session),
+    # then children waiting for a client
+    statuses = ["Execute command" if n % 2 else "Idle" for n in range(sessions)] + ["Wait for connection"] * idle
+    return "".join(f"Database : app\nUsername : app\nPID : {1000 + n}\nStatus : {status}\n"
+                   for n, status in enumerate(statuses))
+
+
+class FakePgpool:
+    # subprocess.run stand-in for pcp_proc_info and systemctl: client sessions per PCP port, one count
+    # taken per call (the last one repeats); failing PCP ports and services exit with 1
+    def __init__(self, sessions, failing=()):
+        self.sessions = {port: list(counts) for port, counts in sessions.items()}
+        self.failing = set(failing)
+        self.commands = []
+
+    def __call__(self, args, **kwargs):
+        command = args[0].rsplit("/", 1)[-1]
+        self.commands.append([command] + list(args[1:]))
+        if command == "pcp_proc_info":
+            port = int(args[args.index("-p") + 1])
+            if port in self.failing:
+                return subprocess.CompletedProcess(args, 1, "", "ERROR: connection to socket failed")
+            counts = self.sessions[port]
+            return subprocess.CompletedProcess(args, 0, proc_info(counts.pop(0) if len(counts) > 1 else counts[0]), "")
+        if command == "systemctl" and args[-1] in self.failing:
+            return subprocess.CompletedProcess(args, 1, "", f"Failed to stop {args[-1]}.service")
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+    def ran(self, command):
+        return [c for c in self.commands if c[0] == command]
+
+
+def controls(pgpool, readonly=False):
+    result = [PgpoolControl(run=pgpool)]
+    if readonly:
+        result.append(PgpoolControl(service="pgpool-readonly", pcp_port=READONLY_PCP_PORT, run=pgpool))
+    return result
+
+
+def drainer(pgpool, clock, tmp_path, readonly=False, **kwargs):
+    return ConnectionDrainer(controls(pgpool, readonly), drain_marker=str(tmp_path / "run" / "draining"),
+                             clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_drain_waits_for_the_sessions_to_finish(clock, tmp_path):
+    pgpool = FakePgpool({MAIN_PCP_PORT: [3, 2, 0]})
+
+    summary = drainer(pgpool, clock, tmp_path, min_wait=5).drain()
+
+    assert summary == {"seconds": 10, "sessions_left": 0}
+    # pgpool-health answers 503 while the marker exists
+    assert (tmp_path / "run" / "draining").exists()
+    assert len(pgpool.ran("pcp_proc_info")) == 3
+    assert pgpool.commands[-1] == ["systemctl", "stop", "pgpool"]
+
+
+def test_idle_host_still_waits_for_the_health_checks(clock, tmp_path):
+    pgpool = FakePgpool({MAIN_PCP_PORT: [0]})
+
+    summary = drainer(pgpool, clock, tmp_path, min_wait=20).drain()
+
+    # The NLB may still send clients until it has seen the failed health checks
+    assert summary == {"seconds": 20, "sessions_left": 0}
+    assert pgpool.ran("systemctl") == [["systemctl", "stop", "pgpool"]]
+
+
+def test_drain_timeout_stops_pgpool_with_sessions_left(clock, tmp_path):
+    pgpool = FakePgpool({MAIN_PCP_PORT: [5]})
+
+    summary = drainer(pgpool, clock, tmp_path, timeout=12, min_wait=0).drain()
+
+    # The last sleep is cut short so the drain ends on the timeout
+    assert summary == {"seconds": 12, "sessions_left": 5}
+    assert pgpool.ran("systemctl") == [["systemctl", "stop", "pgpool"]]
+
+
+def test_readonly_pgpool_sessions_are_drained_too(clock, tmp_path):
+    pgpool = FakePgpool({MAIN_PCP_PORT: [2, 0], READONLY_PCP_PORT: [1, 1, 0]})
+
+    summary = drainer(pgpool, clock, tmp_path, readonly=True, min_wait=0).drain()
+
+    assert summary == {"seconds": 10, "sessions_left": 0}
+    assert pgpool.ran("systemctl") == [["systemctl", "stop", "pgpool"], ["systemctl", "stop", "pgpool-readonly"]]
+
+
+def test_unreachable_pcp_counts_as_no_sessions_and_stop_failures_are_skipped(clock, tmp_path):
+    pgpool = FakePgpool({MAIN_PCP_PORT: [1, 0]}, failing=[READONLY_PCP_PORT, "pgpool"])
+
+    summary = drainer(pgpool, clock, tmp_path, readonly=True, min_wait=0).drain()
+
+    assert summary == {"seconds": 5, "sessions_left": 0}
+    # The read-only pgpool is stopped even though stopping the main one failed
+    assert pgpool.ran("systemctl") == [["systemctl", "stop", "pgpool"], ["systemctl", "stop", "pgpool-readonly"]]
+
+
+@pytest.fixture
+def drain_host(tmp_path, clock, monkeypatch):
+    # pgpool-drain main() with boto3, the instance metadata, subprocess and the clock stubbed out
+    autoscaling = StubAutoScaling()
+    clients = []
+
+    def client(service, region_name):
+        clients.append((service, region_name))
+        return autoscaling
+
+    monkeypatch.setitem(sys.modules, "boto3", types.SimpleNamespace(client=client))
+    monkeypatch.setattr(drain_agent, "instance_id", lambda: "i-123")
+    pgpool = FakePgpool({MAIN_PCP_PORT: [1, 0], READONLY_PCP_PORT: [0]})
+    monkeypatch.setattr(drain_agent, "PgpoolControl", functools.partial(PgpoolControl, run=pgpool))
+    monkeypatch.setattr(drain_agent, "ConnectionDrainer", functools.partial(
+        ConnectionDrainer, drain_marker=str(tmp_path / "draining"), clock=clock, sleep=clock.sleep))
+    monkeypatch.setattr(drain_agent, "finish_scale_in", functools.partial(finish_scale_in, run=pgpool))
+
+    def run(state, **config):
+        monkeypatch.setattr(drain_agent, "wait_for_scale_in", lambda: state)
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps(dict(region="us-east-1", **config)))
+        monkeypatch.setattr(sys, "argv", ["pgpool-drain", str(config_path)])
+        drain_agent.main()
+
+    return types.SimpleNamespace(run=run, autoscaling=autoscaling, clients=clients, pgpool=pgpool)
+
+
+def test_main_drains_and_completes_the_termination_hook(drain_host, clock):
+    drain_host.run(TERMINATED, drain={"lifecycle_hook": "pgpool-terminate", "timeout": 300, "min_wait": 10},
+                   readonly={"pgpool_settings": {}})
+
+    assert drain_host.clients == [("autoscaling", "us-east-1")]
+    assert drain_host.autoscaling.completed == [{
+        "LifecycleHookName": "pgpool-terminate",
+        "AutoScalingGroupName": "pgpool-asg",
+        "LifecycleActionResult": "CONTINUE",
+        "InstanceId": "i-123",
+    }]
+    assert clock.now == 10
+    assert drain_host.pgpool.ran("systemctl") == [["systemctl", "stop", "pgpool"],
+                                                  ["systemctl", "stop", "pgpool-readonly"]]
+
+
+def test_main_without_a_termination_hook_returns_to_the_warm_pool(drain_host):
+    # Warm pool reuse on scale in with draining turned off
+    drain_host.run("Warmed:Stopped", drain={"timeout": 0, "min_wait": 10})
+
+    assert drain_host.clients == []
+    assert drain_host.autoscaling.completed == []
+    assert drain_host.pgpool.ran("systemctl") == [["systemctl", "stop", "pgpool"],
+                                                  ["systemctl", "restart", "--no-block", "pgpool-boot"]]
+
+
+def states(*values):
+    values = list(values)
+    return lambda: values.pop(0) if len(values) > 1 else values[0]
+
+
+def test_wait_for_scale_in_returns_on_termination(clock):
+    state = wait_for_scale_in(states(IN_SERVICE, IN_SERVICE, TERMINATED), sleep=clock.sleep)
+
+    assert state == TERMINATED
+    assert clock.now == 10
+
+
+def test_wait_for_scale_in_returns_when_the_instance_goes_back_to_the_warm_pool(clock):
+    state = wait_for_scale_in(states(IN_SERVICE, "Warmed:Stopped"), sleep=clock.sleep)
+
+    assert state == "Warmed:Stopped"
+
+
+def test_warm_pool_state_before_activation_is_not_a_scale_in(clock):
+    # Started on a warm instance that is only now being activated
+    state = wait_for_scale_in(states("Warmed:Running", "Warmed:Running", IN_SERVICE, "Warmed:Running"),
+                              sleep=clock.sleep)
+
+    assert state == "Warmed:Running"
+    assert clock.now == 15
+
+
+def test_terminated_instance_completes_the_termination_hook():
+    hook = Hook()
+    run = Recorder()
+
+    finish_scale_in(TERMINATED, hook, run)
+
+    assert hook.completions == 1
+    assert run.commands == []
+
+
+def test_instance_back_in_the_warm_pool_hands_over_to_the_boot_step():
+    hook = Hook()
+    run = Recorder()
+
+    finish_scale_in("Warmed:Running", hook, run)
+
+    # The boot step completes the launch hook, the termination hook is not pending
+    assert hook.completions == 0
+    assert run.commands == [["systemctl", "restart", "--no-block", "pgpool-boot"]]
+
+
+def test_termination_without_a_hook():
+    run = Recorder()
+
+    finish_scale_in(TERMINATED, None, run)
+
+    assert run.commands == []
@@ -0,0 +1,225 @@
+import json
+import subprocess
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from pgpool_aurora_cdk.agents.control import PgpoolControl
+from pgpool_aurora_cdk.agents.health import (DRAINING, HEALTHY, PGPOOL_DOWN, SATURATED, STALE, WRITER_UNREACHABLE,
+                                             HealthMonitor, InstanceHealthReporter, health_server)
+
+
+def proc_info(busy, idle):
+    # pcp_proc_info --all --verbose output of busy children and children waiting for a client
+    statuses = ["Execute command"] * busy + ["Wait for connection"] * idle
+    return "".join(f"Database : app\nUsername : app\nPID : {1000 + n}\nStatus : {status}\n"
+                   for n, status in enumerate(statuses))
+
+
+class FakePgpool:
+    # subprocess.run stand-in for pcp_proc_info and ss; down makes PCP fail like a stopped pgpool
+    def __init__(self, busy=1, idle=9, waiting=0):
+        self.busy = busy
+        self.idle = idle
+        self.waiting = waiting
+        self.down = False
+        self.commands = []
+
+    def __call__(self, args, **kwargs):
+        command = args[0].rsplit("/", 1)[-1]
+        self.commands.append(command)
+        if command == "pcp_proc_info":
+            if self.down:
+                return subprocess.CompletedProcess(args, 1, "", "ERROR: connection to socket failed")
+            return subprocess.CompletedProcess(args, 0, proc_info(self.busy, self.idle), "")
+        if command == "ss":
+            return subprocess.CompletedProcess(args, 0, f"LISTEN {self.waiting} 128 0.0.0.0:9999 0.0.0.0:*\n", "")
+        raise AssertionError(f"unexpected command {args}")
+
+
+class Writer:
+    # socket.create_connection stand-in for the writer endpoint
+    def __init__(self):
+        self.reachable = True
+        self.connections = 0
+
+    def __call__(self, address, timeout):
+        self.connections += 1
+        if not self.reachable:
+            raise ConnectionRefusedError(111, "Connection refused")
+        return self
+
+    def close(self):
+        pass
+
+
+class StubAutoScaling:
+    def __init__(self):
+        self.calls = []
+
+    def set_instance_health(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+@pytest.fixture
+def pgpool():
+    return FakePgpool()
+
+
+@pytest.fixture
+def writer():
+    return Writer()
+
+
+def monitor(pgpool, writer, clock, tmp_path, **kwargs):
+    return HealthMonitor(PgpoolControl(run=pgpool), "writer.cluster", run_command=pgpool, connect=writer,
+                         clock=clock, drain_marker=str(tmp_path / "draining"), **kwargs)
+
+
+def test_healthy_snapshot(pgpool, writer, clock, tmp_path):
+    health = monitor(pgpool, writer, clock, tmp_path)
+
+    snapshot = health.refresh()
+
+    assert snapshot["state"] == HEALTHY
+    assert snapshot["busy_children_ratio"] == 10.0
+    assert health.status() == (200, {"state": HEALTHY, "busy_children_ratio": 10.0, "waiting_clients": 0,
+                                     "writer_reachable": True, "age": 0})
+
+
+def test_status_is_served_from_the_snapshot_without_touching_pgpool(pgpool, writer, clock, tmp_path):
+    health = monitor(pgpool, writer, clock, tmp_path)
+    health.refresh()
+    commands, connections = len(pgpool.commands), writer.connections
+
+    for _ in range(100):
+        assert health.status()[0] == 200
+
+    assert (len(pgpool.commands), writer.connections) == (commands, connections)
+
+
+def test_probes_over_http_answer_from_the_snapshot(pgpool, writer, clock, tmp_path):
+    health = monitor(pgpool, writer, clock, tmp_path)
+    health.refresh()
+    commands = len(pgpool.commands)
+    pgpool.down = True
+    server = health_server(health, port=0, host="127.0.0.1")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/", timeout=5) as response:
+            body = json.loads(response.read())
+        assert (response.status, body["state"]) == (200, HEALTHY)
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/readonly", timeout=5)
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # The probes neither ran PCP nor noticed that pgpool went down after the last refresh
+    assert len(pgpool.commands) == commands
+
+
+@pytest.mark.parametrize("busy, idle, waiting", [(19, 1, 0), (20, 0, 0), (5, 15, 3)])
+def test_saturated_pool_turns_unhealthy(writer, clock, tmp_path, busy, idle, waiting):
+    health = monitor(FakePgpool(busy=busy, idle=idle, waiting=waiting), writer, clock, tmp_path)
+
+    health.refresh()
+
+    code, body = health.status()
+    assert (code, body["state"]) == (503, SATURATED)
+    assert body["waiting_clients"] == waiting
+
+
+def test_saturation_is_measured_against_num_init_children(writer, clock, tmp_path):
+    # Dynamic process management: 10 forked children all busy, but 40 more may be forked
+    health = monitor(FakePgpool(busy=10, idle=0), writer, clock, tmp_path, max_children=50)
+
+    assert health.refresh()["state"] == HEALTHY
+
+
+def test_unreachable_writer_and_stopped_pgpool(pgpool, writer, clock, tmp_path):
+    health = monitor(pgpool, writer, clock, tmp_path)
+
+    writer.reachable = False
+    assert health.refresh()["state"] == WRITER_UNREACHABLE
+    pgpool.down = True
+    snapshot = health.refresh()
+    assert snapshot["state"] == PGPOOL_DOWN
+    assert "connection to socket failed" in snapshot["error"]
+    assert health.status()[0] == 503
+
+
+def test_draining_host_skips_pgpool(pgpool, writer, clock, tmp_path):
+    (tmp_path / "draining").touch()
+    health = monitor(pgpool, writer, clock, tmp_path)
+
+    assert health.refresh()["state"] == DRAINING
+    assert pgpool.commands == []
+    assert health.status()[0] == 503
+
+
+def test_stale_snapshot_fails(pgpool, writer, clock, tmp_path):
+    health = monitor(pgpool, writer, clock, tmp_path, refresh_interval=2)
+    assert health.status() == (503, {"state": STALE})
+    health.refresh()
+
+    clock.sleep(16)
+    assert health.status()[0] == 200
+    clock.sleep(1)
+    code, body = health.status()
+    assert (code, body["state"], body["age"]) == (503, STALE, 17)
+
+
+def test_failing_sample_counts_as_pgpool_down(writer, clock, tmp_path):
+    def broken(args, **kwargs):
+        raise RuntimeError("boom")
+
+    health = monitor(broken, writer, clock, tmp_path)
+
+    assert health.refresh() == {"sampled_at": 0.0, "state": PGPOOL_DOWN, "error": "boom"}
+
+
+def test_reporter_marks_the_instance_unhealthy_once_pgpool_stays_down(clock):
+    autoscaling = StubAutoScaling()
+    reporter = InstanceHealthReporter(autoscaling, "i-123", unhealthy_after=60, clock=clock)
+
+    for state in (HEALTHY, SATURATED, WRITER_UNREACHABLE, DRAINING):
+        assert reporter.observe(state) is False
+    for _ in range(6):
+        reporter.observe(PGPOOL_DOWN)
+        clock.sleep(10)
+    assert autoscaling.calls == []
+    for _ in range(5):
+        reporter.observe(PGPOOL_DOWN)
+        clock.sleep(10)
+
+    # Reported on the change to unhealthy only, not on every later down observation
+    assert autoscaling.calls == [{"InstanceId": "i-123", "HealthStatus": "Unhealthy",
+                                  "ShouldRespectGracePeriod": True}]
+
+
+def test_reporter_restarts_the_timer_when_pgpool_recovers(clock):
+    autoscaling = StubAutoScaling()
+    reporter = InstanceHealthReporter(autoscaling, "i-123", unhealthy_after=60, clock=clock)
+
+    for state in [PGPOOL_DOWN] * 5 + [HEALTHY] + [PGPOOL_DOWN] * 5:
+        reporter.observe(state)
+        clock.sleep(10)
+
+    assert autoscaling.calls == []
+
+
+def test_monitor_feeds_the_reporter(pgpool, writer, clock, tmp_path):
+    autoscaling = StubAutoScaling()
+    reporter = InstanceHealthReporter(autoscaling, "i-123", unhealthy_after=4, clock=clock)
+    health = monitor(pgpool, writer, clock, tmp_path, reporter=reporter)
+    pgpool.down = True
+
+    for _ in range(4):
+        health.refresh()
+        clock.sleep(2)
+
+    assert len(autoscaling.calls) == 1
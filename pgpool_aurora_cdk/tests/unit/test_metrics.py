@@ -0,0 +1,158 @@
+import subprocess
+
+from pgpool_aurora_cdk.agents.control import PgpoolControl
+from pgpool_aurora_cdk.agents.metrics import (PoolMetricsAgent, listen_backlog, parse_listen_backlog,
+                                              parse_proc_info, pool_metrics)
+
+
+def proc_record(pid, backend_id, backend_pid, status, database="app"):
+    # One pool slot of one child as printed by pcp_proc_info --all --verbose (pgpool 4.4)
+    return (
+        f"Database                  : {database}\n"
+        "Username                  : app\n"
+        "Start time                : 2024-05-01 10:00:00 (2:30 before process restarting)\n"
+        "Client connection time    : 2024-05-01 10:00:05\n"
+        "Client disconnection time : \n"
+        "Client idle duration      : 0\n"
+        "Major                     : 3\n"
+        "Minor                     : 0\n"
+        "Counter                   : 12\n"
+        f"Backend PID               : {backend_pid}\n"
+        "Connected                 : 1\n"
+        f"PID                       : {pid}\n"
+        f"Backend ID                : {backend_id}\n"
+        f"Status                    : {status}\n"
+        "Load balance node         : 1\n"
+        "client_host               : 10.0.1.5\n"
+        "client_port               : 41234\n"
+        "statement                 : SELECT 1\n"
+    )
+
+
+# Two children with a writer and a reader connection each, and a spare child without connections
+PROC_INFO = (
+    proc_record(2001, 0, 31001, "Execute command")
+    + proc_record(2001, 1, 41001, "Execute command")
+    + proc_record(2002, 0, 31002, "Wait for connection")
+    + proc_record(2002, 1, 41002, "Wait for connection")
+    + proc_record(2003, 0, 0, "Wait for connection", database="")
+)
+
+SS_OUTPUT = """\
+LISTEN 3      128          0.0.0.0:9999       0.0.0.0:*
+LISTEN 1      128             [::]:9999          [::]:*
+"""
+
+
+class FakePgpool:
+    # subprocess.run stand-in for pcp_proc_info and ss
+    def __init__(self, proc_info=PROC_INFO, ss=SS_OUTPUT):
+        self.proc_info = proc_info
+        self.ss = ss
+        self.commands = []
+
+    def __call__(self, args, **kwargs):
+        command = args[0].rsplit("/", 1)[-1]
+        self.commands.append(list(args))
+        if command == "pcp_proc_info":
+            return subprocess.CompletedProcess(args, 0, self.proc_info, "")
+        if command == "ss":
+            return subprocess.CompletedProcess(args, 0, self.ss, "")
+        raise AssertionError(f"unexpected command {args}")
+
+
+class StubCloudWatch:
+    def __init__(self):
+        self.calls = []
+
+    def put_metric_data(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+def agent(pgpool, cloudwatch, **kwargs):
+    return PoolMetricsAgent(PgpoolControl(run=pgpool), cloudwatch, "pgpool-fleet", run_command=pgpool, **kwargs)
+
+
+def test_parse_proc_info_splits_the_records():
+    records = parse_proc_info(PROC_INFO)
+
+    assert len(records) == 5
+    assert [(r["PID"], r["Backend ID"], r["Status"]) for r in records[:2]] == [
+        ("2001", "0", "Execute command"), ("2001", "1", "Execute command")
+    ]
+    # Values keep their own colons, empty values stay empty
+    assert records[0]["Start time"] == "2024-05-01 10:00:00 (2:30 before process restarting)"
+    assert records[0]["Client disconnection time"] == ""
+    assert records[4]["Database"] == ""
+
+
+def test_parse_listen_backlog_sums_the_listening_sockets():
+    assert parse_listen_backlog(SS_OUTPUT) == 4
+    assert parse_listen_backlog("") == 0
+    assert parse_listen_backlog("State Recv-Q Send-Q Local Address:Port Peer Address:Port\n") == 0
+
+
+def test_listen_backlog_asks_ss_for_the_pgpool_port():
+    pgpool = FakePgpool()
+
+    assert listen_backlog(9999, pgpool) == 4
+    assert pgpool.commands == [["ss", "-Hltn", "sport = :9999"]]
+
+
+def test_pool_metrics_counts_children_once_and_connections_per_backend():
+    metrics = pool_metrics(parse_proc_info(PROC_INFO), 4)
+
+    assert metrics == {
+        "children": 3,
+        "busy_children": 1,
+        "busy_children_ratio": 100.0 / 3,
+        "waiting_clients": 4,
+        "backend_connections": {"0": 2, "1": 2},
+    }
+
+
+def test_pool_metrics_ratio_is_taken_against_max_children():
+    # Dynamic process management: 3 forked children out of up to 10
+    assert pool_metrics(parse_proc_info(PROC_INFO), 0, max_children=10)["busy_children_ratio"] == 10.0
+
+
+def test_publish_sends_the_fleet_series():
+    pgpool, cloudwatch = FakePgpool(), StubCloudWatch()
+
+    metrics = agent(pgpool, cloudwatch, namespace="Test").publish()
+
+    assert metrics["busy_children"] == 1
+    fleet = [{"Name": "Fleet", "Value": "pgpool-fleet"}]
+    assert cloudwatch.calls == [{"Namespace": "Test", "MetricData": [
+        {"MetricName": "BusyChildrenRatio", "Dimensions": fleet, "Value": 100.0 / 3, "Unit": "Percent"},
+        {"MetricName": "BusyChildren", "Dimensions": fleet, "Value": 1, "Unit": "Count"},
+        {"MetricName": "Children", "Dimensions": fleet, "Value": 3, "Unit": "Count"},
+        {"MetricName": "WaitingClients", "Dimensions": fleet, "Value": 4, "Unit": "Count"},
+        {"MetricName": "BackendConnections", "Dimensions": fleet + [{"Name": "Backend", "Value": "0"}],
+         "Value": 2, "Unit": "Count"},
+        {"MetricName": "BackendConnections", "Dimensions": fleet + [{"Name": "Backend", "Value": "1"}],
+         "Value": 2, "Unit": "Count"},
+    ]}]
+    assert [c[0].rsplit("/", 1)[-1] for c in pgpool.commands] == ["pcp_proc_info", "ss"]
+
+
+def test_missing_backlog_publishes_no_waiting_clients():
+    # pgpool is restarting and nothing listens on the port yet: ss prints no socket
+    cloudwatch = StubCloudWatch()
+
+    agent(FakePgpool(ss=""), cloudwatch).publish()
+
+    data = {d["MetricName"]: d["Value"] for d in cloudwatch.calls[0]["MetricData"]}
+    assert data["WaitingClients"] == 0
+    assert data["BusyChildren"] == 1
+
+
+def test_idle_pool_publishes_no_backend_series():
+    cloudwatch = StubCloudWatch()
+    idle = proc_record(2001, 0, 0, "Wait for connection", database="")
+
+    agent(FakePgpool(proc_info=idle), cloudwatch, max_children=32).publish()
+
+    data = cloudwatch.calls[0]["MetricData"]
+    assert [d["MetricName"] for d in data] == ["BusyChildrenRatio", "BusyChildren", "Children", "WaitingClients"]
+    assert data[0]["Value"] == 0.0
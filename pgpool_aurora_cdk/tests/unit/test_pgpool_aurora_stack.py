@@ -0,0 +1,777 @@
+import json
+import re
+
+import pytest
+from aws_cdk.assertions import Annotations, Match, Template
+
+from pgpool_aurora_cdk.instance_types import instance_architecture
+from pgpool_aurora_cdk.logging_profiles import DEFAULT_LOGGING_PROFILE, LOGGING_PROFILES, logging_settings
+
+
+def launch_template_data(template) -> dict:
+    (launch_template,) = template.find_resources("AWS::EC2::LaunchTemplate").values()
+    return launch_template["Properties"]["LaunchTemplateData"]
+
+
+def user_data(template) -> str:
+    # Launch template user data with every CloudFormation token replaced by "TOKEN"
+    parts = launch_template_data(template)["UserData"]["Fn::Base64"]["Fn::Join"][1]
+    return "".join(part if isinstance(part, str) else "TOKEN" for part in parts)
+
+
+def host_config(template) -> dict:
+    # /etc/pgpool-aurora/config.json as written by the user data
+    text = user_data(template)
+    start = text.index("config.json << 'EOF'\n") + len("config.json << 'EOF'\n")
+    return json.loads(text[start:text.index("\nEOF", start)])
+
+
+def instance_tags(template) -> dict:
+    for spec in launch_template_data(template)["TagSpecifications"]:
+        if spec["ResourceType"] == "instance":
+            return {tag["Key"]: tag["Value"] for tag in spec["Tags"]}
+    return {}
+
+
+# Architecture (Graviton)
+
+@pytest.mark.parametrize("architecture, instance_type", [("x86_64", "t3.medium"), ("arm64", "t4g.medium")])
+def test_default_instance_type_follows_the_ami_architecture(synth, architecture, instance_type):
+    template = synth(architecture=architecture)
+
+    data = launch_template_data(template)
+    assert data["InstanceType"] == instance_type
+    assert data["ImageId"] == "ami-0123456789abcdef0"
+    assert instance_tags(template)["Architecture"] == architecture
+
+
+@pytest.mark.parametrize("instance_type, architecture", [("c7g.xlarge", "arm64"), ("c7i.xlarge", "x86_64")])
+def test_architecture_is_derived_from_the_instance_type(synth, instance_type, architecture):
+    template = synth(instance_type=instance_type)
+
+    assert launch_template_data(template)["InstanceType"] == instance_type
+    assert instance_tags(template)["Architecture"] == architecture
+
+
+@pytest.mark.parametrize("instance_type, architecture", [("c7i.large", "arm64"), ("m7g.large", "x86_64")])
+def test_instance_type_must_match_the_ami_architecture(synth, instance_type, architecture):
+    with pytest.raises(ValueError, match=f"AMI is {architecture}"):
+        synth(instance_type=instance_type, architecture=architecture)
+
+
+def test_unknown_architecture_is_rejected(synth):
+    with pytest.raises(ValueError, match="Unsupported architecture"):
+        synth(instance_type="t3.medium", architecture="ppc64")
+
+
+@pytest.mark.parametrize("instance_type, architecture", [
+    ("t4g.medium", "arm64"),
+    ("c7gn.2xlarge", "arm64"),
+    ("m6gd.large", "arm64"),
+    ("a1.large", "arm64"),
+    ("t3.medium", "x86_64"),
+    ("m7a.large", "x86_64"),
+    ("c6in.xlarge", "x86_64"),
+])
+def test_instance_architecture(instance_type, architecture):
+    assert instance_architecture(instance_type) == architecture
+
+
+def test_asg_uses_the_launch_template(synth):
+    template = synth(architecture="arm64")
+
+    template.has_resource_properties("AWS::AutoScaling::AutoScalingGroup", {
+        "LaunchTemplate": Match.object_like({"LaunchTemplateId": Match.any_value()}),
+    })
+
+
+# Aurora reader auto scaling
+
+def test_reader_autoscaling_tracks_reader_cpu(synth):
+    template = synth(reader_autoscaling=True, db_replica_count=2, max_readers=6)
+
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "ServiceNamespace": "rds",
+        "ScalableDimension": "rds:cluster:ReadReplicaCount",
+        "MinCapacity": 2,
+        "MaxCapacity": 6,
+        "ResourceId": {"Fn::Join": ["", ["cluster:", {"Ref": Match.string_like_regexp("AuroraPostgreSQLCluster")}]]},
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "PolicyType": "TargetTrackingScaling",
+        "TargetTrackingScalingPolicyConfiguration": {
+            "PredefinedMetricSpecification": {"PredefinedMetricType": "RDSReaderAverageCPUUtilization"},
+            "TargetValue": 70,
+            "ScaleOutCooldown": 300,
+            "ScaleInCooldown": 900,
+        },
+    })
+
+
+def test_reader_autoscaling_on_connections_with_a_custom_target(synth):
+    template = synth(reader_autoscaling=True, reader_scaling_metric="connections", reader_scaling_target=300,
+                     min_readers=1)
+
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "MinCapacity": 1,
+        "MaxCapacity": 4,
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "TargetTrackingScalingPolicyConfiguration": Match.object_like({
+            "PredefinedMetricSpecification": {"PredefinedMetricType": "RDSReaderAverageDatabaseConnections"},
+            "TargetValue": 300,
+        }),
+    })
+
+
+def test_new_readers_reach_pgpool_through_discovery(synth):
+    template = synth(reader_autoscaling=True, discovery_interval=15)
+
+    config = host_config(template)
+    assert config["reader_backends"] == "instances"
+    assert config["discovery_interval"] == 15
+    assert "pgpool-discovery" in config["services"]
+    assert "pgpool_aurora_cdk.agents.discovery" in user_data(template)
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {"Statement": Match.array_with([Match.object_like({
+            "Action": ["rds:DescribeDBClusters", "rds:DescribeDBInstances"],
+            "Effect": "Allow",
+        })])},
+    })
+
+
+def test_reader_scaling_is_off_by_default(synth):
+    template = synth()
+
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalableTarget", 0)
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalingPolicy", 0)
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    (dict(reader_backends="endpoint"), "reader_backends='instances'"),
+    (dict(db_replica_count=0), "db_replica_count >= 1"),
+    (dict(min_readers=5, max_readers=4), "min_readers <= max_readers"),
+    (dict(reader_scaling_metric="memory"), "Unsupported reader_scaling_metric"),
+])
+def test_reader_autoscaling_validation(synth, kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        synth(reader_autoscaling=True, **kwargs)
+
+
+# Pool saturation scaling
+
+def test_scaling_policies_use_instance_warmup_instead_of_cooldown(synth):
+    template = synth(pool_metrics=True, boot_seconds=90)
+
+    policies = template.find_resources("AWS::AutoScaling::ScalingPolicy")
+    assert len(policies) == 3
+    for policy in policies.values():
+        properties = policy["Properties"]
+        assert "Cooldown" not in properties
+        assert properties["EstimatedInstanceWarmup"] == 90
+    template.has_resource_properties("AWS::AutoScaling::ScalingPolicy", {
+        "PolicyType": "TargetTrackingScaling",
+        "TargetTrackingConfiguration": Match.object_like({
+            "CustomizedMetricSpecification": Match.object_like({"MetricName": "BusyChildrenRatio"}),
+        }),
+    })
+    template.has_resource_properties("AWS::AutoScaling::ScalingPolicy", {
+        "PolicyType": "StepScaling",
+        "MetricAggregationType": "Maximum",
+        "StepAdjustments": [
+            {"MetricIntervalLowerBound": 0, "MetricIntervalUpperBound": 19, "ScalingAdjustment": 1},
+            {"MetricIntervalLowerBound": 19, "ScalingAdjustment": 2},
+        ],
+    })
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "WaitingClients",
+        "Statistic": "Maximum",
+        "Threshold": 1,
+        "ComparisonOperator": "GreaterThanOrEqualToThreshold",
+        "AlarmActions": [{"Ref": Match.string_like_regexp("WaitingClientsScaling")}],
+    })
+
+
+def test_ec2_health_check_grace_covers_the_boot(synth):
+    template = synth(boot_seconds=90)
+
+    template.has_resource_properties("AWS::AutoScaling::AutoScalingGroup", {
+        "HealthCheckType": "EC2",
+        "HealthCheckGracePeriod": 135,
+    })
+
+
+# Warm pool and connection draining
+
+def lifecycle_hooks(template) -> dict:
+    return {hook["Properties"]["LifecycleHookName"]: hook["Properties"]
+            for hook in template.find_resources("AWS::AutoScaling::LifecycleHook").values()}
+
+
+def test_warm_pool_reuse_on_scale_in_drains_returning_instances(synth):
+    template = synth(warm_pool=True, drain_timeout=600, boot_seconds=60)
+
+    template.has_resource_properties("AWS::AutoScaling::WarmPool", {
+        "InstanceReusePolicy": {"ReuseOnScaleIn": True},
+    })
+    hooks = lifecycle_hooks(template)
+    # A returning instance waits in Warmed:Pending:Wait for the whole drain
+    assert hooks["pgpool-launch"]["HeartbeatTimeout"] == 660
+    assert hooks["pgpool-launch"]["DefaultResult"] == "ABANDON"
+    assert hooks["pgpool-terminate"]["HeartbeatTimeout"] == 660
+    config = host_config(template)
+    assert "pgpool-drain" in config["services"]
+    assert config["drain"]["lifecycle_hook"] == "pgpool-terminate"
+    assert config["lifecycle_hook"] == "pgpool-launch"
+
+
+def test_warm_pool_reuse_drains_without_a_termination_hook(synth):
+    template = synth(warm_pool=True, drain_timeout=0)
+
+    assert set(lifecycle_hooks(template)) == {"pgpool-launch"}
+    config = host_config(template)
+    assert "pgpool-drain" in config["services"]
+    assert config["drain"].get("lifecycle_hook") is None
+
+
+def test_launch_hook_follows_the_boot_time_without_reuse(synth):
+    template = synth(warm_pool=True, warm_pool_reuse_on_scale_in=False, drain_timeout=600, boot_seconds=60)
+
+    # max(60, 60 * 1.5) + 120
+    assert lifecycle_hooks(template)["pgpool-launch"]["HeartbeatTimeout"] == 210
+
+
+def test_no_drain_agent_without_drain_or_reuse(synth):
+    template = synth(drain_timeout=0)
+
+    assert lifecycle_hooks(template) == {}
+    config = host_config(template)
+    assert "pgpool-drain" not in config["services"]
+    assert config.get("drain") is None
+
+
+# Scheduled and predictive scaling
+
+MORNING = {"name": "morning", "cron": "0 7 * * MON-FRI", "min_capacity": 4, "time_zone": "Asia/Shanghai"}
+
+
+def test_scaling_schedules_become_scheduled_actions(synth):
+    night = {"name": "night", "cron": "0 22 * * *", "min_capacity": 2, "desired_capacity": 2}
+    template = synth(scaling_schedules=[MORNING, night])
+
+    template.resource_count_is("AWS::AutoScaling::ScheduledAction", 2)
+    template.has_resource_properties("AWS::AutoScaling::ScheduledAction", {
+        "Recurrence": "0 7 * * MON-FRI",
+        "TimeZone": "Asia/Shanghai",
+        "MinSize": 4,
+        "MaxSize": Match.absent(),
+        "DesiredCapacity": Match.absent(),
+    })
+    template.has_resource_properties("AWS::AutoScaling::ScheduledAction", {
+        "Recurrence": "0 22 * * *",
+        "TimeZone": Match.absent(),
+        "MinSize": 2,
+        "DesiredCapacity": 2,
+    })
+
+
+def test_scheduled_capacity_above_max_capacity_sizes_pgpool_for_the_larger_fleet(synth):
+    baseline = host_config(synth(max_capacity=4))["pgpool_settings"]
+    scheduled = host_config(synth(max_capacity=4, scaling_schedules=[
+        {"name": "peak", "cron": "0 8 * * *", "max_capacity": 16, "min_capacity": 8}
+    ]))["pgpool_settings"]
+
+    assert (scheduled["num_init_children"] * scheduled["max_pool"]
+            < baseline["num_init_children"] * baseline["max_pool"])
+
+
+def test_predictive_scaling_on_cpu(synth):
+    template = synth(predictive_scaling=True, boot_seconds=90)
+
+    template.has_resource_properties("AWS::AutoScaling::ScalingPolicy", {
+        "PolicyType": "PredictiveScaling",
+        "PredictiveScalingConfiguration": {
+            "Mode": "ForecastAndScale",
+            # Defaults to the boot time
+            "SchedulingBufferTime": 90,
+            "MetricSpecifications": [{
+                "TargetValue": 70,
+                "PredefinedMetricPairSpecification": {"PredefinedMetricType": "ASGCPUUtilization"},
+            }],
+        },
+    })
+
+
+def test_predictive_scaling_on_pool_saturation(synth):
+    template = synth(predictive_scaling=True, predictive_scaling_metric="pool", pool_metrics=True,
+                     predictive_scaling_mode="ForecastOnly", predictive_scaling_buffer=300)
+
+    def query(query_id, metric_name, stat):
+        return [Match.object_like({
+            "Id": query_id,
+            "ReturnData": True,
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": "PgpoolAurora",
+                    "MetricName": metric_name,
+                    "Dimensions": [{"Name": "Fleet", "Value": "PgpoolAuroraStack"}],
+                },
+                "Stat": stat,
+            },
+        })]
+
+    template.has_resource_properties("AWS::AutoScaling::ScalingPolicy", {
+        "PolicyType": "PredictiveScaling",
+        "PredictiveScalingConfiguration": {
+            "Mode": "ForecastOnly",
+            "SchedulingBufferTime": 300,
+            "MetricSpecifications": [Match.object_like({
+                "CustomizedScalingMetricSpecification": {
+                    "MetricDataQueries": query("scaling", "BusyChildrenRatio", "Average"),
+                },
+                "CustomizedLoadMetricSpecification": {
+                    "MetricDataQueries": query("load", "BusyChildren", "Sum"),
+                },
+            })],
+        },
+    })
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    (dict(scaling_schedules=[{"name": "peak", "min_capacity": 4}]), "name and a cron expression"),
+    (dict(scaling_schedules=[{"name": "peak", "cron": "0 8 * * *"}]), "sets none of"),
+    (dict(predictive_scaling=True, predictive_scaling_mode="ScaleOnly"), "Unsupported predictive_scaling_mode"),
+    (dict(predictive_scaling=True, predictive_scaling_metric="memory"), "Unsupported predictive_scaling_metric"),
+    (dict(predictive_scaling=True, predictive_scaling_metric="pool", pool_metrics=False), "requires pool_metrics"),
+    (dict(predictive_scaling=True, predictive_scaling_buffer=3601), "predictive_scaling_buffer"),
+])
+def test_scaling_schedule_and_forecast_validation(synth, kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        synth(**kwargs)
+
+
+# Client and backend TLS
+
+TLS_SECRET_ARN = "arn:aws:secretsmanager:us-east-1:123456789012:secret:pgpool-tls-AbCdEf"
+
+
+def test_listeners_are_plain_tcp_without_nlb_certificates(synth):
+    template = synth(client_tls=True, readonly_listener=True)
+
+    listeners = template.find_resources("AWS::ElasticLoadBalancingV2::Listener")
+    assert len(listeners) == 2
+    for listener in listeners.values():
+        properties = listener["Properties"]
+        assert properties["Protocol"] == "TCP"
+        assert "Certificates" not in properties
+        assert "SslPolicy" not in properties
+        assert "AlpnPolicy" not in properties
+
+
+def test_client_tls_is_terminated_by_pgpool(synth):
+    template = synth(client_tls=True, tls_certificate_secret_arn=TLS_SECRET_ARN, tls_min_protocol_version="TLSv1.3")
+
+    config = host_config(template)
+    settings = config["pgpool_settings"]
+    assert settings["ssl"] is True
+    assert settings["ssl_cert"] == "/usr/local/etc/server.crt"
+    assert settings["ssl_key"] == "/usr/local/etc/server.key"
+    assert settings["ssl_min_protocol_version"] == "TLSv1.3"
+    assert config["tls"] == {"certificate_secret_arn": TLS_SECRET_ARN}
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {"Statement": Match.array_with([Match.object_like({
+            "Action": ["secretsmanager:GetSecretValue", "secretsmanager:DescribeSecret"],
+            "Resource": TLS_SECRET_ARN,
+        })])},
+    })
+
+
+USER_SECRET_ARN = "arn:aws:secretsmanager:us-east-1:123456789012:secret:app-user-AbCdEf"
+
+
+def test_client_tls_rejects_plaintext_clients(synth):
+    template = synth(client_tls=True, client_user_secret_arns=[USER_SECRET_ARN])
+
+    config = host_config(template)
+    settings = config["pgpool_settings"]
+    # Clear-text pass-through would need pool_hba off, and pool_hba off accepts plaintext clients
+    assert settings["allow_clear_text_frontend_auth"] is False
+    assert settings["enable_pool_hba"] is True
+    assert settings["pool_passwd"] == "pool_passwd"
+    # The stack's own user plus the given ones, readable by the pgpool instances
+    assert config["client_auth"]["user_secret_arns"] == ["TOKEN", USER_SECRET_ARN]
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {"Statement": Match.array_with([Match.object_like({
+            "Action": ["secretsmanager:GetSecretValue", "secretsmanager:DescribeSecret"],
+            "Resource": USER_SECRET_ARN,
+        })])},
+    })
+
+
+def test_clients_authenticate_against_aurora_without_client_tls(synth):
+    config = host_config(synth(backend_tls=True))
+
+    assert config["pgpool_settings"]["allow_clear_text_frontend_auth"] is True
+    assert "enable_pool_hba" not in config["pgpool_settings"]
+    assert config.get("client_auth") is None
+
+
+def test_client_tls_without_a_secret_uses_a_self_signed_certificate(synth):
+    config = host_config(synth(client_tls=True))
+
+    assert config["pgpool_settings"]["ssl"] is True
+    assert config["pgpool_settings"]["ssl_min_protocol_version"] == "TLSv1.2"
+    assert config.get("tls") is None
+
+
+def test_backend_tls_is_enforced_by_aurora(synth):
+    template = synth(backend_tls=True)
+
+    settings = host_config(template)["pgpool_settings"]
+    assert settings["ssl"] is True
+    assert "ssl_min_protocol_version" not in settings
+    template.has_resource_properties("AWS::RDS::DBClusterParameterGroup", {
+        "Parameters": Match.object_like({"rds.force_ssl": "1"}),
+    })
+
+
+def test_tls_is_off_by_default(synth):
+    settings = host_config(synth())["pgpool_settings"]
+
+    assert "ssl" not in settings
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    (dict(tls_certificate_secret_arn=TLS_SECRET_ARN), "requires client_tls"),
+    (dict(client_user_secret_arns=[USER_SECRET_ARN]), "requires client_tls"),
+    (dict(client_tls=True, tls_min_protocol_version="TLSv1.1"), "Unsupported tls_min_protocol_version"),
+])
+def test_tls_validation(synth, kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        synth(**kwargs)
+
+
+# Aurora instance classes
+
+def db_instances(template) -> list:
+    return [instance["Properties"] for instance in template.find_resources("AWS::RDS::DBInstance").values()]
+
+
+@pytest.mark.parametrize("db_instance_class", [
+    "db.t3.medium",
+    "db.t4g.large",
+    "db.r5.large",
+    "db.r6g.xlarge",
+    "db.r6i.large",
+    "db.r7g.2xlarge",
+    "db.r7i.4xlarge",
+    "db.x2g.large",
+])
+def test_provisioned_instance_class_is_deployed_as_given(synth, db_instance_class):
+    instances = db_instances(synth(db_instance_class=db_instance_class, db_replica_count=2))
+
+    # Writer and both readers
+    assert [instance["DBInstanceClass"] for instance in instances] == [db_instance_class] * 3
+
+
+def test_serverless_v2_instances_and_capacity(synth):
+    template = synth(db_instance_class="db.serverless", serverless_min_acu=1, serverless_max_acu=32.5,
+                     db_replica_count=1)
+
+    assert [instance["DBInstanceClass"] for instance in db_instances(template)] == ["db.serverless"] * 2
+    template.has_resource_properties("AWS::RDS::DBCluster", {
+        "ServerlessV2ScalingConfiguration": {"MinCapacity": 1, "MaxCapacity": 32.5},
+    })
+
+
+def test_provisioned_cluster_has_no_serverless_scaling(synth):
+    template = synth(db_instance_class="db.r6g.large")
+
+    template.has_resource_properties("AWS::RDS::DBCluster", {
+        "ServerlessV2ScalingConfiguration": Match.absent(),
+    })
+
+
+@pytest.mark.parametrize("db_instance_class, message", [
+    ("db.r7g.huge", "db.r7g comes in"),
+    ("db.z9.large", "Unsupported Aurora instance class"),
+    ("r6g.large", "Unsupported Aurora instance class"),
+    ("db.t3", "db.t3 comes in"),
+])
+def test_unknown_instance_class_is_rejected(synth, db_instance_class, message):
+    with pytest.raises(ValueError, match=message):
+        synth(db_instance_class=db_instance_class)
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(serverless_min_acu=0.25),
+    dict(serverless_min_acu=8, serverless_max_acu=4),
+    dict(serverless_max_acu=300),
+    dict(serverless_max_acu=16.3),
+])
+def test_serverless_capacity_validation(synth, kwargs):
+    with pytest.raises(ValueError, match="Serverless v2"):
+        synth(db_instance_class="db.serverless", **kwargs)
+
+
+# Availability zone affinity
+
+def nlb_attributes(template) -> dict:
+    (nlb,) = template.find_resources("AWS::ElasticLoadBalancingV2::LoadBalancer").values()
+    return {a["Key"]: a["Value"] for a in nlb["Properties"]["LoadBalancerAttributes"]}
+
+
+def test_az_affinity_keeps_clients_and_reads_in_their_zone(synth):
+    template = synth(az_affinity=True, remote_reader_weight=3)
+
+    attributes = nlb_attributes(template)
+    assert attributes["load_balancing.cross_zone.enabled"] == "false"
+    assert attributes["dns_record.client_routing_policy"] == "availability_zone_affinity"
+    config = host_config(template)
+    assert config["az_affinity"] == {"remote_reader_weight": 3}
+    assert config["reader_backends"] == "instances"
+
+
+def test_nlb_is_cross_zone_without_az_affinity(synth):
+    template = synth()
+
+    attributes = nlb_attributes(template)
+    assert attributes["load_balancing.cross_zone.enabled"] == "true"
+    assert "dns_record.client_routing_policy" not in attributes
+    assert host_config(template).get("az_affinity") is None
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    (dict(reader_backends="endpoint"), "az_affinity requires reader_backends='instances'"),
+    (dict(remote_reader_weight=11), "remote_reader_weight must be between 0 and reader_weight"),
+    (dict(remote_reader_weight=-1), "remote_reader_weight must be between 0 and reader_weight"),
+])
+def test_az_affinity_validation(synth, kwargs, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        synth(az_affinity=True, **kwargs)
+
+
+# Read-only listener
+
+def listeners_by_port(template) -> dict:
+    return {listener["Properties"]["Port"]: listener["Properties"]
+            for listener in template.find_resources("AWS::ElasticLoadBalancingV2::Listener").values()}
+
+
+def target_groups(template) -> dict:
+    return {logical_id: group["Properties"]
+            for logical_id, group in template.find_resources("AWS::ElasticLoadBalancingV2::TargetGroup").items()}
+
+
+def test_readonly_listener_adds_a_listener_and_target_group(synth):
+    template = synth(readonly_listener=True, readonly_listener_port=6432)
+
+    listeners = listeners_by_port(template)
+    assert sorted(listeners) == [5432, 6432]
+    groups = target_groups(template)
+    (readonly_group,) = [logical_id for logical_id, group in groups.items() if group["Port"] == 9998]
+    (main_group,) = [logical_id for logical_id, group in groups.items() if group["Port"] == 9999]
+    assert groups[readonly_group]["Protocol"] == "TCP"
+    assert groups[readonly_group]["HealthCheckPath"] == "/readonly"
+    assert groups[readonly_group]["HealthCheckPort"] == "8071"
+    assert groups[main_group]["HealthCheckPath"] == "/"
+    assert listeners[6432]["Protocol"] == "TCP"
+    assert listeners[6432]["DefaultActions"] == [{"Type": "forward", "TargetGroupArn": {"Ref": readonly_group}}]
+    assert listeners[5432]["DefaultActions"] == [{"Type": "forward", "TargetGroupArn": {"Ref": main_group}}]
+    # Both target groups register the pgpool instances
+    template.has_resource_properties("AWS::AutoScaling::AutoScalingGroup", {
+        "TargetGroupARNs": Match.array_with([{"Ref": main_group}, {"Ref": readonly_group}]),
+    })
+    template.has_resource_properties("AWS::EC2::SecurityGroupIngress", {
+        "FromPort": 9998, "ToPort": 9998, "IpProtocol": "tcp",
+    })
+    assert template.find_outputs("NLBReadOnlyPort")["NLBReadOnlyPort"]["Value"] == "6432"
+    config = host_config(template)
+    assert "pgpool-readonly" in config["services"]
+    assert config["readonly"]["pgpool_settings"]["num_init_children"] >= 8
+
+
+def test_no_readonly_listener_by_default(synth):
+    template = synth()
+
+    assert sorted(listeners_by_port(template)) == [5432]
+    assert [group["Port"] for group in target_groups(template).values()] == [9999]
+    assert template.find_outputs("NLBReadOnlyPort") == {}
+    assert host_config(template).get("readonly") is None
+
+
+def test_readonly_listener_with_az_affinity(synth):
+    # The read-only pgpool shares the per-reader backends, and their zone-local weights
+    config = host_config(synth(readonly_listener=True, az_affinity=True))
+
+    assert config["readonly"] is not None
+    assert config["az_affinity"]["remote_reader_weight"] >= 0
+
+
+def test_readonly_listener_requires_readers(synth):
+    # Without readers the reader endpoint resolves to the writer
+    with pytest.raises(ValueError, match="readonly_listener requires db_replica_count"):
+        synth(readonly_listener=True, db_replica_count=0)
+
+
+# Logging
+
+def cloudwatch_agent_config(template) -> dict:
+    # CloudWatch agent configuration as written by the user data
+    text = user_data(template)
+    start = text.index("pgpool-logs.json << 'EOF'\n") + len("pgpool-logs.json << 'EOF'\n")
+    return json.loads(text[start:text.index("\nEOF", start)])
+
+
+def test_cloudwatch_agent_ships_the_pgpool_logs_to_the_log_group(synth):
+    template = synth()
+
+    (collect,) = cloudwatch_agent_config(template)["logs"]["logs_collected"]["files"]["collect_list"]
+    assert collect["file_path"] == "/var/log/pgpool/pgpool-*.log"
+    assert collect["log_stream_name"] == "{instance_id}"
+    # The log group name is the only token in the agent configuration
+    assert collect["log_group_name"] == "TOKEN"
+    (log_group_id,) = template.find_resources("AWS::Logs::LogGroup")
+    assert {"Ref": log_group_id} in launch_template_data(template)["UserData"]["Fn::Base64"]["Fn::Join"][1]
+    assert "amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s" in user_data(template)
+    assert template.find_outputs("PgpoolLogGroupName")["PgpoolLogGroupName"]["Value"] == {"Ref": log_group_id}
+
+
+@pytest.mark.parametrize("kwargs, retention", [({}, 30), (dict(log_retention_days=7), 7)])
+def test_log_group_retention(synth, kwargs, retention):
+    synth(**kwargs).has_resource_properties("AWS::Logs::LogGroup", {"RetentionInDays": retention})
+
+
+def test_production_logging_profile_by_default(synth):
+    settings = host_config(synth())["pgpool_settings"]
+
+    assert DEFAULT_LOGGING_PROFILE == "production"
+    assert {key: settings[key] for key in LOGGING_PROFILES["production"]} == logging_settings("production")
+
+
+@pytest.mark.parametrize("logging_profile", sorted(LOGGING_PROFILES))
+def test_logging_profile_is_rendered_into_the_pgpool_settings(synth, logging_profile):
+    settings = host_config(synth(logging_profile=logging_profile))["pgpool_settings"]
+
+    assert {key: settings[key] for key in LOGGING_PROFILES[logging_profile]} == logging_settings(logging_profile)
+    # Only the debug profile logs every statement
+    assert settings["log_statement"] is (logging_profile == "debug")
+    assert settings["log_per_node_statement"] is (logging_profile == "debug")
+
+
+def test_slow_and_sampled_statements_are_logged_by_aurora(synth):
+    template = synth(slow_statement_ms=500, statement_sample_rate=0.01)
+
+    template.has_resource_properties("AWS::RDS::DBClusterParameterGroup", {
+        "Parameters": {
+            "log_min_duration_statement": "500",
+            "log_min_duration_sample": "0",
+            "log_statement_sample_rate": "0.01",
+        },
+    })
+    template.has_resource_properties("AWS::RDS::DBCluster", {
+        "EnableCloudwatchLogsExports": ["postgresql"],
+    })
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    (dict(logging_profile="verbose"), "Unknown logging profile 'verbose'"),
+    (dict(log_retention_days=10), "Unsupported log_retention_days 10"),
+    (dict(slow_statement_ms=-1), "slow_statement_ms must not be negative"),
+    (dict(statement_sample_rate=0), "statement_sample_rate must be greater than 0"),
+    (dict(statement_sample_rate=1.5), "statement_sample_rate must be greater than 0"),
+])
+def test_logging_validation(synth, kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        synth(**kwargs)
+
+
+# Shared query cache
+
+def security_group_id(template, description) -> str:
+    (logical_id,) = template.find_resources("AWS::EC2::SecurityGroup", {
+        "Properties": {"GroupDescription": description},
+    })
+    return logical_id
+
+
+def test_query_cache_is_one_memcached_node_reachable_from_pgpool_only(synth):
+    template = synth(query_cache=True, query_cache_node_type="cache.r7g.large")
+
+    cache_sg = security_group_id(template, "Security group for the pgpool query cache (memcached)")
+    template.resource_count_is("AWS::ElastiCache::CacheCluster", 1)
+    template.has_resource_properties("AWS::ElastiCache::CacheCluster", {
+        "Engine": "memcached",
+        "CacheNodeType": "cache.r7g.large",
+        "NumCacheNodes": 1,
+        "Port": 11211,
+        "VpcSecurityGroupIds": [{"Fn::GetAtt": [cache_sg, "GroupId"]}],
+    })
+    ingress = template.find_resources("AWS::EC2::SecurityGroupIngress", {
+        "Properties": {"GroupId": {"Fn::GetAtt": [cache_sg, "GroupId"]}},
+    })
+    (rule,) = [resource["Properties"] for resource in ingress.values()]
+    assert (rule["IpProtocol"], rule["FromPort"], rule["ToPort"]) == ("tcp", 11211, 11211)
+    assert rule["SourceSecurityGroupId"] == {
+        "Fn::GetAtt": [security_group_id(template, "Security group for Pgpool instances"), "GroupId"],
+    }
+
+
+def test_query_cache_settings_reach_the_instances(synth):
+    template = synth(query_cache=True, query_cache_ttl=30, query_cache_auto_invalidation=False,
+                     query_cache_tables=["app.prices"], query_cache_exclude_tables=["app.orders"])
+
+    assert host_config(template)["query_cache"] == {
+        "host": "TOKEN",
+        "port": 11211,
+        "ttl": 30,
+        "auto_invalidation": False,
+        "include_tables": ["app.prices"],
+        "exclude_tables": ["app.orders"],
+    }
+    # The host is the node's endpoint, resolved by CloudFormation
+    (cache_id,) = template.find_resources("AWS::ElastiCache::CacheCluster")
+    assert f'"Fn::GetAtt": ["{cache_id}", "ConfigurationEndpoint.Address"]' in json.dumps(
+        launch_template_data(template)["UserData"])
+
+
+def test_no_query_cache_by_default(synth):
+    template = synth()
+
+    template.resource_count_is("AWS::ElastiCache::CacheCluster", 0)
+    assert host_config(template).get("query_cache") is None
+
+
+# Connection capacity
+
+def connection_capacity(template) -> dict:
+    return json.loads(template.find_outputs("ConnectionCapacity")["ConnectionCapacity"]["Value"])
+
+
+def test_pinned_pool_settings_are_rendered_and_reported(synth):
+    template = synth(db_instance_class="db.r6g.large", pgpool_num_init_children=48, pgpool_max_pool=2)
+
+    settings = host_config(template)["pgpool_settings"]
+    assert (settings["num_init_children"], settings["max_pool"]) == (48, 2)
+    report = connection_capacity(template)
+    assert report["connections_per_node"] == 4 * 48 * 2
+    assert report["headroom_per_node"] > 0
+
+
+def test_oversubscribed_pinned_pool_is_a_synth_warning(build_stack):
+    stack = build_stack(db_instance_class="db.r6g.large", max_capacity=10, pgpool_max_pool=4)
+
+    Annotations.from_stack(stack).has_warning(
+        "/PgpoolAuroraStack", Match.string_like_regexp("open up to 2560 connections per Aurora instance"))
+    assert connection_capacity(Template.from_stack(stack))["headroom_per_node"] < 0
+
+
+def test_oversubscribed_pinned_pool_fails_a_strict_synth(synth):
+    with pytest.raises(ValueError, match="open up to 2560 connections per Aurora instance"):
+        synth(db_instance_class="db.r6g.large", max_capacity=10, pgpool_max_pool=4, capacity_check="strict")
+
+
+@pytest.mark.parametrize("kwargs", [dict(pgpool_num_init_children=0), dict(pgpool_max_pool=-1)])
+def test_pinned_pool_settings_must_be_positive(synth, kwargs):
+    with pytest.raises(ValueError, match="must be a positive integer"):
+        synth(**kwargs)
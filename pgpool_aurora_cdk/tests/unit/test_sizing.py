@@ -0,0 +1,84 @@
+import pytest
+
+from pgpool_aurora_cdk.sizing import (aurora_max_connections, capacity_report, check_capacity,
+                                      peak_pgpool_instances, pgpool_sizing)
+
+INSTANCE_TYPE = "t3.medium"
+
+
+def capacity(db_instance_class, max_capacity, **pinned):
+    settings = pgpool_sizing(INSTANCE_TYPE, db_instance_class, max_capacity, **pinned)
+    return capacity_report(settings, max_capacity, aurora_max_connections(db_instance_class))
+
+
+def outcome(report, strict):
+    # "ok", "warn", or the check that failed: "overrun" at the maximum size, "rebalance" during the surge
+    try:
+        warnings = check_capacity(report, strict=strict)
+    except ValueError as e:
+        return "rebalance" if "rebalances" in str(e) else "overrun"
+    return "warn" if warnings else "ok"
+
+
+@pytest.mark.parametrize("strict", [False, True])
+@pytest.mark.parametrize("db_instance_class, max_capacity, expected", [
+    # db.t3.medium leaves 385 usable connections: 2 x 64 x 3 = 384 fit, the third host of the surge does not
+    ("db.t3.medium", 2, "rebalance"),
+    ("db.t3.medium", 4, "ok"),
+    ("db.t3.medium", 10, "rebalance"),
+    ("db.r6g.large", 2, "ok"),
+    ("db.r6g.large", 4, "ok"),
+    ("db.r6g.large", 10, "ok"),
+    ("db.r6g.4xlarge", 2, "ok"),
+    ("db.r6g.4xlarge", 10, "ok"),
+])
+def test_computed_settings_matrix(db_instance_class, max_capacity, strict, expected):
+    report = capacity(db_instance_class, max_capacity)
+
+    # Computed settings never oversubscribe the fleet at its maximum size
+    assert report["headroom_per_node"] >= 0
+    assert report["connections_per_node"] == max_capacity * report["num_init_children"] * report["max_pool"]
+    assert report["rebalance_instances"] == peak_pgpool_instances(max_capacity)
+    if expected == "rebalance":
+        assert outcome(report, strict) == ("rebalance" if strict else "warn")
+    else:
+        assert outcome(report, strict) == expected
+
+
+@pytest.mark.parametrize("strict", [False, True])
+@pytest.mark.parametrize("db_instance_class, max_capacity, pinned, expected", [
+    # db.r6g.large leaves 1541 usable connections; 10 x 64 x 4 = 2560 do not fit
+    ("db.r6g.large", 10, dict(max_pool=4), "overrun"),
+    ("db.t3.medium", 4, dict(num_init_children=64, max_pool=2), "overrun"),
+    # 5 x 256 = 1280 during the surge
+    ("db.r6g.large", 4, dict(max_pool=4), "ok"),
+    # 6 x 256 = 1536 still fit during the surge, 7 x 256 = 1792 do not
+    ("db.r6g.large", 5, dict(num_init_children=64, max_pool=4), "ok"),
+    ("db.r6g.large", 6, dict(num_init_children=64, max_pool=4), "rebalance"),
+])
+def test_pinned_settings_matrix(db_instance_class, max_capacity, pinned, strict, expected):
+    report = capacity(db_instance_class, max_capacity, **pinned)
+
+    for key, value in pinned.items():
+        assert report[key] == value
+    if expected == "overrun":
+        assert report["headroom_per_node"] < 0
+        assert outcome(report, strict) == ("overrun" if strict else "warn")
+    elif expected == "rebalance":
+        assert outcome(report, strict) == ("rebalance" if strict else "warn")
+    else:
+        assert outcome(report, strict) == expected
+
+
+def test_overrun_message_names_the_fan_out():
+    report = capacity("db.t3.medium", 4, num_init_children=64, max_pool=2)
+
+    with pytest.raises(ValueError, match=r"4 pgpool instances x 64 children x max_pool 2 open up to 512"):
+        check_capacity(report, strict=True)
+    (warning,) = check_capacity(report)
+    assert warning.startswith("4 pgpool instances x 64 children x max_pool 2 open up to 512")
+
+
+def test_pinned_children_below_the_minimum_are_rejected():
+    with pytest.raises(ValueError, match="at least 8 are needed"):
+        pgpool_sizing(INSTANCE_TYPE, "db.r6g.large", 4, num_init_children=4)
@@ -0,0 +1,228 @@
+import json
+import subprocess
+
+import pytest
+
+from pgpool_aurora_cdk.agents.control import PgpoolControl
+from pgpool_aurora_cdk.agents.pgpool_conf import parse_backends, read_conf
+from pgpool_aurora_cdk.agents.weights import (MIN_WEIGHT_CHANGE, AuroraLoadSource, LoadSourceError,
+                                              WeightController, load_factor, parse_replica_status,
+                                              weight_value)
+
+PGPOOL_CONF = """\
+backend_hostname0 = 'writer.cluster'
+backend_weight0 = 1
+backend_hostname1 = 'reader-1.cluster'
+backend_weight1 = 10
+backend_hostname2 = 'reader-2.cluster'
+backend_weight2 = 10
+"""
+
+READERS = {"reader-1.cluster": 10, "reader-2.cluster": 10}
+
+
+class FakeLoad:
+    # Load source returning a fixed Aurora sample; instances maps instance ids to cpu/connections/lag_ms
+    def __init__(self, **instances):
+        self.instances = instances
+        self.requests = []
+
+    def sample(self, reader_ids):
+        self.requests.append(list(reader_ids))
+        return {"writer": "writer", "instances": {k: dict(v) for k, v in self.instances.items()}}
+
+
+class FakePgpool:
+    def __init__(self):
+        self.commands = []
+
+    def __call__(self, args, **kwargs):
+        self.commands.append(list(args))
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+
+@pytest.fixture
+def pgpool_conf(tmp_path):
+    path = tmp_path / "pgpool.conf"
+    path.write_text(PGPOOL_CONF)
+    return str(path)
+
+
+def controller(source, pgpool_conf, pgpool=None, **kwargs):
+    return WeightController(source, PgpoolControl(run=pgpool or FakePgpool()), lambda: dict(READERS),
+                            pgpool_conf=pgpool_conf, **kwargs)
+
+
+def applied_weights(pgpool_conf):
+    return {index: b["weight"] for index, b in parse_backends(read_conf(pgpool_conf)).items()}
+
+
+# Target computation
+
+def test_load_factor_is_linear_between_target_and_limit():
+    assert load_factor(None, 70, 95, 0.2) == 1.0
+    assert load_factor(70, 70, 95, 0.2) == 1.0
+    assert load_factor(82.5, 70, 95, 0.2) == pytest.approx(0.6)
+    assert load_factor(99, 70, 95, 0.2) == 0.2
+
+
+def test_targets_move_the_shed_weight_to_the_writer(pgpool_conf):
+    source = FakeLoad(**{"reader-1": {"cpu": 95}, "reader-2": {"cpu": 10}, "writer": {"cpu": 10}})
+    slots = {"reader-1.cluster": 1, "reader-2.cluster": 2}
+
+    targets = controller(source, pgpool_conf).targets(slots, READERS, source.sample([]))
+
+    assert targets == {1: pytest.approx(2.0), 2: 10, 0: pytest.approx(9.0)}
+
+
+def test_targets_use_the_worst_of_cpu_connections_and_lag(pgpool_conf):
+    source = FakeLoad(**{"reader-1": {"cpu": 10, "connections": 950}, "reader-2": {"lag_ms": 550},
+                         "writer": {}})
+    slots = {"reader-1.cluster": 1, "reader-2.cluster": 2}
+
+    targets = controller(source, pgpool_conf, max_connections=1000).targets(slots, READERS, source.sample([]))
+
+    assert targets[1] == pytest.approx(2.0)
+    assert targets[2] == pytest.approx(5.0)
+    assert targets[0] == pytest.approx(14.0)
+
+
+def test_hot_writer_takes_only_part_of_the_shed_weight(pgpool_conf):
+    source = FakeLoad(**{"reader-1": {"cpu": 95}, "reader-2": {"cpu": 95}, "writer": {"cpu": 95}})
+    slots = {"reader-1.cluster": 1, "reader-2.cluster": 2}
+
+    targets = controller(source, pgpool_conf).targets(slots, READERS, source.sample([]))
+
+    assert targets[0] == pytest.approx(1 + 16 * 0.2)
+
+
+# Damping and applying
+
+def test_step_moves_a_damping_fraction_towards_the_target(pgpool_conf):
+    pgpool = FakePgpool()
+    source = FakeLoad(**{"reader-1": {"cpu": 95}, "reader-2": {"cpu": 10}, "writer": {"cpu": 10}})
+    weights = controller(source, pgpool_conf, pgpool)
+
+    assert weights.step() == {"backend_weight0": 3.4, "backend_weight1": 7.6}
+    assert source.requests == [["reader-1", "reader-2"]]
+    assert pgpool.commands == [["systemctl", "reload", "pgpool"]]
+    assert weights.step() == {"backend_weight0": 5.1, "backend_weight1": 5.9}
+    assert applied_weights(pgpool_conf) == {0: "5.1", 1: "5.9", 2: "10"}
+
+
+def test_changes_below_the_minimum_are_not_applied_but_accumulate(pgpool_conf):
+    pgpool = FakePgpool()
+    # reader-1 slightly above the CPU target: its target weight is 9.36
+    source = FakeLoad(**{"reader-1": {"cpu": 72}, "reader-2": {"cpu": 10}, "writer": {"cpu": 10}})
+    weights = controller(source, pgpool_conf, pgpool)
+
+    steps = [weights.step() for _ in range(5)]
+
+    assert steps[:4] == [{}] * 4
+    assert pgpool.commands == [["systemctl", "reload", "pgpool"]]
+    assert steps[4] == {"backend_weight0": 1.5, "backend_weight1": 9.5}
+    assert 10 - weights.weights[1] >= MIN_WEIGHT_CHANGE
+
+
+def test_steady_weights_cause_no_reload(pgpool_conf):
+    pgpool = FakePgpool()
+    source = FakeLoad(**{"reader-1": {"cpu": 10}, "reader-2": {"cpu": 10}, "writer": {"cpu": 10}})
+
+    assert controller(source, pgpool_conf, pgpool).step() == {}
+    assert pgpool.commands == []
+
+
+def test_lagging_reader_drops_to_zero_at_once(pgpool_conf):
+    source = FakeLoad(**{"reader-1": {"cpu": 10}, "reader-2": {"cpu": 10, "lag_ms": 1500}, "writer": {"cpu": 10}})
+    weights = controller(source, pgpool_conf)
+
+    settings = weights.step()
+
+    assert settings["backend_weight2"] == 0
+    assert settings["backend_weight0"] == 4
+    # Once caught up the reader comes back gradually
+    source.instances["reader-2"]["lag_ms"] = 5
+    assert weights.step()["backend_weight2"] == 3
+
+
+def test_reads_shift_to_the_writer_when_every_reader_is_degraded(pgpool_conf):
+    source = FakeLoad(**{"reader-1": {"lag_ms": 2000}, "reader-2": {"lag_ms": 2000}, "writer": {"cpu": 10}})
+    weights = controller(source, pgpool_conf)
+
+    for _ in range(20):
+        weights.step()
+
+    # The writer converges on its own weight plus everything the readers shed, to within the minimum change
+    applied = applied_weights(pgpool_conf)
+    assert (applied[1], applied[2]) == ("0", "0")
+    assert 21 - MIN_WEIGHT_CHANGE <= float(applied[0]) < 21
+
+
+def test_readers_unknown_to_pgpool_are_not_sampled(pgpool_conf):
+    source = FakeLoad(**{"writer": {"cpu": 10}})
+    weights = WeightController(source, PgpoolControl(run=FakePgpool()),
+                               lambda: {"reader-2.cluster": 10, "reader-9.cluster": 10}, pgpool_conf=pgpool_conf)
+
+    weights.step()
+
+    assert source.requests == [["reader-2"]]
+
+
+@pytest.mark.parametrize("weight, value", [(3.0, 3), (3.04, 3), (7.56, 7.6), (-0.2, 0)])
+def test_weight_value(weight, value):
+    assert weight_value(weight) == value
+
+
+# Aurora load source
+
+def test_parse_replica_status():
+    text = "writer-1,MASTER_SESSION_ID,\nreader-1,1f2e3d,12.5\nreader-2,4c5b6a,\n\n,broken,1\n"
+
+    assert parse_replica_status(text) == ("writer-1", {"reader-1": 12.5, "reader-2": None})
+
+
+def test_parse_replica_status_without_a_writer():
+    assert parse_replica_status("reader-1,1f2e3d,3\n") == (None, {"reader-1": 3.0})
+
+
+class StubSecrets:
+    def __init__(self):
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        return {"SecretString": json.dumps({"username": "monitor", "password": "secret"})}
+
+
+class StubCloudWatch:
+    def get_metric_data(self, MetricDataQueries, **kwargs):
+        values = {"cpu0": [42.0, 40.0], "connections0": [120.0], "cpu1": [15.0], "connections1": []}
+        return {"MetricDataResults": [{"Id": q["Id"], "Values": values[q["Id"]]} for q in MetricDataQueries]}
+
+
+def test_aurora_load_source_combines_lag_and_cloudwatch_metrics():
+    def psql(args, **kwargs):
+        assert kwargs["env"]["PGPASSWORD"] == "secret"
+        return subprocess.CompletedProcess(args, 0, "writer-1,MASTER_SESSION_ID,\nreader-1,1f2e3d,12.5\n", "")
+
+    source = AuroraLoadSource(StubCloudWatch(), StubSecrets(), "arn:secret", "writer.cluster", run=psql,
+                              clock=lambda: 1714557600.0)
+
+    assert source.sample(["reader-1"]) == {"writer": "writer-1", "instances": {
+        "reader-1": {"cpu": 42.0, "connections": 120.0, "lag_ms": 12.5},
+        "writer-1": {"cpu": 15.0},
+    }}
+
+
+def test_aurora_load_source_fetches_the_secret_again_after_a_failure():
+    secrets = StubSecrets()
+
+    def psql(args, **kwargs):
+        return subprocess.CompletedProcess(args, 2, "", "password authentication failed")
+
+    source = AuroraLoadSource(StubCloudWatch(), secrets, "arn:secret", "writer.cluster", run=psql)
+
+    for _ in range(2):
+        with pytest.raises(LoadSourceError, match="password authentication failed"):
+            source.sample(["reader-1"])
+    assert secrets.calls == 2